@@ -0,0 +1 @@
+"""Offline benchmarks for the Selenium API server, see ``python -m benchmarks.run --help``."""
@@ -0,0 +1,580 @@
+"""An in-memory stand-in for Chrome that speaks the WebDriver command protocol.
+
+``FakeDriver`` is a real Selenium ``WebDriver`` whose command executor answers
+in-process instead of over HTTP. Everything the server does on the client side
+(argument wrapping, WebElement references, response unwrapping, the command
+counting of ``instrument_driver``) runs unchanged, so a benchmark against it
+measures the server's own dispatch and serialization overhead without a
+browser.
+
+Pages are parsed into a small DOM. The server's in-page scripts are recognised
+by the routines they end with and answered from that DOM, and selectors are
+matched with a subset of CSS: tag names, ``#id``, ``.class``, ``[attr]`` and
+``[attr=value]``, joined by descendant or ``>`` combinators.
+"""
+
+import base64
+import hashlib
+import itertools
+import json
+import re
+from html import escape
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.keys import Keys
+from selenium.webdriver.remote.webdriver import WebDriver
+
+import server
+
+element_key = 'element-6066-11e4-a52e-4f735466cecf'
+void_tags = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+raw_text_tags = {'script', 'style'}
+
+# A 1x1 transparent PNG.
+blank_png = base64.b64encode(bytes.fromhex(
+    '89504e470d0a1a0a0000000d4948445200000001000000010806000000'
+    '1f15c4890000000d49444154789c6360000002000100e221bc330000000049454e44ae426082')).decode()
+
+class Node:
+    def __init__(self, tag=None, attributes=None, text=None, parent=None):
+        self.tag = tag
+        self.attributes = dict(attributes or {})
+        self.text = text
+        self.parent = parent
+        self.children = []
+        self.value = self.attributes.get('value', '')
+
+    @property
+    def is_element(self):
+        return self.tag is not None and self.tag != '#document'
+
+    @property
+    def element_children(self):
+        return [child for child in self.children if child.is_element]
+
+    def descendants(self):
+        for child in self.children:
+            if child.is_element:
+                yield child
+                yield from child.descendants()
+
+    def start_tag(self):
+        attributes = ''.join(f' {name}="{escape(value)}"' for name, value in self.attributes.items())
+        return f'<{self.tag}{attributes}>'
+
+    def outer_html(self):
+        if self.tag is None:
+            return self.text if self.parent is not None and self.parent.tag in raw_text_tags else escape(self.text, quote=False)
+        if self.tag in void_tags:
+            return self.start_tag()
+        return f'{self.start_tag()}{self.inner_html()}</{self.tag}>'
+
+    def inner_html(self):
+        return ''.join(child.outer_html() for child in self.children)
+
+    def text_content(self):
+        if self.tag is None:
+            return self.text
+        if self.tag in raw_text_tags:
+            return ''
+        return ''.join(child.text_content() for child in self.children)
+
+    def set_inner_html(self, html):
+        self.children = parse_fragment(html, self)
+
+class TreeBuilder(HTMLParser):
+    def __init__(self, root):
+        super().__init__(convert_charrefs=True)
+        self.root = root
+        self.current = root
+
+    def handle_starttag(self, tag, attrs):
+        node = Node(tag, {name: value or '' for name, value in attrs}, parent=self.current)
+        self.current.children.append(node)
+        if tag not in void_tags:
+            self.current = node
+
+    def handle_startendtag(self, tag, attrs):
+        self.current.children.append(Node(tag, {name: value or '' for name, value in attrs}, parent=self.current))
+
+    def handle_endtag(self, tag):
+        node = self.current
+        while node is not self.root and node.tag != tag:
+            node = node.parent
+        if node is not self.root:
+            self.current = node.parent
+
+    def handle_data(self, data):
+        self.current.children.append(Node(text=data, parent=self.current))
+
+def parse_fragment(html, parent):
+    builder = TreeBuilder(Node('#fragment'))
+    builder.feed(html)
+    builder.close()
+    for child in builder.root.children:
+        child.parent = parent
+    return builder.root.children
+
+def parse_document(html):
+    document = Node('#document')
+    document.children = parse_fragment(html, document)
+    return document
+
+compound_pattern = re.compile(r'([a-zA-Z][\w-]*|\*)?((?:[#.][\w-]+|\[[^\]]+\])*)$')
+simple_pattern = re.compile(r'#([\w-]+)|\.([\w-]+)|\[\s*([\w-]+)\s*(?:=\s*["\']?([^"\'\]]*)["\']?\s*)?\]')
+
+def parse_compound(text):
+    match = compound_pattern.match(text)
+    if not match:
+        raise ValueError(f'Unsupported selector {text!r}')
+    tests = []
+    if match.group(1) and match.group(1) != '*':
+        tests.append(('tag', match.group(1).lower()))
+    for element_id, class_name, attribute, value in simple_pattern.findall(match.group(2)):
+        if element_id:
+            tests.append(('attribute', 'id', element_id))
+        elif class_name:
+            tests.append(('class', class_name))
+        else:
+            tests.append(('attribute', attribute, value if value else None))
+    return tests
+
+def parse_selector(selector):
+    """Return one list of ``(combinator, tests)`` pairs per comma separated group."""
+    groups = []
+    for group in selector.split(','):
+        parts = []
+        combinator = ' '
+        for token in re.findall(r'>|(?:\[[^\]]*\]|[^\s>\[])+', group):
+            if token == '>':
+                combinator = '>'
+            else:
+                parts.append((combinator, parse_compound(token)))
+                combinator = ' '
+        groups.append(parts)
+    return groups
+
+def matches_compound(node, tests):
+    for test in tests:
+        if test[0] == 'tag' and node.tag != test[1]:
+            return False
+        if test[0] == 'class' and test[1] not in node.attributes.get('class', '').split():
+            return False
+        if test[0] == 'attribute' and (test[1] not in node.attributes or (test[2] is not None and node.attributes[test[1]] != test[2])):
+            return False
+    return True
+
+def matches_parts(node, parts):
+    combinator, tests = parts[-1]
+    if not matches_compound(node, tests):
+        return False
+    if len(parts) == 1:
+        return True
+    ancestor = node.parent
+    while ancestor is not None and ancestor.is_element:
+        if matches_parts(ancestor, parts[:-1]):
+            return True
+        if combinator == '>':
+            return False
+        ancestor = ancestor.parent
+    return False
+
+def select(root, selector):
+    groups = parse_selector(selector)
+    return [node for node in root.descendants() if any(matches_parts(node, parts) for parts in groups)]
+
+def hash_string(text):
+    return hashlib.blake2b(text.encode(), digest_size=8).hexdigest()
+
+def node_tree(node, depth):
+    """The same content tree as ``nodeTree`` of the server's content scripts."""
+    if not node.is_element or depth <= 0 or node.tag == 'template':
+        return {'h': hash_string(node.outer_html())}
+    children = [node_tree(child, depth - 1) for child in node.children]
+    tag = hash_string(node.start_tag())
+    return {'h': hash_string(tag + ''.join(child['h'] for child in children)), 't': tag, 'c': children}
+
+def container_tree(container, depth):
+    children = [node_tree(child, depth - 1) for child in container.children]
+    return {'h': hash_string(''.join(child['h'] for child in children)), 'c': children}
+
+class ScriptError(Exception):
+    pass
+
+class FakeConnection:
+    """Answers WebDriver commands from an in-memory page."""
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.url = 'about:blank'
+        self.document = parse_document('<html><head></head><body></body></html>')
+        self.references = {}
+        # References of elements of documents that were replaced since.
+        self.stale_references = set()
+        self.ids = itertools.count(1)
+        self.performance_log = []
+        self.bodies = {}
+        self.cookies = []
+        self.storage = {}
+        self.new_document_scripts = {}
+        self.window = {'x': 0, 'y': 0, 'width': 375, 'height': 667}
+
+    def reference(self, node):
+        if not hasattr(node, 'reference'):
+            node.reference = str(next(self.ids))
+            self.references[node.reference] = node
+        return {element_key: node.reference}
+
+    def node(self, value):
+        return self.references[value[element_key]]
+
+    def wrap(self, value):
+        if isinstance(value, Node):
+            return self.reference(value)
+        if isinstance(value, list):
+            return [self.wrap(item) for item in value]
+        if isinstance(value, dict):
+            return {key: self.wrap(item) for key, item in value.items()}
+        return value
+
+    def unwrap(self, value):
+        if isinstance(value, dict) and element_key in value:
+            return self.node(value)
+        if isinstance(value, list):
+            return [self.unwrap(item) for item in value]
+        return value
+
+    def execute(self, command, params):
+        try:
+            return {'status': 0, 'value': self.wrap(self.dispatch(command, params or {}))}
+        except KeyError as e:
+            if e.args and e.args[0] in self.stale_references:
+                return {'status': 'stale element reference', 'value': {'error': 'stale element reference', 'message': f'Element {e} is not attached to the page'}}
+            return {'status': 404, 'value': {'error': 'no such element', 'message': f'Unknown element {e}'}}
+        except (ScriptError, ValueError) as e:
+            return {'status': 500, 'value': {'error': 'javascript error', 'message': str(e)}}
+
+    def dispatch(self, command, params):
+        if command == 'newSession':
+            return {'sessionId': 'fake', 'capabilities': {'browserName': 'chrome', 'browserVersion': 'fake'}}
+        if command == 'get':
+            return self.load(params['url'])
+        if command == 'getCurrentUrl':
+            return self.url
+        if command == 'getTitle':
+            titles = select(self.document, 'title')
+            return titles[0].text_content() if titles else ''
+        if command == 'getPageSource':
+            return self.document.inner_html()
+        if command in ('findElements', 'findElement'):
+            found = select(self.document, params['value'])
+            if command == 'findElement':
+                if not found:
+                    raise KeyError(params['value'])
+                return found[0]
+            return found
+        if command == 'findChildElements':
+            return select(self.references[params['id']], params['value'])
+        if command == 'getElementTagName':
+            return self.references[params['id']].tag
+        if command == 'getElementText':
+            return self.references[params['id']].text_content()
+        if command == 'getElementRect':
+            return {'x': 0, 'y': 0, 'width': 100, 'height': 20}
+        if command == 'isElementEnabled':
+            return 'disabled' not in self.references[params['id']].attributes
+        if command == 'clickElement':
+            node = self.references[params['id']]
+            if node.tag == 'a' and node.attributes.get('href'):
+                return self.load(urljoin(self.url, node.attributes['href']))
+            if node.attributes.get('data-more'):
+                return self.load_more(urljoin(self.url, node.attributes['data-more']), node)
+            return None
+        if command == 'sendKeysToElement':
+            node = self.references[params['id']]
+            typed = params['text']
+            if Keys.CONTROL + 'a' in typed:
+                node.value = ''
+                typed = typed.replace(Keys.CONTROL + 'a', '')
+            node.value += ''.join(character for character in typed if not '\ue000' <= character <= '\uf8ff')
+            return None
+        if command in ('w3cExecuteScript', 'w3cExecuteScriptAsync'):
+            return self.run_script(params['script'], self.unwrap(params.get('args', [])))
+        if command in ('screenshot', 'elementScreenshot'):
+            return blank_png
+        if command == 'executeCdpCommand':
+            return self.run_cdp(params['cmd'], params.get('params', {}))
+        if command == 'getCookies':
+            return []
+        if command == 'getWindowRect':
+            return self.window
+        if command == 'setWindowRect':
+            self.window.update((key, value) for key, value in params.items() if value is not None)
+            return self.window
+        if command == 'getLog':
+            entries, self.performance_log = self.performance_log, []
+            return entries
+        return None
+
+    def load(self, url):
+        html = self.loader(url)
+        if html is None:
+            raise ScriptError(f'Cannot load {url}')
+        self.url = url
+        self.document = parse_document(html)
+        self.stale_references.update(self.references)
+        self.references = {}
+        self.log_load(url, html)
+        seed_prefix = server.storage_seed_js.split('%s')[0]
+        for source in self.new_document_scripts.values():
+            if source.startswith(seed_prefix):
+                seeded = json.loads(source[len(seed_prefix):-len(');\n')]).get(self.origin(), {})
+                for kind in ('local', 'session'):
+                    self.origin_storage(self.origin())[kind].update(seeded.get(kind) or {})
+        return None
+
+    def load_more(self, url, button):
+        """Append the rows of the page at url to ``#items`` and put its button in place of ``button``."""
+        html = self.loader(url)
+        if html is None:
+            raise ScriptError(f'Cannot load {url}')
+        more = parse_document(html)
+        def by_id(root, id):
+            return [node for node in root.descendants() if node.attributes.get('id') == id]
+        items = by_id(self.document, 'items')[0]
+        for row in by_id(more, 'items')[0].children:
+            row.parent = items
+            items.children.append(row)
+        replacement = by_id(more, 'next')
+        for node in replacement:
+            node.parent = button.parent
+        index = button.parent.children.index(button)
+        button.parent.children[index:index + 1] = replacement
+        return None
+
+    def document_token(self):
+        if not hasattr(self.document, 'token'):
+            self.document.token = f'document-{next(self.ids)}'
+        return self.document.token
+
+    def origin(self):
+        parts = urlsplit(self.url)
+        return f'{parts.scheme}://{parts.netloc}' if parts.scheme in ('http', 'https') else 'null'
+
+    def origin_storage(self, origin):
+        return self.storage.setdefault(origin, {'local': {}, 'session': {}})
+
+    def log_load(self, url, html):
+        """Write the performance log entries of a document load."""
+        request_id = str(next(self.ids))
+        events = [
+            ('Network.requestWillBeSent', {'requestId': request_id, 'type': 'Document', 'timestamp': 1.0, 'wallTime': 0.0,
+                                           'request': {'url': url, 'method': 'GET', 'headers': {}}}),
+            ('Network.responseReceived', {'requestId': request_id, 'response': {
+                'status': 200, 'statusText': 'OK', 'mimeType': 'text/html', 'headers': {'Content-Type': 'text/html'}}}),
+            ('Network.loadingFinished', {'requestId': request_id, 'timestamp': 1.001, 'encodedDataLength': len(html)}),
+        ]
+        self.performance_log += [{'level': 'INFO', 'timestamp': 0, 'message': json.dumps({'message': {'method': method, 'params': params}})}
+                                 for method, params in events]
+        self.bodies = {request_id: html}
+
+    def run_cdp(self, cmd, params):
+        if cmd == 'Page.captureScreenshot':
+            return {'data': blank_png}
+        if cmd == 'Network.getAllCookies':
+            return {'cookies': self.cookies}
+        if cmd == 'Network.setCookies':
+            keys = {(cookie['name'], cookie.get('domain'), cookie.get('path')) for cookie in params['cookies']}
+            self.cookies = [cookie for cookie in self.cookies if (cookie['name'], cookie.get('domain'), cookie.get('path')) not in keys]
+            self.cookies += [dict(cookie, session='expires' not in cookie) for cookie in params['cookies']]
+            return {}
+        if cmd == 'Page.addScriptToEvaluateOnNewDocument':
+            identifier = str(next(self.ids))
+            self.new_document_scripts[identifier] = params['source']
+            return {'identifier': identifier}
+        if cmd == 'Page.removeScriptToEvaluateOnNewDocument':
+            self.new_document_scripts.pop(params['identifier'], None)
+            return {}
+        if cmd in ('DOMStorage.getDOMStorageItems', 'DOMStorage.setDOMStorageItem'):
+            storage_id = params['storageId']
+            items = self.origin_storage(storage_id['securityOrigin'])['local' if storage_id['isLocalStorage'] else 'session']
+            if cmd == 'DOMStorage.setDOMStorageItem':
+                items[params['key']] = params['value']
+                return {}
+            return {'entries': [[key, value] for key, value in items.items()]}
+        if cmd == 'Input.insertText':
+            return {}
+        if cmd == 'Network.getResponseBody':
+            if params['requestId'] not in self.bodies:
+                raise ScriptError('No resource with given identifier found')
+            return {'body': self.bodies[params['requestId']], 'base64Encoded': False}
+        return {}
+
+    def resolve(self, steps, root):
+        """resolveSelector(): every CSS step is matched inside the first element found so far."""
+        elements = [] if root is self.document else [root]
+        for step in steps:
+            if step[0] == 'css':
+                elements = select(elements[0] if elements else root, step[1])
+            elif step[0] == 'parent':
+                if not elements:
+                    return {'error': 'parent'}
+                elements = [elements[0].parent] if elements[0].parent is not None else []
+            elif step[0] == 'index':
+                if step[1] >= len(elements):
+                    return {'error': 'index', 'index': step[1]}
+                elements = [elements[step[1]]]
+            if not elements:
+                return []
+        return elements
+
+    def extract(self, node, fields, attribute_names):
+        info = {}
+        for field in fields:
+            if field == 'tag_name':
+                info['tag_name'] = node.tag
+            elif field == 'attributes':
+                info['attributes'] = ({name: node.attributes.get(name) for name in attribute_names}
+                                      if attribute_names else dict(node.attributes))
+            elif field == 'text':
+                info['text'] = node.text_content()
+            elif field == 'innerHTML':
+                info['innerHTML'] = node.inner_html()
+            elif field == 'outerHTML':
+                info['outerHTML'] = node.outer_html()
+            elif field == 'rect':
+                info['rect'] = {'x': 0, 'y': 0, 'width': 100, 'height': 20}
+            elif field == 'visible':
+                info['visible'] = True
+            elif field == 'child_count':
+                info['child_count'] = len(node.element_children)
+            elif field == 'children':
+                info['children'] = [self.extract(child, ['tag_name', 'attributes'], None) for child in node.element_children]
+            elif field == 'handle':
+                info['handle'] = node
+        return info
+
+    def run_script(self, script, args):
+        if script.startswith('/* getAttribute */'):
+            node, name = args
+            if name == 'innerHTML':
+                return node.inner_html()
+            if name == 'value' and node.tag in ('input', 'textarea'):
+                return node.value
+            return node.attributes.get(name)
+        if script.startswith('/* isDisplayed */'):
+            return True
+        if script.endswith(server.extraction_js):
+            result = self.resolve(args[0], args[5] or self.document)
+            if isinstance(result, dict):
+                return result
+            offset, limit = args[3], args[4]
+            page = result[offset:None if limit is None else offset + limit]
+            return {'total': len(result), 'items': [self.extract(node, args[1], args[2]) for node in page],
+                    'document': self.document_token() if 'handle' in args[1] else None}
+        if script == server.document_token_js:
+            return self.document_token()
+        if script.endswith(server.page_state_js):
+            origin = self.origin()
+            items = self.origin_storage(origin) if origin != 'null' else {'local': None, 'session': None}
+            return {'url': self.url, 'origin': origin, 'viewport': {'width': self.window['width'], 'height': self.window['height']},
+                    'local': items['local'], 'session': items['session']}
+        if script.endswith(server.scrape_js):
+            rows = self.resolve(args[0], self.document)
+            if isinstance(rows, dict):
+                return rows
+            total, limit = len(rows), args[3]
+            if args[2]:
+                rows = [row for row in rows if not getattr(row, 'scraped', False)]
+            records = [self.scrape_row(row, args[1]) for row in rows[:limit]]
+            return {'total': total, 'records': records}
+        match = re.search(r'return resolveSelector\((.*), arguments\[0\] \|\| document\);$', script)
+        if match:
+            return self.resolve(json.loads(match.group(1)), (args[0] if args else None) or self.document)
+        if script.endswith(server.wait_js):
+            return self.check_condition(*args[:3], args[4] or self.document)
+        if script.endswith(server.content_tree_script[len(server.content_tree_js):]):
+            container = args[0] or self.document
+            return {'tree': container_tree(container, args[1]), 'content': container.inner_html() if args[2] else None}
+        if script.endswith(server.content_nodes_script[len(server.content_tree_js):]):
+            return self.content_nodes(args[0] or self.document, args[1], args[2])
+        if script.endswith('return containerContent(arguments[0] || document);'):
+            return (args[0] or self.document).inner_html()
+        if script.endswith(server.text_entry_js):
+            node, text, mode = args
+            if mode != 'select':
+                node.value = text
+            return None
+        if 'document.readyState' in script:
+            return 'complete'
+        if 'arguments[0].parentNode' in script:
+            parent = args[0].parent
+            return parent if parent is not None and parent.is_element else None
+        if 'element.attributes.length' in script:
+            return dict(args[0].attributes)
+        if 'arguments[0].innerHTML = arguments[1]' in script:
+            args[0].set_inner_html(args[1])
+            return None
+        if 'arguments[0].value = arguments[1]' in script:
+            args[0].value = args[1]
+            return None
+        if 'return arguments[0].value' in script:
+            return args[0].value
+        if 'setAttribute(arguments[1], arguments[2])' in script:
+            args[0].attributes[args[1]] = args[2]
+            return None
+        return None
+
+    def scrape_row(self, row, fields):
+        record = {}
+        for name, steps, extract, attribute, all_matches in fields:
+            matches = self.resolve(steps, row) if steps else [row]
+            values = [node.attributes.get(attribute) if extract == 'attribute' else self.extract(node, [extract], None)[extract]
+                      for node in (matches if isinstance(matches, list) else [])]
+            record[name] = values if all_matches else (values[0] if values else None)
+        row.scraped = True
+        return record
+
+    def check_condition(self, steps, condition, options, root):
+        if condition in ('ready_state', 'network_idle'):
+            return {'ok': True, 'state': 'complete'}
+        elements = self.resolve(steps, root)
+        if isinstance(elements, dict):
+            elements = []
+        if condition == 'unscraped':
+            elements = [node for node in elements if not getattr(node, 'scraped', False)]
+        if condition == 'text':
+            pattern = re.compile(options['pattern']) if options.get('pattern') else None
+            elements = [node for node in elements
+                        if (pattern.search(node.text_content()) if pattern else options['text'] in node.text_content())]
+        if condition == 'count':
+            return {'ok': len(elements) >= options['count'], 'count': len(elements)}
+        return {'ok': bool(elements), 'count': len(elements)}
+
+    def content_nodes(self, container, depth, nodes):
+        htmls = []
+        for path, expected in nodes:
+            node = container
+            for index in path:
+                node = node.children[index] if node is not None and index < len(node.children) else None
+            if node is None or node_tree(node, depth - len(path))['h'] != expected:
+                return None
+            htmls.append(node.outer_html())
+        return htmls
+
+    def close(self):
+        pass
+
+class FakeDriver(WebDriver):
+    """A WebDriver backed by ``FakeConnection``; ``loader(url)`` returns the HTML of a URL."""
+
+    def __init__(self, loader):
+        super().__init__(command_executor=FakeConnection(loader), options=Options())
+
+    def execute_cdp_cmd(self, cmd, cmd_args):
+        return self.execute('executeCdpCommand', {'cmd': cmd, 'params': cmd_args})['value']
+
+    def get_log(self, log_type):
+        return self.execute('getLog', {'type': log_type})['value']
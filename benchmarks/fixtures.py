@@ -0,0 +1,138 @@
+"""Synthetic fixture pages and the local HTTP server that serves them.
+
+Every page is generated from its path and query string, so a run is
+reproducible without network access:
+
+- ``/list?items=N``: a list of N products; with ``pages=P`` and ``page=K``
+  the K-th of P pages of N products, linked by a ``#next`` link, or with
+  ``more=1`` by a ``#next`` load more button that appends the next page
+- ``/deep?depth=N``: N nested containers around a single leaf
+- ``/large?kb=N``: an article of about N kilobytes of text
+- ``/mutating?interval=MS``: a list that grows and changes every MS milliseconds
+- ``/form``: an input, a textarea, a contenteditable editor and a button
+- ``/api/echo``: echoes the request as JSON, for ``send_request``
+"""
+
+import json
+import threading
+from html import escape
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+words = ('alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima')
+
+def document(title, body, script=''):
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{escape(title)}</title></head>'
+            f'<body>{body}{f"<script>{script}</script>" if script else ""}</body></html>')
+
+def list_page(items=1000, page=0, pages=1, more=False):
+    rows = ''.join(
+        f'<li class="item" data-id="{i}"><a class="link" href="/item/{i}">{words[i % len(words)]} {i}</a>'
+        f'<span class="price">{i % 97}.{i % 100:02d}</span></li>'
+        for i in range(page * items, (page + 1) * items if page < pages else 0))
+    next_url = f'/list?items={items}&pages={pages}&page={page + 1}'
+    if page + 1 >= pages:
+        next_link = ''
+    elif more:
+        next_link = f'<button id="next" data-more="{next_url}&more=1">Load more</button>'
+    else:
+        next_link = f'<a id="next" href="{next_url}">Next</a>'
+    return document('List', f'<h1 id="title">{items} items</h1><ul id="items">{rows}</ul>{next_link}')
+
+def deep_page(depth=200):
+    opening = ''.join(f'<div class="level" data-level="{i}">' for i in range(depth))
+    return document('Deep', f'<main id="root">{opening}<span id="leaf">leaf</span>{"</div>" * depth}</main>')
+
+def large_page(kb=1024):
+    paragraph = ' '.join(words * 8)
+    count = max(kb * 1024 // (len(paragraph) + 7), 1)
+    body = ''.join(f'<p class="paragraph">{paragraph}</p>' for _ in range(count))
+    return document('Large', f'<article id="content">{body}</article>')
+
+def mutating_page(interval=100):
+    script = f"""
+        var list = document.getElementById('feed'), count = 0;
+        setInterval(function() {{
+            count++;
+            var item = document.createElement('li');
+            item.className = 'entry';
+            item.textContent = 'entry ' + count;
+            list.appendChild(item);
+            if (list.children.length > 50) {{
+                list.removeChild(list.firstChild);
+            }}
+            document.getElementById('counter').textContent = String(count);
+        }}, {int(interval)});
+        setTimeout(function() {{ document.getElementById('status').textContent = 'Done'; }}, 1000);
+    """
+    return document('Mutating', '<div id="status">Loading</div><div id="counter">0</div><ul id="feed"></ul>', script)
+
+def form_page():
+    body = ('<form id="form"><input id="name" name="name" type="text" value="">'
+            '<textarea id="content" name="content"></textarea>'
+            '<div id="editor" contenteditable="true"></div>'
+            '<button id="submit" type="button">Submit</button></form>')
+    return document('Form', body)
+
+pages = {
+    '/list': lambda query: list_page(int(query.get('items', 1000)), int(query.get('page', 0)), int(query.get('pages', 1)),
+                                      query.get('more') == '1'),
+    '/deep': lambda query: deep_page(int(query.get('depth', 200))),
+    '/large': lambda query: large_page(int(query.get('kb', 1024))),
+    '/mutating': lambda query: mutating_page(int(query.get('interval', 100))),
+    '/form': lambda query: form_page(),
+}
+
+def render(url):
+    """Return the HTML of a fixture page URL, or None if there is no such page."""
+    parts = urlsplit(url)
+    page = pages.get(parts.path)
+    if page is None:
+        return None
+    return page({key: values[-1] for key, values in parse_qs(parts.query).items()})
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.startswith('/api/echo'):
+            self.send_echo()
+            return
+        html = render(self.path)
+        if html is None:
+            self.send_error(404)
+            return
+        self.send_body(html.encode(), 'text/html; charset=utf-8')
+
+    def do_POST(self):
+        self.send_echo()
+
+    def send_echo(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode(errors='replace') if length else ''
+        echo = {'method': self.command, 'path': self.path, 'body': body, 'cookies': self.headers.get('Cookie')}
+        self.send_body(json.dumps(echo).encode(), 'application/json')
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class FixtureServer:
+    """Serves the fixture pages on a free local port in a background thread."""
+
+    def __init__(self, host='127.0.0.1', port=0):
+        self.httpd = ThreadingHTTPServer((host, port), FixtureHandler)
+        self.httpd.daemon_threads = True
+        self.url = f'http://{host}:{self.httpd.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.httpd.serve_forever, name='fixtures', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
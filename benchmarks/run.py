@@ -0,0 +1,321 @@
+"""Benchmark the /execute actions against the local fixture pages.
+
+Examples::
+
+    # In-process against the fake driver, no Chrome needed
+    python -m benchmarks.run --mode fake --output fake.json
+
+    # Against a running server with real browsers
+    python server.py --port 5000 --network-capture &
+    python -m benchmarks.run --mode live --url http://127.0.0.1:5000 --sessions 4 --concurrency 8
+
+    # Compare with an earlier run and fail on regressions
+    python -m benchmarks.run --mode fake --baseline fake.json
+
+Every scenario runs ``--iterations`` times on each of ``--sessions`` sessions,
+with up to ``--concurrency`` requests in flight. The results hold throughput,
+latency percentiles and the WebDriver commands per action (read from the
+``timing`` breakdown of every response) and are written as JSON.
+"""
+
+import argparse
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmarks import fixtures
+
+LIST = '/list?items=1000'
+DEEP = '/deep?depth=200'
+LARGE = '/large?kb=1024'
+MUTATING = '/mutating?interval=50'
+FORM = '/form'
+PAGED = '/list?items=100&pages=5'
+
+product_schema = {'rows': 'li.item', 'fields': {
+    'name': 'a.link',
+    'url': {'selector': 'a.link', 'extract': 'attribute', 'attribute': 'href'},
+    'price': 'span.price',
+}}
+
+# (name, page, action, params, live only). Sessions are navigated to the page
+# before the scenario runs; ``{fixtures}`` in string params is replaced with
+# the URL of the fixture server.
+scenarios = [
+    ('get_pool_stats', None, 'get_pool_stats', {}, False),
+    ('list_sessions', None, 'list_sessions', {}, False),
+    ('navigate:list', None, 'navigate', {'url': '{fixtures}' + LIST}, False),
+    ('navigate:large', None, 'navigate', {'url': '{fixtures}' + LARGE}, False),
+    ('get_element_info', LIST, 'get_element_info', {'css_selector': 'li.item'}, False),
+    ('get_all_matching_elements_info', LIST, 'get_all_matching_elements_info', {'css_selector': 'li.item'}, False),
+    ('get_element_parent_info', LIST, 'get_element_parent_info', {'css_selector': 'li.item a.link'}, False),
+    ('execute_js_on_element', LIST, 'execute_js_on_element', {'css_selector': '#title', 'js': 'return arguments[0].textContent;'}, False),
+    ('click_element', LIST, 'click_element', {'css_selector': '#title'}, False),
+    ('get_innerHTML', LIST, 'get_innerHTML', {'css_selector': '#items'}, False),
+    ('get_innerHTML:etag', LIST, 'get_innerHTML', {'css_selector': '#items', 'etag': ''}, False),
+    ('get_innerHTML_for_each', LIST, 'get_innerHTML_for_each', {'css_selector': 'li.item'}, False),
+    ('extract_elements', LIST, 'extract_elements', {'css_selector': 'li.item', 'fields': ['text', 'attributes'], 'limit': 100}, False),
+    ('scrape', LIST, 'scrape', {'schema': product_schema}, False),
+    ('scrape:url', None, 'scrape', {'schema': product_schema, 'pagination': {
+        'type': 'url', 'template': '{fixtures}' + PAGED + '&page={page}', 'start': 0, 'max_pages': 10}}, False),
+    ('check_element_exists', LIST, 'check_element_exists', {'css_selector': 'li.item::999'}, False),
+    ('count_elements', LIST, 'count_elements', {'css_selector': 'li.item'}, False),
+    ('get_element_attribute', LIST, 'get_element_attribute', {'css_selector': 'li.item', 'attribute': 'data-id'}, False),
+    ('get_all_element_attributes', LIST, 'get_all_element_attributes', {'css_selector': 'li.item'}, False),
+    ('get_element_children', LIST, 'get_element_children', {'css_selector': '#items'}, False),
+    ('scroll_to_element', LIST, 'scroll_to_element', {'css_selector': 'li.item::500'}, False),
+    ('scroll_to_top', LIST, 'scroll_to_top', {}, False),
+    ('scroll_to_bottom', LIST, 'scroll_to_bottom', {}, False),
+    ('get_current_url', LIST, 'get_current_url', {}, False),
+    ('is_page_loading', LIST, 'is_page_loading', {}, False),
+    ('execute_js', LIST, 'execute_js', {'js': 'document.title'}, False),
+    ('get_screenshot', LIST, 'get_screenshot', {}, False),
+    ('get_screenshot:jpeg', LIST, 'get_screenshot', {'format': 'jpeg', 'quality': 60}, False),
+    ('wait_for_element:count', LIST, 'wait_for_element', {'css_selector': 'li.item', 'condition': 'count', 'count': 1000}, False),
+    ('get_page_source:deep', DEEP, 'get_page_source', {}, False),
+    ('get_innerHTML:deep', DEEP, 'get_innerHTML', {'css_selector': '#leaf'}, False),
+    ('get_page_source:large', LARGE, 'get_page_source', {}, False),
+    ('get_page_source:large_etag', LARGE, 'get_page_source', {'etag': ''}, False),
+    ('wait_for_element:text', MUTATING, 'wait_for_element', {'css_selector': '#status', 'condition': 'text', 'text': 'Done', 'timeout': 5}, True),
+    ('wait_for_element:mutation', MUTATING, 'wait_for_element', {'css_selector': 'li.entry', 'condition': 'count', 'count': 5, 'timeout': 5}, True),
+    ('get_innerHTML:mutating', MUTATING, 'get_innerHTML', {'css_selector': '#feed'}, True),
+    ('paste_text:keys', FORM, 'paste_text', {'css_selector': '#content', 'text': 'line one\nline two\nline three', 'mode': 'keys'}, False),
+    ('paste_text:insert', FORM, 'paste_text', {'css_selector': '#content', 'text': 'line one\nline two\nline three', 'mode': 'insert'}, False),
+    ('paste_text:native', FORM, 'paste_text', {'css_selector': '#content', 'text': 'line one\nline two\nline three', 'mode': 'native'}, False),
+    ('paste_text:paste_event', FORM, 'paste_text', {'css_selector': '#editor', 'text': 'line one\nline two\nline three', 'mode': 'paste_event'}, False),
+    ('set_input_value', FORM, 'set_input_value', {'css_selector': '#name', 'value': 'benchmark'}, False),
+    ('get_input_value', FORM, 'get_input_value', {'css_selector': '#name'}, False),
+    ('set_element_attribute', FORM, 'set_element_attribute', {'css_selector': '#name', 'attribute': 'data-run', 'value': '1'}, False),
+    ('set_innerHTML', FORM, 'set_innerHTML', {'css_selector': '#editor', 'html': '<p>benchmark</p>'}, False),
+    ('send_enter_key', FORM, 'send_enter_key', {'css_selector': '#name'}, False),
+    ('send_request', FORM, 'send_request', {'url': '{fixtures}/api/echo'}, False),
+    ('send_requests', FORM, 'send_requests', {'requests': [{'url': '{fixtures}/api/echo', 'data': {'n': n}} for n in range(10)]}, False),
+    # Needs a server started with --network-capture. Every navigate while
+    # capturing reads the performance log and the kept response bodies.
+    ('start_network_capture', LIST, 'start_network_capture', {'bodies': ['*/list*']}, False),
+    ('navigate:captured', None, 'navigate', {'url': '{fixtures}' + LIST}, False),
+    ('get_network_requests', None, 'get_network_requests', {'url': '/list'}, False),
+    ('drain_network_requests', None, 'drain_network_requests', {}, False),
+    ('stop_network_capture', None, 'stop_network_capture', {}, False),
+    ('snapshot_session', LIST, 'snapshot_session', {}, False),
+    ('restore_session', None, 'restore_session', {}, False),
+]
+
+def fill_params(value, fixtures_url):
+    if isinstance(value, str):
+        return value.replace('{fixtures}', fixtures_url)
+    if isinstance(value, list):
+        return [fill_params(item, fixtures_url) for item in value]
+    if isinstance(value, dict):
+        return {key: fill_params(item, fixtures_url) for key, item in value.items()}
+    return value
+
+class HttpClient:
+    """Sends actions to a running server, with one connection per thread."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.local = threading.local()
+
+    def execute(self, action, params):
+        if not hasattr(self.local, 'http'):
+            self.local.http = requests.Session()
+        response = self.local.http.post(self.url + '/execute', json={'action': action, 'params': params})
+        return response.status_code, response.json()
+
+class InProcessClient:
+    """Sends actions to the server's Flask app in this process, backed by the fake driver."""
+
+    def __init__(self):
+        import server
+        from benchmarks.fake_driver import FakeDriver
+        server.launch_driver = lambda profile="", arguments=(), user_data_dir=None: server.instrument_driver(FakeDriver(fixtures.render))
+        server.network_capture_enabled = True
+        self.snapshots = tempfile.TemporaryDirectory()
+        server.snapshot_dir = self.snapshots.name
+        self.app = server.app
+        self.local = threading.local()
+
+    def execute(self, action, params):
+        if not hasattr(self.local, 'client'):
+            self.local.client = self.app.test_client()
+        response = self.local.client.post('/execute', json={'action': action, 'params': params})
+        return response.status_code, response.get_json()
+
+def percentile(ordered, fraction):
+    """The nearest-rank percentile of an ascending list."""
+    if not ordered:
+        return None
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+def summarize(samples, wall_time):
+    latencies = sorted(sample['latency_ms'] for sample in samples)
+    commands = [sample['webdriver_commands'] for sample in samples if sample['webdriver_commands'] is not None]
+    server_times = [sample['server_ms'] for sample in samples if sample['server_ms'] is not None]
+    errors = [sample for sample in samples if sample['code'] >= 400]
+    return {
+        'count': len(samples),
+        'errors': len(errors),
+        'first_error': errors[0]['message'] if errors else None,
+        'throughput': round(len(samples) / wall_time, 2) if wall_time else None,
+        'latency_ms': {
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'max': latencies[-1] if latencies else None,
+        },
+        'webdriver_commands': round(sum(commands) / len(commands), 2) if commands else None,
+        'server_ms': round(sum(server_times) / len(server_times), 3) if server_times else None,
+    }
+
+class Runner:
+    def __init__(self, client, fixtures_url, session_names, concurrency, iterations, warmup):
+        self.client = client
+        self.fixtures_url = fixtures_url
+        self.session_names = session_names
+        self.concurrency = concurrency
+        self.iterations = iterations
+        self.warmup = warmup
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def call(self, session_name, action, params):
+        params = dict(params, session=session_name, timing=True)
+        started = time.perf_counter()
+        code, body = self.client.execute(action, params)
+        latency = (time.perf_counter() - started) * 1000
+        timing = (body or {}).get('timing') or {}
+        return {
+            'latency_ms': round(latency, 3),
+            'code': code,
+            'message': (body or {}).get('message'),
+            'webdriver_commands': timing.get('webdriver_commands'),
+            'server_ms': timing.get('server_ms'),
+        }
+
+    def run_all(self, action, params, rounds):
+        """Call the action ``rounds`` times on every session and return the samples and the wall time."""
+        tasks = [session_name for _ in range(rounds) for session_name in self.session_names]
+        started = time.perf_counter()
+        samples = list(self.executor.map(lambda session_name: self.call(session_name, action, params), tasks))
+        return samples, time.perf_counter() - started
+
+    def navigate(self, page):
+        samples, _ = self.run_all('navigate', {'url': self.fixtures_url + page}, 1)
+        failed = [sample for sample in samples if sample['code'] >= 400]
+        if failed:
+            raise RuntimeError(f'Could not open {page}: {failed[0]["message"]}')
+
+    def run(self, selected):
+        results = {}
+        samples, wall_time = self.run_all('create_session', {}, 1)
+        results['create_session'] = summarize(samples, wall_time)
+        current_page = None
+        for name, page, action, params, _ in selected:
+            if page is not None and page != current_page:
+                self.navigate(page)
+                current_page = page
+            elif page is None:
+                # Scenarios without a page may navigate, like navigate and scrape:url.
+                current_page = None
+            params = fill_params(params, self.fixtures_url)
+            if self.warmup:
+                self.run_all(action, params, self.warmup)
+            samples, wall_time = self.run_all(action, params, self.iterations)
+            results[name] = summarize(samples, wall_time)
+            print(format_row(name, results[name]), flush=True)
+        samples, wall_time = self.run_all('close_session', {}, 1)
+        results['close_session'] = summarize(samples, wall_time)
+        return results
+
+def format_row(name, stats):
+    latency = stats['latency_ms']
+    commands = '-' if stats['webdriver_commands'] is None else f"{stats['webdriver_commands']:g}"
+    return (f"{name:36} {stats['throughput'] or 0:>9.1f}/s  p50 {latency['p50'] or 0:>9.2f}  p95 {latency['p95'] or 0:>9.2f}  "
+            f"p99 {latency['p99'] or 0:>9.2f} ms  cmds {commands:>5}  errors {stats['errors']}")
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(baseline, results, threshold):
+    """Print the change of every scenario against a baseline run and return the regressed scenarios."""
+    regressions = []
+    print(f"\n{'scenario':36} {'p50 before':>11} {'p50 after':>10} {'change':>8}  {'p95 before':>11} {'p95 after':>10} {'change':>8}")
+    for name, stats in results.items():
+        before = baseline.get('scenarios', {}).get(name)
+        if before is None:
+            continue
+        row = f'{name:36}'
+        for key in ('p50', 'p95'):
+            old, new = before['latency_ms'][key], stats['latency_ms'][key]
+            if not old or new is None:
+                row += f" {'-':>11} {'-':>10} {'-':>8} "
+                continue
+            change = (new - old) / old * 100
+            row += f' {old:>11.2f} {new:>10.2f} {change:>+7.1f}% '
+            if key == 'p50' and change > threshold:
+                regressions.append(name)
+        print(row)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Selenium API server against local fixture pages.")
+    parser.add_argument('--mode', choices=['fake', 'live'], default='fake', help="fake runs the server in this process with an in-memory driver, live sends requests to --url (default: fake)")
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help="URL of the server for --mode live (default: http://127.0.0.1:5000)")
+    parser.add_argument('--sessions', type=int, default=2, help="Number of sessions to run every scenario on (default: 2)")
+    parser.add_argument('--concurrency', type=int, default=4, help="Requests in flight at once (default: 4)")
+    parser.add_argument('--iterations', type=int, default=20, help="Measured calls per scenario and session (default: 20)")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured calls per scenario and session before measuring (default: 2)")
+    parser.add_argument('--scenarios', help="Comma separated scenario or action names to run (default: all)")
+    parser.add_argument('--output', help="Write the results as JSON to this file")
+    parser.add_argument('--baseline', help="Compare with the results of an earlier run")
+    parser.add_argument('--threshold', type=float, default=10, help="Percent increase of p50 latency reported as a regression (default: 10)")
+    args = parser.parse_args()
+
+    selected = [scenario for scenario in scenarios if args.mode == 'live' or not scenario[4]]
+    if args.scenarios:
+        wanted = set(args.scenarios.split(','))
+        selected = [scenario for scenario in selected if scenario[0] in wanted or scenario[2] in wanted]
+
+    fixture_server = fixtures.FixtureServer().start()
+    client = InProcessClient() if args.mode == 'fake' else HttpClient(args.url)
+    session_names = [f'benchmark-{index}' for index in range(args.sessions)]
+    runner = Runner(client, fixture_server.url, session_names, args.concurrency, args.iterations, args.warmup)
+    started = time.time()
+    try:
+        results = runner.run(selected)
+    finally:
+        fixture_server.stop()
+
+    report = {
+        'created_at': started,
+        'duration_seconds': round(time.time() - started, 3),
+        'commit': current_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {key: getattr(args, key) for key in ('mode', 'sessions', 'concurrency', 'iterations', 'warmup')},
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            print(f"\nRegressed by more than {args.threshold:g}%: {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
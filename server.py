@@ -6,24 +6,198 @@ import undetected_chromedriver as uc
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.action_chains import ActionChains
-from selenium.common.exceptions import NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException, TimeoutException, JavascriptException, StaleElementReferenceException
 import re
+import json
 import os
 import requests
+import requests.adapters
 from requests_toolbelt.multipart.encoder import MultipartEncoder
 import pyperclip
+import threading
+import functools
+import pkgutil
+import logging
+import base64
+import gzip
+import difflib
+import atexit
+import sys
+import queue
+import subprocess
+import signal
+import zlib
+import fnmatch
+from urllib.parse import quote, unquote, urlsplit
+import errno
+import shutil
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 app_path = os.path.dirname(__file__)
 app = Flask(__name__)
+logger = logging.getLogger("selenium_api")
 
 sessions = {}
 
-def get_session(name, profile = ""):
-    if name in sessions:
-        return sessions[name]
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+command_buckets = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+class Metrics:
+    """Counters and histograms rendered in the Prometheus text format.
+
+    Labels are passed as a tuple of ``(name, value)`` pairs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {}
+        self.buckets = {}
+        self.values = {}
+
+    def describe(self, name, kind, description, buckets=None):
+        self.descriptions[name] = (kind, description)
+        self.values[name] = {}
+        if buckets is not None:
+            self.buckets[name] = buckets
+
+    def inc(self, name, labels=(), value=1):
+        with self.lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + value
+
+    def observe(self, name, value, labels=()):
+        with self.lock:
+            series = self.values[name]
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = [[0] * len(self.buckets[name]), 0, 0]
+            for index, bound in enumerate(self.buckets[name]):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self, gauges=()):
+        """Render all metrics plus ``gauges``, a list of
+        ``(name, description, [(labels, value), ...])`` tuples computed by the caller."""
+        lines = []
+        with self.lock:
+            for name, (kind, description) in self.descriptions.items():
+                lines.append(f"# HELP {name} {description}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in self.values[name].items():
+                    if kind == 'histogram':
+                        bucket_counts, total, count = value
+                        for bound, bucket_count in zip(self.buckets[name], bucket_counts):
+                            lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {bucket_count}")
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+                        lines.append(f"{name}_sum{format_labels(labels)} {total}")
+                        lines.append(f"{name}_count{format_labels(labels)} {count}")
+                    else:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, description, samples in gauges:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe('selenium_api_requests_total', 'counter', 'Actions handled, by action and HTTP status code.')
+metrics.describe('selenium_api_errors_total', 'counter', 'Actions that raised an exception, by action and exception type.')
+metrics.describe('selenium_api_action_duration_seconds', 'histogram', 'Time spent running an action.', latency_buckets)
+metrics.describe('selenium_api_queue_wait_seconds', 'histogram', 'Time an action waited in the queue of its session.', latency_buckets)
+metrics.describe('selenium_api_webdriver_commands', 'histogram', 'WebDriver commands issued per action.', command_buckets)
+metrics.describe('selenium_api_profile_clone_seconds', 'histogram', 'Time spent cloning a template profile for a session.', latency_buckets)
+metrics.describe('selenium_api_driver_startup_seconds', 'histogram', 'Time taken to launch a browser.', latency_buckets)
+metrics.describe('selenium_api_session_recoveries_total', 'counter', 'Sessions whose browser died, by whether a snapshot restored them.')
+metrics.describe('selenium_api_background_failures_total', 'counter', 'Session checks and evictions run in the background that raised an exception, by task.')
+
+# The timing of the action that runs on the current thread, if any.
+action_context = threading.local()
+
+class ActionTiming:
+    """Collects the timing breakdown and WebDriver command count of one action."""
+
+    def __init__(self, queued_at=None):
+        self.started = time.perf_counter()
+        self.queue_time = self.started - queued_at if queued_at is not None else None
+        self.commands = 0
+        self.browser_time = 0.0
+        self.selector_time = 0.0
+        self.in_selector = False
+        self.exception = None
+
+    def breakdown(self):
+        total = time.perf_counter() - self.started
+        return {
+            'total_ms': round(total * 1000, 3),
+            'queue_ms': round(self.queue_time * 1000, 3) if self.queue_time is not None else None,
+            'selector_ms': round(self.selector_time * 1000, 3),
+            'browser_ms': round(self.browser_time * 1000, 3),
+            'server_ms': round(max(total - self.selector_time - self.browser_time, 0) * 1000, 3),
+            'webdriver_commands': self.commands,
+        }
+
+def current_timing():
+    return getattr(action_context, 'timing', None)
+
+def current_session():
+    """The session of the action running on the current thread, if any."""
+    name = getattr(action_context, 'session_name', None)
+    return sessions.get(name) if name is not None else None
+
+def instrument_driver(driver):
+    """Count the WebDriver commands and browser time of the running action.
+
+    Every command, including those sent by WebElements, goes through
+    ``driver.execute``, so wrapping it on the instance is enough.
+    """
+    execute = driver.execute
+
+    def counted_execute(driver_command, params=None):
+        timing = current_timing()
+        if timing is None:
+            return execute(driver_command, params)
+        started = time.perf_counter()
+        try:
+            return execute(driver_command, params)
+        finally:
+            timing.commands += 1
+            if not timing.in_selector:
+                timing.browser_time += time.perf_counter() - started
+
+    driver.execute = counted_execute
+    return driver
+
+def profile_path(profile):
+    return os.path.join(app_path, "Data/Profiles/" + profile)
+
+def build_chrome_options(profile="", arguments=(), user_data_dir=None):
     chrome_options = uc.ChromeOptions()
     chrome_options.add_argument('--window-size=375x667')
     chrome_options.add_argument("--no-sandbox")
@@ -33,25 +207,1161 @@ def get_session(name, profile = ""):
     chrome_options.add_argument("--disable-renderer-backgrounding")
     chrome_options.add_argument("--disable-webgl")
     chrome_options.add_argument("--disable-software-rasterizer")
+    for argument in arguments:
+        chrome_options.add_argument(argument)
+    if network_capture_enabled:
+        chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+        chrome_options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
 
     profile = profile.lower();
-    if profile != "" and profile != "default":
-        profile_path = os.path.join(app_path, "Data/Profiles/" + profile)
-        chrome_options.user_data_dir = profile_path
+    if user_data_dir is not None:
+        chrome_options.user_data_dir = user_data_dir
+    elif profile != "" and profile != "default":
+        chrome_options.user_data_dir = profile_path(profile)
+    return chrome_options
+
+def launch_driver(profile="", arguments=(), user_data_dir=None):
+    started = time.perf_counter()
+    driver = uc.Chrome(options=build_chrome_options(profile, arguments, user_data_dir))
+    metrics.observe('selenium_api_driver_startup_seconds', time.perf_counter() - started)
+    return instrument_driver(driver)
+
+def is_driver_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+def quit_driver(driver):
+    try:
+        driver.quit()
+    except Exception as e:
+        logger.warning("Error while closing the browser: %s", e)
+
+# Where sessions get their copies of template profiles. Point it at a tmpfs
+# such as /dev/shm to keep the copies in memory.
+clone_dir = os.path.join(app_path, "Data/Clones")
+clone_profiles_by_default = False
+write_back_by_default = False
+
+# Parts of a profile that are not copied into a clone: caches Chrome rebuilds
+# on its own, crash and metrics data, and the lock files of the browser that
+# last used the template.
+profile_skipped_names = {
+    'Cache', 'Code Cache', 'GPUCache', 'GrShaderCache', 'ShaderCache', 'GraphiteDawnCache', 'DawnCache',
+    'DawnGraphiteCache', 'CacheStorage', 'ScriptCache', 'Media Cache', 'Application Cache', 'Crashpad',
+    'Crash Reports', 'BrowserMetrics', 'component_crx_cache', 'optimization_guide_model_store',
+    'SingletonLock', 'SingletonCookie', 'SingletonSocket', 'lockfile', 'BrowserMetrics-spare.pma',
+}
+
+# Files under these directories are never changed in place by Chrome, so a
+# clone can share them with the template through hard links.
+profile_immutable_dirs = {'Extensions'}
+
+FICLONE = 0x40049409
+template_locks = {}
+template_locks_lock = threading.Lock()
+
+def template_lock(path):
+    with template_locks_lock:
+        return template_locks.setdefault(path, threading.Lock())
+
+def ignore_profile_caches(directory, names):
+    return [name for name in names if name in profile_skipped_names]
+
+class ProfileCopier:
+    """Copies files with the fastest method that works for a pair of directories.
+
+    Files are reflinked (copy-on-write, so the copy costs no time or space
+    until either side changes) where the filesystem supports it, immutable
+    extension files are hard linked, and everything else is copied. A method
+    that fails once because of the filesystem is not tried again.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.can_reflink = fcntl is not None
+        self.can_link = True
+        self.counts = {'reflink': 0, 'link': 0, 'copy': 0}
+
+    def copy(self, source, destination):
+        relative = os.path.relpath(source, self.source)
+        if self.can_link and not profile_immutable_dirs.isdisjoint(relative.split(os.sep)[:-1]):
+            try:
+                os.link(source, destination)
+                self.counts['link'] += 1
+                return destination
+            except OSError:
+                self.can_link = False
+        if self.can_reflink:
+            try:
+                with open(source, 'rb') as source_file, open(destination, 'wb') as destination_file:
+                    fcntl.ioctl(destination_file.fileno(), FICLONE, source_file.fileno())
+                shutil.copystat(source, destination)
+                self.counts['reflink'] += 1
+                return destination
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM):
+                    raise
+                self.can_reflink = False
+        shutil.copy2(source, destination)
+        self.counts['copy'] += 1
+        return destination
+
+    def copytree(self, destination):
+        shutil.copytree(self.source, destination, symlinks=True, ignore=ignore_profile_caches, copy_function=self.copy)
+
+def clone_profile(profile, name):
+    """Copy the template profile into a new directory for the session and return its path.
+
+    A template that does not exist yet gives an empty profile.
+    """
+    started = time.perf_counter()
+    template = profile_path(profile)
+    safe_name = re.sub(r'[^\w.-]', '_', name)
+    destination = os.path.join(clone_dir, f'{os.getpid()}-{safe_name}-{base64.urlsafe_b64encode(os.urandom(6)).decode()}')
+    os.makedirs(clone_dir, exist_ok=True)
+    with template_lock(template):
+        if os.path.isdir(template):
+            copier = ProfileCopier(template)
+            copier.copytree(destination)
+        else:
+            copier = None
+            os.makedirs(destination)
+    elapsed = time.perf_counter() - started
+    metrics.observe('selenium_api_profile_clone_seconds', elapsed)
+    logger.info("Cloned profile profile=%s session=%s seconds=%.3f files=%s", profile, name, elapsed, copier.counts if copier else {})
+    return destination
+
+def write_back_profile(profile, clone):
+    """Replace the template profile with the state of a session's clone.
+
+    The clone is copied next to the template first and then swapped in, so
+    a crash never leaves a half-written template behind.
+    """
+    template = profile_path(profile)
+    staging = f'{template}.writeback-{os.getpid()}'
+    shutil.rmtree(staging, ignore_errors=True)
+    ProfileCopier(clone).copytree(staging)
+    with template_lock(template):
+        previous = f'{template}.previous-{os.getpid()}'
+        # Left behind by a write-back that crashed or could not delete it.
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.isdir(template):
+            os.rename(template, previous)
+        os.rename(staging, template)
+        shutil.rmtree(previous, ignore_errors=True)
+    logger.info("Wrote back profile profile=%s", profile)
+
+def remove_stale_clones():
+    """Delete clones left behind by server processes that are no longer running."""
+    if psutil is None or not os.path.isdir(clone_dir):
+        return
+    for entry in os.listdir(clone_dir):
+        pid = entry.split('-', 1)[0]
+        if pid.isdigit() and int(pid) != os.getpid() and not psutil.pid_exists(int(pid)):
+            shutil.rmtree(os.path.join(clone_dir, entry), ignore_errors=True)
+
+class BrowserPool:
+    """A pool of idle, pre-launched drivers for sessions without a profile.
+
+    The pool refills when it has no idle driver left, or fewer than
+    ``min_size``. A background thread then launches drivers one at a time
+    until ``max_size`` are idle. A pool with a ``max_size`` of 0 is disabled
+    and every session launches its own driver.
+    """
+
+    def __init__(self, min_size=0, max_size=0):
+        self.min_size = max(min_size, 0)
+        self.max_size = max(max_size, self.min_size)
+        self.idle = deque()
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopped = False
+        self.refilling = False
+        self.hits = 0
+        self.misses = 0
+        self.launched = 0
+        self.failures = 0
+        self.discarded = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
 
-    driver = uc.Chrome(options=chrome_options)
+    def start(self):
+        if self.enabled and self.thread is None:
+            self.thread = threading.Thread(target=self.refill_loop, name="browser-pool", daemon=True)
+            self.thread.start()
+            self.wakeup.set()
 
-    sessions[name] = driver
+    def stop(self):
+        self.stopped = True
+        self.wakeup.set()
+        with self.lock:
+            drivers = list(self.idle)
+            self.idle.clear()
+        for driver in drivers:
+            quit_driver(driver)
+
+    def acquire(self):
+        """Take an idle driver from the pool, or launch one if none is ready."""
+        while self.enabled:
+            with self.lock:
+                driver = self.idle.popleft() if self.idle else None
+                if driver is None:
+                    self.misses += 1
+            self.wakeup.set()
+            if driver is None:
+                break
+            if is_driver_alive(driver):
+                with self.lock:
+                    self.hits += 1
+                return driver
+            with self.lock:
+                self.discarded += 1
+            quit_driver(driver)
+        return launch_driver()
+
+    def refill_loop(self):
+        failures_in_row = 0
+        while not self.stopped:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            with self.lock:
+                if self.idle and len(self.idle) >= self.min_size:
+                    continue
+                self.refilling = True
+            try:
+                while not self.stopped:
+                    with self.lock:
+                        if len(self.idle) >= self.max_size:
+                            break
+                    try:
+                        driver = launch_driver()
+                    except Exception as e:
+                        failures_in_row += 1
+                        with self.lock:
+                            self.failures += 1
+                        logger.error("Error while launching a pooled browser: %s", e)
+                        time.sleep(min(2 ** failures_in_row, 60))
+                        self.wakeup.set()
+                        break
+                    failures_in_row = 0
+                    with self.lock:
+                        if not self.stopped:
+                            self.idle.append(driver)
+                            self.launched += 1
+                            driver = None
+                    if driver is not None:
+                        quit_driver(driver)
+            finally:
+                with self.lock:
+                    self.refilling = False
+
+    def stats(self):
+        with self.lock:
+            requests_total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self.idle),
+                'refilling': self.refilling,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests_total if requests_total else None,
+                'launched': self.launched,
+                'discarded': self.discarded,
+                'failures': self.failures,
+            }
+
+browser_pool = BrowserPool()
+
+def driver_memory_rss(driver):
+    """Return the resident memory in bytes of the driver's process trees.
+
+    This covers chromedriver and the Chrome browser with all of its child
+    processes. Returns None when psutil is not installed.
+    """
+    if psutil is None:
+        return None
+    root_pids = [getattr(driver, 'browser_pid', None)]
+    service_process = getattr(getattr(driver, 'service', None), 'process', None)
+    root_pids.append(getattr(service_process, 'pid', None))
+    processes = {}
+    for pid in root_pids:
+        if not pid:
+            continue
+        try:
+            root = psutil.Process(pid)
+            processes[root.pid] = root
+            for child in root.children(recursive=True):
+                processes[child.pid] = child
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    rss = 0
+    for process in processes.values():
+        try:
+            rss += process.memory_info().rss
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+    return rss
+
+# Selenium's default timeout for scripts in seconds.
+default_script_timeout = 30
+
+# Content versions kept per session for diffs of get_page_source and get_innerHTML.
+max_content_versions = 16
+
+# Element handles kept per session, the least recently used are dropped first.
+max_element_handles = 1000
+
+class ElementHandle:
+    """A cached element together with the selector and index it was found with.
+
+    ``document`` is the token of the document the element was found in, see
+    document_token_js. A handle is only found again in that same document.
+    """
+
+    def __init__(self, handle_id, selector, index, element, document=None):
+        self.id = handle_id
+        self.selector = selector
+        self.index = index
+        self.element = element
+        self.document = document
+
+class ExpiredHandleError(Exception):
+    """The page of an element handle was replaced by another document."""
+
+# Network capture reads the DevTools performance log, which Chrome only writes
+# when it is enabled at launch, so it is switched on for the whole server.
+network_capture_enabled = False
+default_network_capture_bytes = 16 * 1024 * 1024
+max_network_capture_bytes = 256 * 1024 * 1024
+default_network_body_size = 1024 * 1024
+max_network_pending = 1000
+# Sessions without a capture only empty their log this often (seconds), so
+# Chrome does not buffer it without bound.
+network_discard_interval = 60
+
+class NetworkCapture:
+    """The requests of a session read from the performance log.
+
+    Finished requests are kept in a ring buffer of at most ``max_bytes`` of
+    JSON, the oldest are dropped first. Response bodies are fetched for URLs
+    that match one of the ``body_patterns`` (``*`` wildcards), up to
+    ``max_body_size`` bytes each.
+    """
+
+    def __init__(self, body_patterns=(), max_bytes=default_network_capture_bytes, max_body_size=default_network_body_size):
+        self.body_patterns = list(body_patterns)
+        self.max_bytes = max_bytes
+        self.max_body_size = max_body_size
+        self.capturing = True
+        self.pending = OrderedDict()
+        self.records = deque()
+        self.size = 0
+        self.next_seq = 1
+        self.dropped = 0
+
+    def process(self, driver, entries):
+        for entry in entries:
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, TypeError, ValueError):
+                continue
+            method, event = message.get('method'), message.get('params', {})
+            if method == 'Network.requestWillBeSent':
+                if 'redirectResponse' in event and event['requestId'] in self.pending:
+                    record = self.pending.pop(event['requestId'])
+                    self.read_response(record, event['redirectResponse'])
+                    self.finish(record, event['timestamp'])
+                request = event['request']
+                self.pending[event['requestId']] = {
+                    'request_id': event['requestId'],
+                    'url': request['url'],
+                    'method': request['method'],
+                    'type': event.get('type'),
+                    'request_headers': request.get('headers', {}),
+                    'post_data': request.get('postData'),
+                    'started_at': event.get('wallTime'),
+                    'timestamp': event['timestamp'],
+                    'status': None,
+                }
+                while len(self.pending) > max_network_pending:
+                    self.pending.popitem(last=False)
+                    self.dropped += 1
+            elif method == 'Network.responseReceived' and event['requestId'] in self.pending:
+                self.read_response(self.pending[event['requestId']], event['response'])
+            elif method == 'Network.loadingFinished' and event['requestId'] in self.pending:
+                record = self.pending.pop(event['requestId'])
+                record['encoded_size'] = event.get('encodedDataLength')
+                if any(fnmatch.fnmatchcase(record['url'], pattern) for pattern in self.body_patterns):
+                    self.read_body(driver, record)
+                self.finish(record, event['timestamp'])
+            elif method == 'Network.loadingFailed' and event['requestId'] in self.pending:
+                record = self.pending.pop(event['requestId'])
+                record['error'] = 'canceled' if event.get('canceled') else event.get('errorText')
+                self.finish(record, event['timestamp'])
+
+    def read_response(self, record, response):
+        record.update(status=response.get('status'), status_text=response.get('statusText'),
+                      mime_type=response.get('mimeType'), response_headers=response.get('headers', {}),
+                      remote_address=response.get('remoteIPAddress'), from_cache=response.get('fromDiskCache', False))
+
+    def read_body(self, driver, record):
+        try:
+            body = driver.execute_cdp_cmd('Network.getResponseBody', {'requestId': record['request_id']})
+        except Exception as e:
+            record['body_error'] = str(e).splitlines()[0] if str(e) else type(e).__name__
+            return
+        if len(body['body']) > self.max_body_size:
+            record['body_error'] = f'Body larger than {self.max_body_size} bytes'
+            return
+        record['body'] = body['body']
+        record['body_base64'] = body.get('base64Encoded', False)
+
+    def finish(self, record, timestamp):
+        record['duration_ms'] = round((timestamp - record.pop('timestamp')) * 1000, 3)
+        record['seq'] = self.next_seq
+        self.next_seq += 1
+        size = len(json.dumps(record))
+        self.records.append((size, record))
+        self.size += size
+        while self.size > self.max_bytes:
+            self.size -= self.records.popleft()[0]
+            self.dropped += 1
+
+    def select(self, matches, limit=None, remove=False):
+        """Return the records that match, oldest first, and remove them from the buffer if ``remove``."""
+        selected, kept = [], deque()
+        for size, record in self.records:
+            if matches(record) and (limit is None or len(selected) < limit):
+                selected.append(record)
+                if remove:
+                    self.size -= size
+                    continue
+            kept.append((size, record))
+        self.records = kept
+        return selected
+
+    def stats(self):
+        return {'capturing': self.capturing, 'records': len(self.records), 'pending': len(self.pending),
+                'bytes': self.size, 'max_bytes': self.max_bytes, 'dropped': self.dropped}
+
+def network_filter(params):
+    """Build a record filter from the ``url``, ``method``, ``status``, ``type`` and ``after`` params, raises ValueError."""
+    try:
+        url = re.compile(params['url']) if params.get('url') else None
+    except re.error as e:
+        raise ValueError(f'Invalid url pattern: {e}')
+    method = params.get('method')
+    status = params.get('status')
+    statuses = set(status) if isinstance(status, list) else {status} if status is not None else None
+    if statuses is not None and not all(isinstance(code, int) for code in statuses):
+        raise ValueError('Status must be an integer or a list of integers')
+    resource_type = params.get('type')
+    after = params.get('after', 0)
+    if not isinstance(after, int):
+        raise ValueError('after must be an integer')
+
+    def matches(record):
+        return ((url is None or url.search(record['url']))
+                and (method is None or record['method'].upper() == str(method).upper())
+                and (statuses is None or record['status'] in statuses)
+                and (resource_type is None or str(record['type']).lower() == str(resource_type).lower())
+                and record['seq'] > after)
+    return matches
+
+def collect_network(driver, session):
+    """Read the performance log into the session's network capture, or discard it when not capturing.
+
+    Without a capture the log is only read every ``network_discard_interval``
+    seconds rather than after every action.
+    """
+    if not network_capture_enabled:
+        return
+    capturing = session.network is not None and session.network.capturing
+    now = time.time()
+    if not capturing and now - session.network_log_read_at < network_discard_interval:
+        return
+    entries = driver.get_log('performance')
+    session.network_log_read_at = now
+    if capturing:
+        session.network.process(driver, entries)
+
+class BrowserSession:
+    """A named browser session together with its lifecycle bookkeeping."""
+
+    def __init__(self, name, driver, profile="", preset="default"):
+        self.name = name
+        self.driver = driver
+        self.profile = profile
+        self.preset = preset
+        self.profile_clone = None
+        self.write_back = False
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        self.content_versions = OrderedDict()
+        self.handles = OrderedDict()
+        self.handle_ids = {}
+        self.next_handle = 1
+        self.network = None
+        self.network_log_read_at = self.created_at
+        self.http_client = None
+        self.script_timeout = default_script_timeout
+        self.cookies_dirty = True
+        self.cookies_synced_at = 0
+        self.snapshot_at = 0
+
+    def touch(self):
+        self.last_used = time.time()
+
+    def remember_content(self, scope, tree):
+        """Keep the content tree of a version so later requests can diff against it."""
+        self.content_versions[(scope, tree['h'])] = tree
+        self.content_versions.move_to_end((scope, tree['h']))
+        while len(self.content_versions) > max_content_versions:
+            self.content_versions.popitem(last=False)
+
+    def content_version(self, scope, etag):
+        return self.content_versions.get((scope, etag))
+
+    def add_handle(self, selector, index, element, document):
+        """Return the handle id for the element at ``index`` of ``selector``, reusing an existing one."""
+        handle_id = self.handle_ids.get((selector, index))
+        if handle_id is None:
+            handle_id = f'handle:{self.next_handle}'
+            self.next_handle += 1
+            self.handle_ids[(selector, index)] = handle_id
+            self.handles[handle_id] = ElementHandle(handle_id, selector, index, element, document)
+        else:
+            self.handles[handle_id].element = element
+            self.handles[handle_id].document = document
+        self.handles.move_to_end(handle_id)
+        while len(self.handles) > max_element_handles:
+            dropped = self.handles.popitem(last=False)[1]
+            del self.handle_ids[(dropped.selector, dropped.index)]
+        return handle_id
+
+    def forget_elements(self):
+        """Mark the cached elements stale, they are found again from their selectors when used."""
+        for handle in self.handles.values():
+            handle.element = None
+
+    def clear_handles(self):
+        self.handles.clear()
+        self.handle_ids.clear()
+
+    def info(self, now=None, memory=True):
+        now = now or time.time()
+        return {
+            'name': self.name,
+            'profile': self.profile or 'default',
+            'preset': self.preset,
+            'profile_clone': self.profile_clone,
+            'network_capture': self.network is not None and self.network.capturing,
+            'created_at': self.created_at,
+            'last_used': self.last_used,
+            'age_seconds': round(now - self.created_at, 3),
+            'idle_seconds': round(now - self.last_used, 3),
+            'busy': session_executor.is_busy(self.name),
+            'memory_rss': driver_memory_rss(self.driver) if memory else None,
+        }
+
+sessions_lock = threading.Lock()
+session_creation_locks = {}
+
+def get_session(name, profile = "", preset = "default", clone = None, write_back = None):
+    session = sessions.get(name)
+    if session is not None:
+        session.touch()
+        return session.driver
+
+    # Only one thread may launch the browser for a given name, otherwise two
+    # concurrent first requests would each start a Chrome and leak one.
+    with sessions_lock:
+        creation_lock = session_creation_locks.setdefault(name, threading.Lock())
+    with creation_lock:
+        if name in sessions:
+            return sessions[name].driver
+        with sessions_lock:
+            stale = session_creation_locks.get(name) is not creation_lock
+        if stale:
+            # The session was closed and its lock dropped while we waited.
+            return get_session(name, profile, preset, clone, write_back)
+
+        settings = session_presets[preset]
+        arguments = preset_launch_arguments(settings)
+        profile = profile.lower();
+        has_profile = profile != "" and profile != "default"
+        clone = clone_profiles_by_default if clone is None else clone
+        write_back = write_back_by_default if write_back is None else write_back
+        profile_clone = clone_profile(profile, name) if has_profile and clone else None
+        try:
+            if has_profile or arguments:
+                driver = launch_driver(profile, arguments, profile_clone)
+            else:
+                driver = browser_pool.acquire()
+        except Exception:
+            if profile_clone is not None:
+                shutil.rmtree(profile_clone, ignore_errors=True)
+            raise
+        try:
+            apply_session_preset(driver, settings)
+        except Exception:
+            quit_driver(driver)
+            if profile_clone is not None:
+                shutil.rmtree(profile_clone, ignore_errors=True)
+            raise
+
+        session = BrowserSession(name, driver, profile, preset)
+        session.profile_clone = profile_clone
+        session.write_back = bool(write_back and profile_clone)
+        with sessions_lock:
+            sessions[name] = session
+    session_reaper.enforce_session_limit(keep=name)
     return driver
 
-def prepare_js_environment(driver):
-    driver.execute_script("""
+def close_session(name):
+    """Quit the browser of a session. Returns False if there is no such session."""
+    with sessions_lock:
+        session = sessions.pop(name, None)
+        if session is not None:
+            session_creation_locks.pop(name, None)
+    if session is None:
+        return False
+    if session.http_client is not None:
+        session.http_client.close()
+    quit_driver(session.driver)
+    if session.profile_clone is not None:
+        if session.write_back:
+            try:
+                write_back_profile(session.profile, session.profile_clone)
+            except OSError as e:
+                logger.warning("Could not write back profile=%s: %s", session.profile, e)
+        shutil.rmtree(session.profile_clone, ignore_errors=True)
+    return True
+
+def evict_session(name, last_used, reason):
+    """Close a session unless it has been used since it was picked for eviction."""
+    session = sessions.get(name)
+    if session is None or session.last_used != last_used:
+        return False
+    logger.info("Closing session session=%s reason=%r", name, reason)
+    return close_session(name)
+
+def report_failure(task, name):
+    """A done callback that logs and counts the exception of a background task on a session's queue."""
+    def done(future):
+        if future.cancelled() or future.exception() is None:
+            return
+        logger.error("Background %s of session=%s failed", task, name, exc_info=future.exception())
+        metrics.inc('selenium_api_background_failures_total', (('task', task),))
+    return done
+
+# Snapshots are gzipped JSON files named after the session (or the name asked
+# for), so a session can be continued in a fresh browser or on another host.
+snapshot_dir = os.path.join(app_path, "Data/Snapshots")
+snapshot_version = 1
+# The fields of Network.getAllCookies that Network.setCookies accepts.
+snapshot_cookie_fields = ('name', 'value', 'domain', 'path', 'secure', 'httpOnly', 'sameSite', 'expires', 'priority',
+                          'sameParty', 'sourceScheme', 'sourcePort', 'partitionKey')
+
+page_state_js = """
+function readStorage(storage) {
+    var items = {};
+    for (var i = 0; i < storage.length; i++) {
+        var key = storage.key(i);
+        items[key] = storage.getItem(key);
+    }
+    return items;
+}
+var state = {url: location.href, origin: location.origin, viewport: {width: window.innerWidth, height: window.innerHeight}};
+try {
+    state.local = readStorage(window.localStorage);
+    state.session = readStorage(window.sessionStorage);
+} catch (e) {
+    state.local = null;
+}
+return state;
+"""
+
+# Seeds the storage of a snapshot before the scripts of the page run.
+storage_seed_js = """
+(function(storage) {
+    var items = storage[location.origin];
+    if (!items) {
+        return;
+    }
+    try {
+        Object.keys(items.local || {}).forEach(function(key) { localStorage.setItem(key, items.local[key]); });
+        Object.keys(items.session || {}).forEach(function(key) { sessionStorage.setItem(key, items.session[key]); });
+    } catch (e) {}
+})(%s);
+"""
+
+def snapshot_path(name):
+    return os.path.join(snapshot_dir, quote(str(name), safe='') + '.json.gz')
+
+def take_snapshot(driver, session, origins=()):
+    """Read what a fresh browser needs to continue a session.
+
+    That is the cookies of all domains, the local and session storage of the
+    current page and of the extra ``origins``, the URL and the window size.
+    """
+    state = driver.execute_script(page_state_js)
+    storage = {}
+    if state['local'] is not None and state['origin'] != 'null':
+        storage[state['origin']] = {'local': state['local'], 'session': state['session']}
+    for origin in origins:
+        if origin in storage:
+            continue
+        storage[origin] = {}
+        for kind, is_local in (('local', True), ('session', False)):
+            try:
+                entries = driver.execute_cdp_cmd('DOMStorage.getDOMStorageItems', {'storageId': {'securityOrigin': origin, 'isLocalStorage': is_local}})['entries']
+            except Exception as e:
+                logger.debug("Could not read the %s storage of origin=%s: %s", kind, origin, e)
+                entries = []
+            storage[origin][kind] = dict(entries)
+    return {
+        'version': snapshot_version,
+        'session': session.name,
+        'profile': session.profile or 'default',
+        'preset': session.preset,
+        'created_at': time.time(),
+        'url': state['url'],
+        'viewport': state['viewport'],
+        'window': driver.get_window_size(),
+        'cookies': driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies'],
+        'storage': storage,
+    }
+
+def write_snapshot(name, snapshot):
+    """Write a snapshot file, replacing an earlier one only once it is complete. Returns the path."""
+    os.makedirs(snapshot_dir, exist_ok=True)
+    path = snapshot_path(name)
+    staging = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with gzip.open(staging, 'wt', encoding='utf-8', compresslevel=6) as file:
+        json.dump(snapshot, file, separators=(',', ':'))
+    os.replace(staging, path)
+    return path
+
+def validate_snapshot(snapshot):
+    if (not isinstance(snapshot, dict) or snapshot.get('version') != snapshot_version
+            or not isinstance(snapshot.get('cookies'), list) or not isinstance(snapshot.get('storage'), dict)):
+        raise ValueError(f'Not a snapshot of version {snapshot_version}')
+    return snapshot
+
+def read_snapshot(name):
+    """Return the snapshot saved under a name, or None if there is none."""
+    try:
+        with gzip.open(snapshot_path(name), 'rt', encoding='utf-8') as file:
+            return validate_snapshot(json.load(file))
+    except FileNotFoundError:
+        return None
+
+def restorable_cookie(cookie):
+    restored = {field: cookie[field] for field in snapshot_cookie_fields if field in cookie}
+    if cookie.get('session') or restored.get('expires', -1) < 0:
+        restored.pop('expires', None)
+    return restored
+
+def restore_snapshot(driver, session, snapshot, navigate=True):
+    """Load the cookies, storage and window size of a snapshot and open its page.
+
+    The storage of the page's origin is seeded before the page's own scripts
+    run; the storage of other origins is written through DevTools.
+    """
+    if snapshot['cookies']:
+        driver.execute_cdp_cmd('Network.setCookies', {'cookies': [restorable_cookie(cookie) for cookie in snapshot['cookies']]})
+    window = snapshot.get('window')
+    if window:
+        driver.set_window_size(window['width'], window['height'])
+    storage = snapshot['storage']
+    url = snapshot.get('url') if navigate else None
+    page_origin = None
+    if url and urlsplit(url).scheme in ('http', 'https'):
+        parts = urlsplit(url)
+        page_origin = f'{parts.scheme}://{parts.netloc}'
+        seed = driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': storage_seed_js % json.dumps(storage)})
+        try:
+            session.clear_handles()
+            driver.get(url)
+            wait_until(driver, session, 'presence', 10, 'body')
+        finally:
+            driver.execute_cdp_cmd('Page.removeScriptToEvaluateOnNewDocument', {'identifier': seed['identifier']})
+    for origin, items in storage.items():
+        if origin == page_origin:
+            continue
+        for kind, is_local in (('local', True), ('session', False)):
+            for key, value in (items.get(kind) or {}).items():
+                try:
+                    driver.execute_cdp_cmd('DOMStorage.setDOMStorageItem', {'storageId': {'securityOrigin': origin, 'isLocalStorage': is_local},
+                                                                             'key': key, 'value': value})
+                except Exception as e:
+                    logger.debug("Could not restore the %s storage of origin=%s: %s", kind, origin, e)
+                    break
+    session.cookies_dirty = True
+
+def restore_session(name, snapshot, navigate=True, profile=None, preset=None, clone=None, write_back=None):
+    """Replace a session with a new one (from the pool if it can) restored from a snapshot.
+
+    An open session of that name is closed first, so nothing of its state
+    mixes with the snapshot.
+    """
+    close_session(name)
+    if preset is None:
+        preset = snapshot.get('preset') if snapshot.get('preset') in session_presets else 'default'
+    driver = get_session(name, snapshot.get('profile', 'default') if profile is None else profile, preset, clone, write_back)
+    session = sessions[name]
+    restore_snapshot(driver, session, snapshot, navigate)
+    return session
+
+def recover_session(session):
+    """Replace the dead browser of a session and restore its last snapshot.
+
+    Without a snapshot the session is only closed, and starts fresh the next
+    time it is used.
+    """
+    # A profile copy of a crashed browser is not worth keeping.
+    session.write_back = False
+    close_session(session.name)
+    snapshot = read_snapshot(session.name)
+    if snapshot is None:
+        logger.warning("Browser of session=%s died, closed the session as it has no snapshot", session.name)
+        metrics.inc('selenium_api_session_recoveries_total', (('result', 'closed'),))
+        return False
+    restore_session(session.name, snapshot, True, session.profile or 'default', session.preset, session.profile_clone is not None)
+    sessions[session.name].snapshot_at = time.time()
+    logger.warning("Browser of session=%s died, restored it from the snapshot of %s", session.name,
+                   time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot['created_at'])))
+    metrics.inc('selenium_api_session_recoveries_total', (('result', 'restored'),))
+    return True
+
+def check_session(name, recover, snapshot_interval):
+    """Recover a session whose browser died, or snapshot it if it was used since the last snapshot."""
+    session = sessions.get(name)
+    if session is None:
+        return
+    if not is_driver_alive(session.driver):
+        if recover:
+            recover_session(session)
+        return
+    if snapshot_interval and session.last_used > session.snapshot_at and time.time() - session.snapshot_at >= snapshot_interval:
+        write_snapshot(name, take_snapshot(session.driver, session))
+        session.snapshot_at = time.time()
+
+class SessionWatchdog:
+    """Rebuilds sessions whose browser died and snapshots the sessions in use.
+
+    With ``interval`` every session is checked that often, and a session whose
+    browser no longer answers gets a new browser restored from its last
+    snapshot. With ``snapshot_interval`` sessions used since their last
+    snapshot are snapshotted that often. Busy sessions are skipped, and the
+    checks run on the session's queue so they cannot interrupt a command.
+    """
+
+    def __init__(self, interval=0, snapshot_interval=0):
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def start(self):
+        if (self.interval or self.snapshot_interval) and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="session-watchdog", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        period = min(interval for interval in (self.interval, self.snapshot_interval) if interval)
+        while not self.stopped.wait(period):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error while checking sessions")
+
+    def sweep(self):
+        with sessions_lock:
+            names = list(sessions)
+        for name in names:
+            if not session_executor.is_busy(name):
+                future = session_executor.submit(name, check_session, name, bool(self.interval), self.snapshot_interval)
+                future.add_done_callback(report_failure('check', name))
+
+session_watchdog = SessionWatchdog()
+
+def restore_saved_sessions(worker_index=None, worker_count=None):
+    """Queue the restore of every saved snapshot, only those routed to this worker in a worker process."""
+    try:
+        files = [file for file in os.listdir(snapshot_dir) if file.endswith('.json.gz')]
+    except FileNotFoundError:
+        return
+    for file in files:
+        name = unquote(file[:-len('.json.gz')])
+        if worker_index is not None and zlib.crc32(name.encode()) % worker_count != worker_index:
+            continue
+        session_executor.submit(name, restore_saved_session, name)
+
+def restore_saved_session(name):
+    try:
+        snapshot = read_snapshot(name)
+        if snapshot is not None and snapshot.get('session') == name and name not in sessions:
+            restore_session(name, snapshot)
+            sessions[name].snapshot_at = time.time()
+            logger.info("Restored session=%s from its snapshot", name)
+    except Exception as e:
+        logger.warning("Could not restore session=%s from its snapshot: %s", name, e)
+
+class SessionReaper:
+    """Closes sessions that exceed the configured lifecycle limits.
+
+    Every ``interval`` seconds sessions idle for longer than ``idle_ttl`` are
+    closed, and while the Chrome processes of all sessions use more than
+    ``memory_budget`` bytes the least recently used sessions are closed first.
+    ``max_sessions`` is enforced whenever a session is created by closing the
+    least recently used ones. A limit of 0 disables it. Sessions with queued or
+    running commands are never evicted, and evictions run on the session's
+    queue so they cannot interrupt a command.
+    """
+
+    def __init__(self, idle_ttl=0, max_sessions=0, memory_budget=0, interval=30):
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.memory_budget = memory_budget
+        self.interval = interval
+        self.thread = None
+        self.stopped = threading.Event()
+        self.evicted = 0
+        # Sessions whose eviction is queued but has not run yet.
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+
+    def start(self):
+        if (self.idle_ttl or self.memory_budget) and self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="session-reaper", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("Error while reaping sessions")
+
+    def idle_sessions(self, keep=None):
+        """Sessions that may be evicted, least recently used first."""
+        with sessions_lock:
+            candidates = [session for name, session in sessions.items() if name != keep]
+        candidates = [session for session in candidates if not session_executor.is_busy(session.name)]
+        return sorted(candidates, key=lambda session: session.last_used)
+
+    def evict(self, session, reason):
+        self.evicted += 1
+        with self.pending_lock:
+            self.pending.add(session.name)
+        future = session_executor.submit(session.name, evict_session, session.name, session.last_used, reason)
+        future.add_done_callback(lambda future: self.evicted_session(session.name))
+        future.add_done_callback(report_failure('eviction', session.name))
+
+    def evicted_session(self, name):
+        with self.pending_lock:
+            self.pending.discard(name)
+
+    def enforce_session_limit(self, keep=None):
+        if not self.max_sessions:
+            return
+        with self.pending_lock:
+            pending = len(self.pending)
+        excess = len(sessions) - pending - self.max_sessions
+        for session in self.idle_sessions(keep)[:max(excess, 0)]:
+            self.evict(session, f"more than {self.max_sessions} sessions")
+
+    def sweep(self):
+        candidates = self.idle_sessions()
+        evicted = set()
+        if self.idle_ttl:
+            now = time.time()
+            for session in candidates:
+                if now - session.last_used > self.idle_ttl:
+                    self.evict(session, f"idle for more than {self.idle_ttl} seconds")
+                    evicted.add(session.name)
+        if self.memory_budget and psutil is not None:
+            with sessions_lock:
+                open_sessions = [session for session in sessions.values() if session.name not in evicted]
+            usage = {session.name: driver_memory_rss(session.driver) or 0 for session in open_sessions}
+            total = sum(usage.values())
+            for session in candidates:
+                if total <= self.memory_budget:
+                    break
+                if session.name in evicted:
+                    continue
+                self.evict(session, f"memory budget of {self.memory_budget} bytes exceeded")
+                total -= usage.get(session.name, 0)
+
+session_reaper = SessionReaper()
+
+class SessionExecutor:
+    """Runs commands on a shared thread pool with one FIFO queue per session.
+
+    Commands for the same session run strictly one after another, in the order
+    they were submitted, so a driver is never used by two threads at once.
+    Commands for different sessions run in parallel on up to ``max_workers``
+    threads. After each command the session goes to the back of the pool's
+    queue, so a busy session cannot starve the others.
+    """
+
+    def __init__(self, max_workers=32):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="session")
+        self.lock = threading.Lock()
+        # A session has an entry here exactly while a run_next call for it is
+        # scheduled or running.
+        self.queues = {}
+
+    def submit(self, name, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)`` on the session and return a Future."""
+        future = Future()
+        with self.lock:
+            queue = self.queues.get(name)
+            schedule = queue is None
+            if schedule:
+                queue = self.queues[name] = deque()
+            queue.append((future, fn, args, kwargs))
+        if schedule:
+            self.pool.submit(self.run_next, name)
+        return future
+
+    def run_next(self, name):
+        with self.lock:
+            future, fn, args, kwargs = self.queues[name].popleft()
+        if future.set_running_or_notify_cancel():
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+        with self.lock:
+            if not self.queues[name]:
+                del self.queues[name]
+                return
+        self.pool.submit(self.run_next, name)
+
+    def is_busy(self, name):
+        with self.lock:
+            return name in self.queues
+
+    def stats(self):
+        with self.lock:
+            return {
+                'threads': self.max_workers,
+                'busy_sessions': len(self.queues),
+                'queued_commands': sum(len(queue) for queue in self.queues.values()),
+            }
+
+session_executor = SessionExecutor()
+
+# Actions that do not use a browser and therefore skip the session queues.
+server_actions = {'get_pool_stats', 'list_sessions'}
+
+# Actions that can run twice with the same effect, so they are retried when a
+# cached element went stale. Actions with side effects, like clicks and
+# typing, may have been half done and are not retried.
+stale_retry_actions = {
+    'get_element_info', 'get_all_matching_elements_info', 'get_element_parent_info', 'get_element_children',
+    'check_element_exists', 'count_elements', 'extract_elements', 'get_element_attribute', 'get_all_element_attributes',
+    'set_element_attribute', 'get_innerHTML', 'get_innerHTML_for_each', 'set_innerHTML', 'get_input_value',
+    'set_input_value', 'scroll_to_element', 'wait_for_element',
+}
+
+# Every action perform_action() handles, the values of the metrics' action label.
+known_actions = server_actions | {
+    'close_session', 'create_session', 'restore_session', 'snapshot_session', 'navigate', 'get_current_url',
+    'is_page_loading', 'get_page_source', 'execute_js', 'get_screenshot', 'wait_for_element', 'get_element_info',
+    'get_all_matching_elements_info', 'get_element_parent_info', 'get_element_children', 'check_element_exists',
+    'count_elements', 'extract_elements', 'scrape', 'get_element_attribute', 'get_all_element_attributes',
+    'set_element_attribute', 'get_innerHTML', 'get_innerHTML_for_each', 'set_innerHTML', 'get_input_value',
+    'set_input_value', 'execute_js_on_element', 'click_element', 'paste_text', 'send_enter_key',
+    'scroll_to_element', 'scroll_to_top', 'scroll_to_bottom', 'send_request', 'send_requests',
+    'start_network_capture', 'stop_network_capture', 'get_network_requests', 'drain_network_requests',
+}
+
+def action_name(action):
+    """The action if perform_action() handles it, otherwise ``'unknown'``."""
+    return action if isinstance(action, str) and action in known_actions else 'unknown'
+
+def execute_action(action, params):
+    """Run an action on the worker queue of its session and wait for it."""
+    # Unknown actions are rejected right away, without waiting for the session.
+    if not isinstance(params, dict) or action_name(action) in server_actions | {'unknown'}:
+        return run_action(action, params)
+    return session_executor.submit(params.get("session", "default"), run_action, action, params, time.perf_counter()).result()
+
+# Counts the fetch and XMLHttpRequest calls in flight and remembers when the
+# page last started or finished loading anything.
+network_tracker_js = """
+function installNetworkTracker() {
+    if (window.__seleniumApiNetwork) {
+        return window.__seleniumApiNetwork;
+    }
+    var network = window.__seleniumApiNetwork = {inflight: 0, last: performance.now()};
+    function started() {
+        network.inflight++;
+        network.last = performance.now();
+    }
+    function ended() {
+        network.inflight = Math.max(network.inflight - 1, 0);
+        network.last = performance.now();
+    }
+    if (window.fetch) {
+        var originalFetch = window.fetch;
+        window.fetch = function() {
+            started();
+            return originalFetch.apply(this, arguments).then(function(response) {
+                ended();
+                return response;
+            }, function(error) {
+                ended();
+                throw error;
+            });
+        };
+    }
+    var originalSend = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function() {
+        started();
+        this.addEventListener('loadend', ended, {once: true});
+        return originalSend.apply(this, arguments);
+    };
+    if (window.PerformanceObserver) {
+        try {
+            new PerformanceObserver(function() { network.last = performance.now(); }).observe({entryTypes: ['resource']});
+        } catch (e) {}
+    }
+    return network;
+}
+"""
+
+# Scripts that patch the page for automation. The shims of a session's preset
+# are registered once as on-new-document scripts, so every page the session
+# loads gets them before its own scripts run.
+page_shims = {
+    'animation_frame': """
         window.requestAnimationFrame = function(callback) {
             setTimeout(callback, 16); // Call the callback at ~60 FPS
         };
-    """)
-
-    driver.execute_script("""
+    """,
+    'visibility': """
         window.test = "test";
         Object.defineProperty(document, 'visibilityState', {
             get: function() {
@@ -68,9 +1378,8 @@ def prepare_js_environment(driver):
                 return 'visible';
             }
         });
-    """)
-
-    driver.execute_script("""
+    """,
+    'mouse_move': """
         function simulateMouseMove() {
             var event = new MouseEvent('mousemove', {
                 bubbles: true,
@@ -81,52 +1390,349 @@ def prepare_js_environment(driver):
             document.dispatchEvent(event);
         }
         setInterval(simulateMouseMove, 1000);
-    """)
+    """,
+    'network_tracker': network_tracker_js + "installNetworkTracker();",
+}
 
-def find_elements(driver, css_selector, element_list=None):
-    if element_list is None:
-        element_list = []
+# URL patterns for Network.setBlockedURLs by resource type. Chrome matches
+# the whole URL, so every extension also gets a variant with a query string.
+resource_type_extensions = {
+    'image': ('png', 'jpg', 'jpeg', 'gif', 'webp', 'avif', 'svg', 'ico', 'bmp'),
+    'media': ('mp4', 'webm', 'ogg', 'ogv', 'mp3', 'wav', 'm4a', 'mov', 'm3u8', 'ts'),
+    'font': ('woff', 'woff2', 'ttf', 'otf', 'eot'),
+    'stylesheet': ('css',),
+}
 
-    def find_parent_element(element):
-        try:
-            return driver.execute_script("return arguments[0].parentNode;", element)
-        except NoSuchElementException:
-            raise NoSuchElementException(f'No parent element found for the selector "{css_selector}"')
+tracker_url_patterns = (
+    '*google-analytics.com*', '*googletagmanager.com*', '*googlesyndication.com*', '*doubleclick.net*',
+    '*facebook.net*', '*connect.facebook.com*', '*hotjar.com*', '*segment.io*', '*segment.com/analytics*',
+    '*mixpanel.com*', '*amplitude.com*', '*scorecardresearch.com*', '*quantserve.com*', '*criteo.com*',
+    '*taboola.com*', '*outbrain.com*', '*newrelic.com*', '*nr-data.net*', '*clarity.ms*',
+)
+
+# Named presets chosen with the ``preset`` param of the request that creates a
+# session. ``default`` keeps the behaviour of a plain session.
+#   block: resource types to block (see resource_type_extensions)
+#   block_urls: additional URL patterns to block, ``*`` is a wildcard
+#   block_trackers: block well known analytics and ad hosts
+#   images: False launches Chrome with images disabled (bypasses the pool)
+#   viewport: {width, height, scale, mobile} emulated with DevTools
+#   shims: names of the page_shims to install
+session_presets = {
+    'default': {
+        'shims': ['animation_frame', 'visibility', 'mouse_move'],
+    },
+    'fast': {
+        'block': ['image', 'media', 'font'],
+        'block_trackers': True,
+        'shims': ['animation_frame', 'visibility', 'mouse_move'],
+    },
+    'text': {
+        'block': ['image', 'media', 'font'],
+        'block_trackers': True,
+        'images': False,
+        'shims': ['visibility', 'network_tracker'],
+    },
+    'desktop': {
+        'viewport': {'width': 1366, 'height': 768},
+        'shims': ['animation_frame', 'visibility', 'mouse_move'],
+    },
+}
+
+preset_keys = {'block', 'block_urls', 'block_trackers', 'images', 'viewport', 'shims'}
+
+def validate_preset(name, preset):
+    """Raise ValueError if a preset has unknown keys, resource types or shims."""
+    if not isinstance(preset, dict):
+        raise ValueError(f'Preset {name} must be an object')
+    unknown = set(preset) - preset_keys
+    if unknown:
+        raise ValueError(f'Preset {name} has unknown keys {", ".join(sorted(unknown))}')
+    unknown = set(preset.get('block', ())) - set(resource_type_extensions)
+    if unknown:
+        raise ValueError(f'Preset {name} blocks unknown resource types {", ".join(sorted(unknown))}')
+    unknown = set(preset.get('shims', ())) - set(page_shims)
+    if unknown:
+        raise ValueError(f'Preset {name} has unknown shims {", ".join(sorted(unknown))}')
+    viewport = preset.get('viewport')
+    if viewport is not None and not (isinstance(viewport, dict) and 'width' in viewport and 'height' in viewport):
+        raise ValueError(f'The viewport of preset {name} needs a width and a height')
+
+def load_presets(path):
+    """Add the presets of a JSON file, replacing built-in presets of the same name."""
+    with open(path) as f:
+        presets = json.load(f)
+    if not isinstance(presets, dict):
+        raise ValueError('The presets file must contain an object of presets by name')
+    for name, preset in presets.items():
+        validate_preset(name, preset)
+    session_presets.update(presets)
+
+def preset_launch_arguments(preset):
+    """Chrome arguments a preset needs at launch, drivers from the pool have none."""
+    arguments = []
+    if preset.get('images') is False:
+        arguments.append('--blink-settings=imagesEnabled=false')
+    return arguments
+
+def blocked_url_patterns(preset):
+    patterns = []
+    for resource_type in preset.get('block', ()):
+        for extension in resource_type_extensions[resource_type]:
+            patterns += [f'*.{extension}', f'*.{extension}?*']
+    if preset.get('block_trackers'):
+        patterns += tracker_url_patterns
+    patterns += preset.get('block_urls', ())
+    return patterns
+
+def apply_session_preset(driver, preset):
+    """Configure a freshly launched driver with DevTools commands for a preset."""
+    patterns = blocked_url_patterns(preset)
+    if patterns:
+        driver.execute_cdp_cmd('Network.enable', {})
+        driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    viewport = preset.get('viewport')
+    if viewport:
+        driver.execute_cdp_cmd('Emulation.setDeviceMetricsOverride', {
+            'width': int(viewport['width']),
+            'height': int(viewport['height']),
+            'deviceScaleFactor': viewport.get('scale', 0),
+            'mobile': bool(viewport.get('mobile', False)),
+        })
+    for shim in preset.get('shims', ()):
+        driver.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': page_shims[shim]})
+
+# Selenium's own visibility atom, so ``::visible`` keeps the exact semantics
+# of WebElement.is_displayed() when it is evaluated inside the page.
+is_displayed_js = pkgutil.get_data('selenium.webdriver.remote', 'isDisplayed.js').decode('utf8')
+
+# Resolves the steps of a compiled selector inside the page. Every CSS step is
+# matched inside the first element found so far (or the root for the first
+# step), just like the former step-by-step resolution over WebDriver.
+selector_resolver_js = """
+function resolveSelector(steps, root) {
+    var list = root.nodeType === 1 ? [root] : [];
+    for (var i = 0; i < steps.length; i++) {
+        var step = steps[i];
+        if (step[0] === 'css') {
+            var scope = list.length ? list[0] : root;
+            list = Array.prototype.slice.call(scope.querySelectorAll(step[1]));
+        } else if (step[0] === 'parent') {
+            if (!list.length) {
+                return {error: 'parent'};
+            }
+            list = [list[0].parentNode];
+        } else if (step[0] === 'visible') {
+            list = list.filter(function(element) { return isShown(element); });
+        } else if (step[0] === 'index') {
+            if (step[1] >= list.length) {
+                return {error: 'index', index: step[1]};
+            }
+            list = [list[step[1]]];
+        }
+        if (!list.length) {
+            return [];
+        }
+    }
+    return list;
+}
+"""
 
-    def check_element_visibility(element):
-        return element.is_displayed()
+# Projects an element onto the requested fields. Used by the bulk extraction
+# so all matches are read in the same call that resolves the selector.
+element_extractor_js = """
+function extractElement(element, fields, attributeNames) {
+    var info = {};
+    for (var i = 0; i < fields.length; i++) {
+        var field = fields[i];
+        if (field === 'tag_name') {
+            // Lowercased like ChromeDriver's Get Element Tag Name, which
+            // get_element_info reads, so SVG's foreignObject is foreignobject
+            // in every action.
+            info.tag_name = element.tagName.toLowerCase();
+        } else if (field === 'attributes') {
+            var attributes = {};
+            if (attributeNames) {
+                for (var j = 0; j < attributeNames.length; j++) {
+                    attributes[attributeNames[j]] = element.getAttribute(attributeNames[j]);
+                }
+            } else {
+                for (var j = 0; j < element.attributes.length; j++) {
+                    var attr = element.attributes[j];
+                    attributes[attr.name] = attr.value;
+                }
+            }
+            info.attributes = attributes;
+        } else if (field === 'text') {
+            info.text = element.innerText !== undefined ? element.innerText : element.textContent;
+        } else if (field === 'innerHTML') {
+            info.innerHTML = element.innerHTML;
+        } else if (field === 'outerHTML') {
+            info.outerHTML = element.outerHTML;
+        } else if (field === 'rect') {
+            var rect = element.getBoundingClientRect();
+            info.rect = {x: rect.x, y: rect.y, width: rect.width, height: rect.height};
+        } else if (field === 'visible') {
+            info.visible = isShown(element);
+        } else if (field === 'child_count') {
+            info.child_count = element.children.length;
+        } else if (field === 'children') {
+            info.children = Array.prototype.map.call(element.children, function(child) {
+                return extractElement(child, ['tag_name', 'attributes'], null);
+            });
+        } else if (field === 'handle') {
+            info.handle = element;
+        }
+    }
+    return info;
+}
+"""
+
+@functools.lru_cache(maxsize=2)
+def page_helpers_js(needs_visibility):
+    """The in-page helper functions, with the visibility atom only if needed."""
+    return "var isShown = " + (is_displayed_js if needs_visibility else "null") + ";\n" + selector_resolver_js + element_extractor_js
+
+class CompiledSelector:
+    """A selector with ``::`` modifiers compiled into an in-page routine."""
+
+    def __init__(self, selector, steps):
+        self.selector = selector
+        self.steps = steps
+        self.needs_visibility = any(step[0] == 'visible' for step in steps)
+        self.script = page_helpers_js(self.needs_visibility) + "return resolveSelector(" + json.dumps(steps) + ", arguments[0] || document);"
+
+    def check_result(self, result):
+        """Turn the error markers of resolveSelector into exceptions."""
+        if isinstance(result, dict) and 'error' in result:
+            if result['error'] == 'index':
+                raise NoSuchElementException(f'No element found with the selector "{self.selector}" at index {result["index"]}')
+            raise IndexError('list index out of range')
+        return result
 
+@functools.lru_cache(maxsize=1024)
+def compile_selector(css_selector):
+    """Parse a selector with ``::parent``, ``::visible`` and ``::N`` modifiers.
+
+    Plain CSS parts become ``css`` steps. Unknown modifiers are ignored. A
+    selector without modifiers is a single ``css`` step, matched as a whole
+    like find_elements() does, so descendant combinators and quoted spaces
+    keep their CSS meaning.
+    """
     if "::" not in css_selector:
-        print("css_selector:"+css_selector)
-        if element_list:
-            return element_list[0].find_elements(By.CSS_SELECTOR, css_selector)
-        else:
-            return driver.find_elements(By.CSS_SELECTOR, css_selector)
+        return CompiledSelector(css_selector, [['css', css_selector.strip()]] if css_selector.strip() else [])
     css_selector = re.sub(r'\s?([>+~])\s?', lambda match: match.group(1), css_selector)
     css_selector = css_selector.replace("::", " ::")
-    print("processed:"+css_selector)
-    parts = css_selector.split(" ")
-
-    for index, part in enumerate(parts):
-        print("part:"+part)
+    steps = []
+    for part in css_selector.split(" "):
         if part.startswith("::"):
             modifier = part[2:]
             if modifier == "parent":
-                element_list = [find_parent_element(element_list[0])]
+                steps.append(['parent'])
             elif modifier == "visible":
-                element_list = [e for e in element_list if check_element_visibility(e)]
+                steps.append(['visible'])
             elif modifier.isdigit():
-                index = int(modifier)
-                if 0 <= index < len(element_list):
-                    element_list = [element_list[index]]
-                else:
-                    raise NoSuchElementException(f'No element found with the selector "{css_selector}" at index {index}')
-        else:  # Regular CSS selector
-            element_list = find_elements(driver, part, element_list)
-        if not element_list:
-            return []
+                steps.append(['index', int(modifier)])
+        elif part:  # Regular CSS selector
+            steps.append(['css', part])
+    return CompiledSelector(css_selector, steps)
+
+handle_pattern = re.compile(r'\s*(handle:\d+)\s*(.*)', re.DOTALL)
+
+def split_handle(css_selector):
+    """Split a selector that starts with an element handle into the handle id and the rest."""
+    match = handle_pattern.fullmatch(css_selector)
+    if match is None:
+        return None, css_selector
+    return match.group(1), match.group(2)
+
+# A random token that identifies the current document, set on first use. A
+# new document, whether from navigate, a click, a form or history, has none.
+document_token_js = """
+if (!window.__seleniumApiDocument) {
+    window.__seleniumApiDocument = Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+return window.__seleniumApiDocument;
+"""
 
-    return element_list
+def document_token(driver):
+    return driver.execute_script(document_token_js)
+
+def resolve_handle(driver, handle_id):
+    """Return the element of a handle, finding it again from its selector if it went stale.
+
+    Raises ExpiredHandleError instead when the page is another document than
+    the one the handle was created in.
+    """
+    session = current_session()
+    handle = session.handles.get(handle_id) if session is not None else None
+    if handle is None:
+        raise NoSuchElementException(f'Unknown element handle {handle_id}')
+    session.handles.move_to_end(handle_id)
+    if handle.element is None:
+        if document_token(driver) != handle.document:
+            raise ExpiredHandleError(f'Element handle {handle_id} expired, the page it was created on was replaced')
+        elements = find_elements(driver, handle.selector)
+        if handle.index >= len(elements):
+            raise NoSuchElementException(f'Element handle {handle_id} no longer matches "{handle.selector}" at index {handle.index}')
+        handle.element = elements[handle.index]
+    return handle.element
+
+def selector_root(driver, css_selector):
+    """Return the element a selector is relative to (None for the document) and the rest of the selector."""
+    handle_id, rest = split_handle(css_selector)
+    if handle_id is None:
+        return None, css_selector
+    return resolve_handle(driver, handle_id), rest
+
+def find_elements(driver, css_selector):
+    logger.debug("Resolving selector selector=%r", css_selector)
+    timing = current_timing()
+    if timing is not None:
+        timing.in_selector = True
+    started = time.perf_counter()
+    try:
+        root, css_selector = selector_root(driver, css_selector)
+        if not css_selector:
+            return [root]
+        if "::" not in css_selector:
+            return (root or driver).find_elements(By.CSS_SELECTOR, css_selector)
+        compiled = compile_selector(css_selector)
+        return compiled.check_result(driver.execute_script(compiled.script, root))
+    finally:
+        if timing is not None:
+            timing.in_selector = False
+            timing.selector_time += time.perf_counter() - started
+
+element_fields = ('tag_name', 'attributes', 'text', 'innerHTML', 'outerHTML', 'rect', 'visible', 'child_count', 'children', 'handle')
+
+extraction_js = """
+var elements = resolveSelector(arguments[0], arguments[5] || document);
+if (!Array.isArray(elements)) {
+    return elements;
+}
+var fields = arguments[1], attributeNames = arguments[2], offset = arguments[3], limit = arguments[4];
+var page = elements.slice(offset, limit === null ? undefined : offset + limit);
+return {total: elements.length, items: page.map(function(element) {
+    return extractElement(element, fields, attributeNames);
+}), document: fields.indexOf('handle') !== -1 ? (function() {%s})() : null};
+""" % document_token_js
+
+def extract_elements(driver, css_selector, fields=('tag_name', 'attributes'), attribute_names=None, offset=0, limit=None):
+    """Resolve a selector and read the given fields of every match in one call.
+
+    Returns a ``(total, items)`` tuple where ``total`` is the number of matches
+    and ``items`` holds one dict per match between ``offset`` and ``limit``.
+    """
+    root, rest = selector_root(driver, css_selector)
+    compiled = compile_selector(rest)
+    script = page_helpers_js(compiled.needs_visibility or 'visible' in fields) + extraction_js
+    result = compiled.check_result(driver.execute_script(script, compiled.steps, list(fields), attribute_names, offset, limit, root))
+    if 'handle' in fields:
+        session = current_session()
+        for index, item in enumerate(result['items'], offset):
+            item['handle'] = session.add_handle(css_selector, index, item['handle'], result['document'])
+    return result['total'], result['items']
 
 def find_element(driver, css_selector):
     element_list = find_elements(driver, css_selector)
@@ -135,30 +1741,734 @@ def find_element(driver, css_selector):
     else:
         raise NoSuchElementException(f'No element found with the selector "{css_selector}"')
 
+# Resolves as soon as the condition holds, re-checking on DOM mutations and
+# ready state changes instead of polling over WebDriver. Conditions that can
+# change without a mutation (layout, network) are also re-checked by a cheap
+# in-page timer.
+wait_js = network_tracker_js + """
+var done = arguments[arguments.length - 1];
+var steps = arguments[0], condition = arguments[1], options = arguments[2], timeout = arguments[3], root = arguments[4] || document;
+var finished = false, observer = null, timers = [];
+var network = condition === 'network_idle' ? installNetworkTracker() : null;
+function matchingElements() {
+    var elements = resolveSelector(steps, root);
+    return Array.isArray(elements) ? elements : [];
+}
+function elementText(element) {
+    return element.innerText !== undefined ? element.innerText : element.textContent;
+}
+function check() {
+    if (condition === 'ready_state') {
+        var state = document.readyState;
+        return state === 'complete' || (options.state === 'interactive' && state === 'interactive') ? {state: state} : null;
+    }
+    if (condition === 'network_idle') {
+        return network.inflight === 0 && performance.now() - network.last >= options.idle_time ? {} : null;
+    }
+    var elements = matchingElements();
+    if (condition === 'visible') {
+        elements = elements.filter(function(element) { return isShown(element); });
+    } else if (condition === 'unscraped') {
+        elements = elements.filter(function(element) { return !element.__seleniumApiScraped; });
+    } else if (condition === 'text') {
+        var pattern = options.pattern ? new RegExp(options.pattern) : null;
+        elements = elements.filter(function(element) {
+            var text = elementText(element);
+            return pattern ? pattern.test(text) : text.indexOf(options.text) !== -1;
+        });
+    }
+    if (condition === 'count') {
+        return elements.length >= options.count ? {count: elements.length} : null;
+    }
+    return elements.length ? {count: elements.length} : null;
+}
+function finish(result) {
+    if (finished) {
+        return;
+    }
+    finished = true;
+    if (observer) {
+        observer.disconnect();
+    }
+    timers.forEach(function(timer) { clearTimeout(timer); clearInterval(timer); });
+    document.removeEventListener('readystatechange', update);
+    done(result);
+}
+function update() {
+    if (finished) {
+        return;
+    }
+    var result;
+    try {
+        result = check();
+    } catch (e) {
+        finish({ok: false, error: String(e)});
+        return;
+    }
+    if (result) {
+        result.ok = true;
+        finish(result);
+    }
+}
+update();
+if (!finished) {
+    timers.push(setTimeout(function() { finish({ok: false}); }, timeout));
+    document.addEventListener('readystatechange', update);
+    if (condition !== 'ready_state' && condition !== 'network_idle') {
+        observer = new MutationObserver(update);
+        observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    }
+    if (condition === 'visible' || condition === 'text' || condition === 'network_idle') {
+        timers.push(setInterval(update, condition === 'network_idle' ? 50 : 100));
+    }
+}
+"""
+
+wait_conditions = ('presence', 'visible', 'text', 'count', 'ready_state', 'network_idle')
+selector_wait_conditions = ('presence', 'visible', 'text', 'count')
 
-@app.route('/execute', methods=['POST'])
-def execute():
+def wait_until(driver, session, condition='presence', timeout=10, css_selector=None, options=None):
+    """Wait inside the page until a condition holds, or raise TimeoutException.
+
+    The page resolves the wait the moment the condition holds and gives up
+    exactly at the timeout. If the page navigates while waiting, the wait
+    continues in the new document with the remaining time.
+    """
+    deadline = time.monotonic() + timeout
+    root, css_selector = selector_root(driver, css_selector) if css_selector else (None, None)
+    compiled = compile_selector(css_selector) if css_selector or root is not None else None
+    script = page_helpers_js(condition == 'visible' or (compiled is not None and compiled.needs_visibility)) + wait_js
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        # The page enforces the timeout, the script timeout is only a safety net.
+        if session.script_timeout < remaining + 5:
+            session.script_timeout = max(remaining + 5, default_script_timeout)
+            driver.set_script_timeout(session.script_timeout)
+        try:
+            result = driver.execute_async_script(script, compiled.steps if compiled else [], condition, options or {}, int(remaining * 1000), root)
+        except JavascriptException as e:
+            if 'unload' not in str(e).lower():
+                raise
+            continue
+        if result and result.get('ok'):
+            return result
+        if result and result.get('error'):
+            raise JavascriptException(result['error'])
+        break
+    target = f'selector {css_selector}' if css_selector else 'the page'
+    raise TimeoutException(f'Timed out after {timeout} seconds waiting for {target} to be {condition}')
+
+# Extracts the records of up to limit rows. Rows are marked as scraped, so
+# pagination can skip and wait for rows that were not seen before. A marker
+# rather than a position also works for lists that remove rows scrolled away.
+scrape_js = """
+var rows = resolveSelector(arguments[0], document), fields = arguments[1], unscraped = arguments[2], limit = arguments[3];
+if (!Array.isArray(rows)) {
+    return rows;
+}
+var total = rows.length;
+if (unscraped) {
+    rows = rows.filter(function(row) { return !row.__seleniumApiScraped; });
+}
+function extractValue(element, extract, attribute) {
+    return extract === 'attribute' ? element.getAttribute(attribute) : extractElement(element, [extract], null)[extract];
+}
+var records = [];
+var end = limit === null ? rows.length : Math.min(rows.length, limit);
+for (var i = 0; i < end; i++) {
+    var row = rows[i], record = {};
+    for (var j = 0; j < fields.length; j++) {
+        var field = fields[j];
+        var matches = field[1].length ? resolveSelector(field[1], row) : [row];
+        var values = (Array.isArray(matches) ? matches : []).map(function(element) {
+            return extractValue(element, field[2], field[3]);
+        });
+        record[field[0]] = field[4] ? values : (values.length ? values[0] : null);
+    }
+    row.__seleniumApiScraped = true;
+    records.push(record);
+}
+return {total: total, records: records};
+"""
+
+scrape_extractors = {'text': 'text', 'html': 'innerHTML', 'outer_html': 'outerHTML', 'attribute': 'attribute'}
+pagination_types = ('next', 'scroll', 'url')
+max_scrape_pages = 1000
+
+class ScrapeSchema:
+    """A validated scrape schema: a row selector and the fields read from every row.
+
+    Fields are a sub-selector (plain or with modifiers, matched inside the
+    row; none reads the row itself) or an object with ``selector``,
+    ``extract`` (text, html, outer_html or attribute), ``attribute`` and
+    ``all`` to return every match instead of the first. Raises ValueError.
+    """
+
+    def __init__(self, schema):
+        if not isinstance(schema, dict) or not isinstance(schema.get('rows'), str) or not schema['rows']:
+            raise ValueError('Schema needs a rows selector')
+        fields = schema.get('fields')
+        if not isinstance(fields, dict) or not fields:
+            raise ValueError('Schema needs at least one field')
+        self.rows = compile_selector(schema['rows'])
+        self.fields = []
+        needs_visibility = self.rows.needs_visibility
+        for name, spec in fields.items():
+            if isinstance(spec, str):
+                spec = {'selector': spec}
+            if not isinstance(spec, dict):
+                raise ValueError(f'Field {name} must be a selector or an object')
+            extract = spec.get('extract', 'text')
+            if extract not in scrape_extractors:
+                raise ValueError(f'Unknown extractor {extract} for field {name}, use one of {", ".join(scrape_extractors)}')
+            if extract == 'attribute' and not spec.get('attribute'):
+                raise ValueError(f'Field {name} needs an attribute')
+            selector = compile_selector(spec['selector']) if spec.get('selector') else None
+            needs_visibility = needs_visibility or (selector is not None and selector.needs_visibility)
+            self.fields.append([name, selector.steps if selector else [], scrape_extractors[extract], spec.get('attribute'), bool(spec.get('all'))])
+        self.script = page_helpers_js(needs_visibility) + scrape_js
+
+    def extract(self, driver, unscraped=False, limit=None):
+        """Return the number of rows and the records of the rows, only of those not scraped before if ``unscraped``."""
+        result = self.rows.check_result(driver.execute_script(self.script, self.rows.steps, self.fields, unscraped, limit))
+        return result['total'], result['records']
+
+def scrape_pagination(pagination):
+    """Validate a pagination rule and fill in its defaults, raises ValueError."""
+    if pagination is None:
+        return {'type': None, 'max_pages': 1}
+    if not isinstance(pagination, dict) or pagination.get('type') not in pagination_types:
+        raise ValueError(f'Pagination needs a type, one of {", ".join(pagination_types)}')
+    pagination = dict(pagination)
+    max_pages = pagination.setdefault('max_pages', 10)
+    if not isinstance(max_pages, int) or not 1 <= max_pages <= max_scrape_pages:
+        raise ValueError(f'max_pages must be an integer between 1 and {max_scrape_pages}')
     try:
-        action = request.json.get('action')
-        params = request.json.get('params')
+        pagination['timeout'] = float(pagination.get('timeout', 10))
+        pagination['idle_time'] = float(pagination.get('idle_time', 2000))
+    except (TypeError, ValueError):
+        raise ValueError('timeout and idle_time must be numbers')
+    if pagination['type'] == 'next' and not pagination.get('selector'):
+        raise ValueError('Pagination by next button needs a selector')
+    if pagination['type'] == 'url':
+        if '{page}' not in str(pagination.get('template', '')):
+            raise ValueError('Pagination by url needs a template with {page}')
+        if not isinstance(pagination.setdefault('start', 1), int):
+            raise ValueError('start must be an integer')
+    return pagination
+
+def scrape_pages(driver, session, schema, pagination, max_records=None, sink=None, cancelled=None):
+    """Extract the records of every page, following the pagination rule.
+
+    The records of each page are passed to ``sink`` as soon as they are read.
+    Returns a ``(pages, count, stop_reason)`` tuple.
+    """
+    kind = pagination['type']
+    pages = count = 0
+    while True:
+        if kind == 'url':
+            session.clear_handles()
+            driver.get(pagination['template'].replace('{page}', str(pagination['start'] + pages)))
+            wait_until(driver, session, 'presence', pagination['timeout'], 'body')
+        # Rows that stay on the page (load more buttons, infinite scroll) are
+        # read once; the first page reads every row, even if scraped before.
+        total, records = schema.extract(driver, pages > 0 and kind != 'url',
+                                        None if max_records is None else max_records - count)
+        pages += 1
+        count += len(records)
+        if records and sink is not None:
+            sink(records)
+        if cancelled is not None and cancelled.is_set():
+            return pages, count, 'cancelled'
+        if max_records is not None and count >= max_records:
+            return pages, count, 'max_records'
+        if kind is None:
+            return pages, count, 'done'
+        if kind == 'url' and not total:
+            return pages, count, 'last_page'
+        if pages >= pagination['max_pages']:
+            return pages, count, 'max_pages'
+        if kind == 'next':
+            buttons = [button for button in find_elements(driver, pagination['selector']) if button.is_enabled()]
+            if not buttons:
+                return pages, count, 'last_page'
+            buttons[0].click()
+            try:
+                wait_until(driver, session, 'unscraped', pagination['timeout'], schema.rows.selector)
+            except TimeoutException:
+                return pages, count, 'timeout'
+        elif kind == 'scroll':
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            try:
+                wait_until(driver, session, 'unscraped', pagination['idle_time'] / 1000, schema.rows.selector)
+            except TimeoutException:
+                return pages, count, 'last_page'
+
+class RecordStream:
+    """Hands the records of a scrape from the session thread to a streamed response."""
+
+    def __init__(self, max_pending=64):
+        self.pending = queue.Queue(max_pending)
+        self.cancelled = threading.Event()
+
+    def put(self, records):
+        # Wait for a slow client, but give up once it disconnected.
+        while not self.cancelled.is_set():
+            try:
+                self.pending.put(records, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def run(self, params, queued_at):
+        action_context.record_stream = self
+        try:
+            return run_action('scrape', params, queued_at)
+        finally:
+            action_context.record_stream = None
+            self.put(None)
+
+    def lines(self, future):
+        """Yield one NDJSON line per record and finally the response of the action."""
+        try:
+            while True:
+                records = self.pending.get()
+                if records is None:
+                    break
+                yield ''.join(json.dumps(record) + '\n' for record in records)
+            response, status = future.result()
+            yield json.dumps(response) + '\n'
+        finally:
+            self.cancelled.set()
+
+
+# Hashes the content below a container (the document or an element) as a tree
+# of child nodes, down to ``depth`` levels. Interior nodes are hashed from
+# their start tag and the hashes of their children, so every character of the
+# content is serialized and hashed only once. The root hash is used as ETag.
+content_tree_js = """
+function hashString(text) {
+    var h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+    for (var i = 0; i < text.length; i++) {
+        var ch = text.charCodeAt(i);
+        h1 = Math.imul(h1 ^ ch, 2654435761);
+        h2 = Math.imul(h2 ^ ch, 1597334677);
+    }
+    h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+    h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+    return ('0000000' + (h2 >>> 0).toString(16)).slice(-8) + ('0000000' + (h1 >>> 0).toString(16)).slice(-8);
+}
+function nodeHtml(node) {
+    if (node.nodeType === 1) {
+        return node.outerHTML;
+    }
+    if (node.nodeType === 3) {
+        var parent = node.parentNode ? node.parentNode.nodeName : '';
+        if (/^(SCRIPT|STYLE|XMP|IFRAME|NOEMBED|NOFRAMES|PLAINTEXT|NOSCRIPT)$/.test(parent)) {
+            return node.data;
+        }
+        return node.data.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/\\u00a0/g, '&nbsp;');
+    }
+    if (node.nodeType === 8) {
+        return '<!--' + node.data + '-->';
+    }
+    if (node.nodeType === 10) {
+        return '<!DOCTYPE ' + node.name + '>';
+    }
+    return '';
+}
+function startTag(element) {
+    var tag = '<' + element.tagName;
+    for (var i = 0; i < element.attributes.length; i++) {
+        tag += ' ' + element.attributes[i].name + '="' + element.attributes[i].value + '"';
+    }
+    return tag + '>';
+}
+function nodeTree(node, depth) {
+    if (node.nodeType !== 1 || depth <= 0 || node.tagName === 'TEMPLATE') {
+        return {h: hashString(nodeHtml(node))};
+    }
+    var children = childTrees(node, depth);
+    var tag = hashString(startTag(node));
+    return {h: hashString(tag + children.map(function(child) { return child.h; }).join('')), t: tag, c: children};
+}
+function childTrees(container, depth) {
+    return Array.prototype.map.call(container.childNodes, function(child) { return nodeTree(child, depth - 1); });
+}
+function containerTree(container, depth) {
+    var children = childTrees(container, depth);
+    return {h: hashString(children.map(function(child) { return child.h; }).join('')), c: children};
+}
+function containerContent(container) {
+    return container === document ? new XMLSerializer().serializeToString(document) : container.innerHTML;
+}
+"""
+
+content_tree_script = content_tree_js + """
+var container = arguments[0] || document;
+return {tree: containerTree(container, arguments[1]), content: arguments[2] ? containerContent(container) : null};
+"""
+
+# Returns the HTML of the nodes at the given paths, or null if any of them no
+# longer has the expected hash because the page changed in the meantime.
+content_nodes_script = content_tree_js + """
+var container = arguments[0] || document, depth = arguments[1], nodes = arguments[2];
+var htmls = [];
+for (var i = 0; i < nodes.length; i++) {
+    var node = container, path = nodes[i][0];
+    for (var j = 0; j < path.length && node; j++) {
+        node = node.childNodes[path[j]];
+    }
+    if (!node || nodeTree(node, depth - path.length).h !== nodes[i][1]) {
+        return null;
+    }
+    htmls.push(nodeHtml(node));
+}
+return htmls;
+"""
+
+def diff_content_trees(old, new, old_path=(), new_path=()):
+    """Compare the children of two content trees.
+
+    Returns a list of splices ``{'path', 'start', 'end', 'nodes'}``: the child
+    nodes ``start`` to ``end`` of the node at ``path`` in the old version are
+    replaced by the nodes of the new version listed in ``nodes`` as
+    ``(path, hash)`` pairs. Paths are lists of child node indexes. Splices are
+    ordered so they can be applied one after another to the old version.
+    """
+    changes = []
+    old_children, new_children = old['c'], new['c']
+    matcher = difflib.SequenceMatcher(None, [child['h'] for child in old_children], [child['h'] for child in new_children], autojunk=False)
+    for tag, i1, i2, j1, j2 in reversed(matcher.get_opcodes()):
+        if tag == 'equal':
+            continue
+        if tag == 'replace' and i2 - i1 == j2 - j1:
+            for offset in reversed(range(i2 - i1)):
+                old_child, new_child = old_children[i1 + offset], new_children[j1 + offset]
+                if 'c' in old_child and 'c' in new_child and old_child['t'] == new_child['t']:
+                    changes.extend(diff_content_trees(old_child, new_child, old_path + (i1 + offset,), new_path + (j1 + offset,)))
+                else:
+                    changes.append({'path': list(old_path), 'start': i1 + offset, 'end': i1 + offset + 1,
+                                    'nodes': [(list(new_path + (j1 + offset,)), new_child['h'])]})
+            continue
+        changes.append({'path': list(old_path), 'start': i1, 'end': i2,
+                        'nodes': [(list(new_path + (j,)), new_children[j]['h']) for j in range(j1, j2)]})
+    return changes
+
+max_diff_depth = 10
+
+def get_versioned_content(driver, session, scope, element, params, message):
+    """Return page or element content with ETag and diff support.
+
+    With an ``etag`` param equal to the current version only a "not modified"
+    reply is sent. With ``diff`` and the ``etag`` of an earlier version the
+    session still remembers, only the changed subtrees are sent. Otherwise the
+    full content is returned. Every reply carries the ``etag`` of the version,
+    which depends on the ``diff_depth``.
+    """
+    etag = params.get('etag')
+    depth = params.get('diff_depth', 3)
+    if not isinstance(depth, int) or not 1 <= depth <= max_diff_depth:
+        return {'status': 'error', 'message': f'Diff depth must be an integer between 1 and {max_diff_depth}'}, 400
+    scope = f'{scope}:{depth}'
+    base = session.content_version(scope, etag) if params.get('diff') and etag else None
+    result = driver.execute_script(content_tree_script, element, depth, base is None and etag is None)
+    tree = result['tree']
+    if etag == tree['h']:
+        return {'status': 'success', 'message': 'Not modified', 'not_modified': True, 'etag': etag}, 200
+    session.remember_content(scope, tree)
+    if base is not None:
+        changes = diff_content_trees(base, tree)
+        nodes = [node for change in changes for node in change['nodes']]
+        htmls = driver.execute_script(content_nodes_script, element, depth, nodes) if nodes else []
+        if htmls is not None:
+            htmls = iter(htmls)
+            for change in changes:
+                change['html'] = [next(htmls) for node in change.pop('nodes')]
+            return {'status': 'success', 'message': f'{message}: {len(changes)} changes', 'data': {'base': etag, 'changes': changes}, 'diff': True, 'etag': tree['h']}, 200
+    content = result['content']
+    if content is None:
+        content = driver.execute_script(content_tree_js + "return containerContent(arguments[0] || document);", element)
+    return {'status': 'success', 'message': message, 'data': content, 'etag': tree['h']}, 200
+
+screenshot_formats = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+
+def screenshot_options(params):
+    """Validate the screenshot params and return ``(format, quality, scale)``."""
+    image_format = str(params.get('format') or 'png').lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in screenshot_formats:
+        raise ValueError(f'Unsupported image format {image_format}, use png, jpeg or webp')
+    quality = params.get('quality')
+    if quality is not None:
+        quality = int(quality)
+        if not 0 <= quality <= 100:
+            raise ValueError('Quality must be between 0 and 100')
+    scale = float(params.get('scale') or 1)
+    if not 0 < scale <= 4:
+        raise ValueError('Scale must be greater than 0 and at most 4')
+    return image_format, quality, scale
+
+def capture_screenshot(driver, image_format='png', quality=None, css_selector=None, scale=1):
+    """Capture a screenshot with the DevTools protocol and return it base64 encoded.
+
+    With a selector only the element is captured, even if it is outside the
+    viewport. A scale below 1 downscales the image inside the browser.
+    """
+    command = {'format': image_format, 'fromSurface': True}
+    if quality is not None and image_format != 'png':
+        command['quality'] = quality
+    clip = None
+    if css_selector:
+        element = find_element(driver, css_selector)
+        clip = driver.execute_script("""
+            var rect = arguments[0].getBoundingClientRect();
+            return {x: rect.left + window.scrollX, y: rect.top + window.scrollY, width: rect.width, height: rect.height};
+        """, element)
+        command['captureBeyondViewport'] = True
+    elif scale != 1:
+        clip = driver.execute_script("return {x: window.scrollX, y: window.scrollY, width: window.innerWidth, height: window.innerHeight};")
+    if clip is not None:
+        clip['scale'] = scale
+        command['clip'] = clip
+    return driver.execute_cdp_cmd('Page.captureScreenshot', command)['data']
+
+# Replaces the content of an input, textarea or contenteditable element in one
+# script. ``select`` only focuses the element and selects its content for
+# Input.insertText, ``native`` sets the value through the native setter (so
+# frameworks like React notice it) and ``paste_event`` dispatches a paste
+# event with its own DataTransfer, inserting the text unless the page handles
+# the event itself.
+text_entry_js = """
+var element = arguments[0], text = arguments[1], mode = arguments[2];
+var isField = element instanceof HTMLInputElement || element instanceof HTMLTextAreaElement;
+element.focus();
+if (isField) {
+    element.select();
+} else {
+    var range = document.createRange();
+    range.selectNodeContents(element);
+    var selection = window.getSelection();
+    selection.removeAllRanges();
+    selection.addRange(range);
+}
+if (mode === 'native' && isField) {
+    var prototype = element instanceof HTMLInputElement ? HTMLInputElement.prototype : HTMLTextAreaElement.prototype;
+    Object.getOwnPropertyDescriptor(prototype, 'value').set.call(element, text);
+    element.dispatchEvent(new InputEvent('input', {bubbles: true, inputType: 'insertText', data: text}));
+    element.dispatchEvent(new Event('change', {bubbles: true}));
+} else if (mode === 'native') {
+    document.execCommand('insertText', false, text);
+} else if (mode === 'paste_event') {
+    var data = new DataTransfer();
+    data.setData('text/plain', text);
+    var event = new ClipboardEvent('paste', {clipboardData: data, bubbles: true, cancelable: true});
+    if (element.dispatchEvent(event)) {
+        document.execCommand('insertText', false, text);
+    }
+    if (isField) {
+        element.dispatchEvent(new Event('change', {bubbles: true}));
+    }
+}
+"""
+
+paste_modes = ('keys', 'clipboard', 'insert', 'native', 'paste_event')
+
+# The clipboard mode of paste_text goes through the system clipboard, which
+# all sessions share.
+clipboard_lock = threading.Lock()
+
+# Seconds after which the HTTP client of a session re-reads the browser's
+# cookies even if no action could have changed them, since pages can also
+# set cookies on their own.
+cookie_max_age = 30
+max_request_concurrency = 64
+
+# Actions that do not change the browser's cookies, so the HTTP client of the
+# session can keep the cookies it already has.
+cookie_safe_actions = {
+    'get_element_info', 'get_all_matching_elements_info', 'get_element_parent_info', 'get_innerHTML',
+    'get_innerHTML_for_each', 'extract_elements', 'check_element_exists', 'count_elements', 'get_current_url',
+    'get_screenshot', 'is_page_loading', 'get_page_source', 'get_input_value', 'get_element_attribute',
+    'get_all_element_attributes', 'get_element_children', 'send_request', 'send_requests',
+    'get_pool_stats', 'list_sessions', 'close_session', 'start_network_capture', 'stop_network_capture',
+    'get_network_requests', 'drain_network_requests', 'snapshot_session',
+}
+
+def sync_http_cookies(driver, session, mode='auto'):
+    """Copy the browser's cookies into the HTTP client of the session.
+
+    With ``auto`` the cookies are only read again when an action may have
+    changed them or they are older than ``cookie_max_age``; ``always`` and
+    ``never`` force or skip the sync. All cookies of the browser are read
+    through the DevTools protocol with their domain, path and expiry, falling
+    back to the cookies of the current page.
+    """
+    if session.http_client is None:
+        client = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=max_request_concurrency)
+        client.mount('http://', adapter)
+        client.mount('https://', adapter)
+        session.http_client = client
+    if mode == 'never' or (mode == 'auto' and not session.cookies_dirty and time.time() - session.cookies_synced_at < cookie_max_age):
+        return
+    try:
+        cookies = driver.execute_cdp_cmd('Network.getAllCookies', {})['cookies']
+    except Exception:
+        cookies = driver.get_cookies()
+    jar = session.http_client.cookies
+    jar.clear()
+    for cookie in cookies:
+        expires = cookie.get('expires', cookie.get('expiry'))
+        jar.set(cookie['name'], cookie['value'], domain=cookie.get('domain', ''), path=cookie.get('path', '/'),
+                secure=cookie.get('secure', False), expires=int(expires) if expires and expires > 0 else None,
+                rest={'HttpOnly': None} if cookie.get('httpOnly') else {})
+    session.cookies_dirty = False
+    session.cookies_synced_at = time.time()
+
+def send_http_request(client, spec):
+    """Send one request described like the params of ``send_request``."""
+    url = spec.get('url')
+    method = spec.get('method', 'GET').upper()
+    data = spec.get('data', {})
+    is_json = spec.get('json', False)
+    is_multipart = spec.get('multipart', False)
+    headers = dict(spec.get('headers') or {})
+    timeout = spec.get('timeout')
+    if is_multipart:
+        data = MultipartEncoder(fields=data)
+        headers['Content-Type'] = data.content_type
+    if method == 'POST':
+        if is_json:
+            return client.post(url, json=data, headers=headers, timeout=timeout)
+        else:
+            return client.post(url, data=data, headers=headers, timeout=timeout)
+    elif method == 'PUT':
+        if is_json:
+            return client.put(url, json=data, headers=headers, timeout=timeout)
+        else:
+            return client.put(url, data=data, headers=headers, timeout=timeout)
+    elif method == 'DELETE':
+        return client.delete(url, params=data, headers=headers, timeout=timeout)
+    else:
+        return client.get(url, params=data, headers=headers, timeout=timeout)
+
+def send_http_requests(client, specs, concurrency):
+    """Send requests concurrently and return their results in the given order."""
+    def send(spec):
+        try:
+            response = send_http_request(client, spec)
+            return {'url': spec['url'], 'status_code': response.status_code, 'headers': dict(response.headers), 'response': response.text}
+        except Exception as e:
+            return {'url': spec['url'], 'error': str(e)}
+
+    if concurrency == 1 or len(specs) == 1:
+        return [send(spec) for spec in specs]
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(specs)), thread_name_prefix="http") as executor:
+        return list(executor.map(send, specs))
+
+def run_action(action, params, queued_at=None):
+    """Run a single action and return a ``(response, status_code)`` tuple.
+
+    This is the body of ``/execute`` without the HTTP layer, so it can also be
+    used to run the steps of a batch. Every action is recorded in the metrics;
+    with the ``timing`` param the response also carries its timing breakdown.
+    """
+    # Never put what a client sent as an action into a label.
+    action_label = action_name(action)
+    timing = ActionTiming(queued_at)
+    previous_timing = current_timing()
+    previous_session = getattr(action_context, 'session_name', None)
+    action_context.timing = timing
+    action_context.session_name = params.get('session', 'default') if isinstance(params, dict) else None
+    try:
+        response, status = perform_action(action, params)
+        if network_capture_enabled and action_label not in server_actions | {'unknown'} and isinstance(params, dict):
+            session = sessions.get(params.get('session', 'default'))
+            if session is not None:
+                # Part of the action's timing, as reading the log is a WebDriver command.
+                try:
+                    collect_network(session.driver, session)
+                except Exception as e:
+                    logger.warning("Could not read the network log of session=%s: %s", session.name, e)
+    finally:
+        action_context.timing = previous_timing
+        action_context.session_name = previous_session
+    breakdown = timing.breakdown()
+    metrics.inc('selenium_api_requests_total', (('action', action_label), ('status', status)))
+    metrics.observe('selenium_api_action_duration_seconds', breakdown['total_ms'] / 1000, (('action', action_label),))
+    metrics.observe('selenium_api_webdriver_commands', timing.commands, (('action', action_label),))
+    if timing.queue_time is not None:
+        metrics.observe('selenium_api_queue_wait_seconds', timing.queue_time, (('action', action_label),))
+    if timing.exception is not None:
+        metrics.inc('selenium_api_errors_total', (('action', action_label), ('exception', timing.exception)))
+    logger.debug("action=%s session=%s status=%s duration_ms=%s webdriver_commands=%s", action_label,
+                 params.get('session', 'default') if isinstance(params, dict) else None, status,
+                 breakdown['total_ms'], timing.commands)
+    if action_label not in cookie_safe_actions and isinstance(params, dict):
+        session = sessions.get(params.get('session', 'default'))
+        if session is not None:
+            session.cookies_dirty = True
+    if isinstance(params, dict) and params.get('timing'):
+        response['timing'] = breakdown
+    return response, status
+
+def perform_action(action, params, retry_stale=True):
+    # Before anything opens a session, so a mistyped action never launches a browser.
+    if action_name(action) == 'unknown':
+        return {'status': 'error', 'message': 'Invalid action'}, 400
+    try:
+        if params.get('handle') and not params.get('css_selector'):
+            params = dict(params, css_selector=params['handle'])
         session_name = params.get("session", "default")
         profile = params.get("profile", "default")
-        driver = get_session(session_name, profile)
+        preset = params.get("preset", "default")
+        if action == 'get_pool_stats':
+            return {'status': 'success', 'message': 'Browser pool statistics', 'data': browser_pool.stats()}, 200
+        if action == 'list_sessions':
+            now = time.time()
+            with sessions_lock:
+                listed = list(sessions.values())
+            sessions_info = [session.info(now) for session in listed]
+            return {'status': 'success', 'message': f'{len(sessions_info)} sessions open', 'data': sessions_info}, 200
+        if action == 'close_session':
+            if close_session(session_name):
+                return {'status': 'success', 'message': f'Closed the session with name {session_name}'}, 200
+            else:
+                return {'status': 'error', 'message': f'Session with name {session_name} not found'}, 404
+        if action == 'restore_session':
+            try:
+                if params.get('snapshot_data') is not None:
+                    snapshot = validate_snapshot(params['snapshot_data'])
+                else:
+                    snapshot = read_snapshot(params.get('snapshot', session_name))
+            except (OSError, ValueError) as e:
+                return {'status': 'error', 'message': f'Could not read the snapshot: {str(e)}'}, 400
+            if snapshot is None:
+                return {'status': 'error', 'message': f'Snapshot {params.get("snapshot", session_name)} not found'}, 404
+            session = restore_session(session_name, snapshot, params.get('navigate', True))
+            return {'status': 'success', 'message': f'Restored the session with name {session_name}',
+                    'data': {'url': session.driver.current_url, 'cookies': len(snapshot['cookies']), 'origins': list(snapshot['storage'])}}, 200
+        if preset not in session_presets:
+            return {'status': 'error', 'message': f'Unknown preset {preset}, use one of {", ".join(session_presets)}'}, 400
+        driver = get_session(session_name, profile, preset, params.get('clone_profile'), params.get('write_back'))
         if action == 'create_session':
             if session_name:
-                get_session(session_name, profile)
-                return jsonify({'status': 'success', 'message': f'Created the session with name {session_name}'}), 200
+                return {'status': 'success', 'message': f'Created the session with name {session_name}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'Please specify the name'}), 400
+                return {'status': 'error', 'message': 'Please specify the name'}, 400
         if action == 'navigate':
             url = params.get('url')
             if url:
+                sessions[session_name].clear_handles()
                 driver.get(url)
-                WebDriverWait(driver, 10).until(EC.presence_of_element_located((By.CSS_SELECTOR, 'body')))
-                prepare_js_environment(driver)
-                return jsonify({'status': 'success', 'message': f'Navigated to {url}'}), 200
+                wait_until(driver, sessions[session_name], 'presence', 10, 'body')
+                return {'status': 'success', 'message': f'Navigated to {url}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'URL is missing'}), 400
+                return {'status': 'error', 'message': 'URL is missing'}, 400
         elif action == 'get_element_info':
             css_selector = params.get('css_selector')
             if css_selector:
@@ -174,48 +2484,22 @@ def execute():
                         }
                         return attributes;
                     ''', element)
-                    return jsonify({'status': 'success', 'message': f'Information for element with selector {css_selector}:', 'data': {'tag_name': tag_name, 'attributes': attributes}}), 200
+                    data = {'tag_name': tag_name, 'attributes': attributes}
+                    if params.get('return_handle'):
+                        data['handle'] = sessions[session_name].add_handle(css_selector, 0, element, document_token(driver))
+                    return {'status': 'success', 'message': f'Information for element with selector {css_selector}:', 'data': data}, 200
                 except NoSuchElementException:
-                    return jsonify({'status': 'error', 'message': f'Element with selector {css_selector} not found'}), 404
+                    return {'status': 'error', 'message': f'Element with selector {css_selector} not found'}, 404
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'get_all_matching_elements_info':
             css_selector = params.get('css_selector')
             if css_selector:
-                elements = find_elements(driver, css_selector)
-                elements_data = []
-                for (element, index) in enumerate(elements):
-                    try:
-                        tag_name = element.tag_name
-                        attributes = driver.execute_script('''
-                            var element = arguments[0];
-                            var attributes = {};
-                            for (var i = 0; i < element.attributes.length; i++) {
-                                var attr = element.attributes[i];
-                                attributes[attr.name] = attr.value;
-                            }
-                            return attributes;
-                        ''', element)
-                        elements_data.append({'tag_name': tag_name, 'attributes': attributes})
-                    except Exception as e:
-                        try:
-                            element = find_element(driver, css_selector + "::" + index)
-                            tag_name = element.tag_name
-                            attributes = driver.execute_script('''
-                                var element = arguments[0];
-                                var attributes = {};
-                                for (var i = 0; i < element.attributes.length; i++) {
-                                    var attr = element.attributes[i];
-                                    attributes[attr.name] = attr.value;
-                                }
-                                return attributes;
-                            ''', element)
-                            elements_data.append({'tag_name': tag_name, 'attributes': attributes})
-                        except Exception as e2:
-                            elements_data.append({'tag_name': "error", 'attributes': {}})
-                return jsonify({'status': 'success', 'message': f'Information for all elements with selector {css_selector}:', 'data': elements_data}), 200
+                fields = ['tag_name', 'attributes', 'handle'] if params.get('return_handle') else ['tag_name', 'attributes']
+                total, elements_data = extract_elements(driver, css_selector, fields)
+                return {'status': 'success', 'message': f'Information for all elements with selector {css_selector}:', 'data': elements_data}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
 
         elif action == 'get_element_parent_info':
             css_selector = params.get('css_selector')
@@ -234,182 +2518,231 @@ def execute():
                             }
                             return attributes;
                         ''', parent_element)
-                        return jsonify({'status': 'success', 'message': f'Parent information for element with selector {css_selector}:', 'data': {'tag_name': tag_name, 'attributes': attributes}}), 200
+                        return {'status': 'success', 'message': f'Parent information for element with selector {css_selector}:', 'data': {'tag_name': tag_name, 'attributes': attributes}}, 200
                     else:
-                        return jsonify({'status': 'error', 'message': f'Element with selector {css_selector} does not have a parent'}), 404
+                        return {'status': 'error', 'message': f'Element with selector {css_selector} does not have a parent'}, 404
                 except NoSuchElementException:
-                    return jsonify({'status': 'error', 'message': f'Element with selector {css_selector} not found'}), 404
+                    return {'status': 'error', 'message': f'Element with selector {css_selector} not found'}, 404
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'execute_js_on_element':
             css_selector = params.get('css_selector')
             js = params.get('js')
             if css_selector and js:
                 element = find_element(driver, css_selector)
                 result = driver.execute_script(js, element)
-                return jsonify({'status': 'success', 'message': f'JavaScript code executed on element with selector {css_selector}', 'data': result}), 200
+                return {'status': 'success', 'message': f'JavaScript code executed on element with selector {css_selector}', 'data': result}, 200
             elif not css_selector:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
             else:
-                return jsonify({'status': 'error', 'message': 'JavaScript code is missing'}), 400
+                return {'status': 'error', 'message': 'JavaScript code is missing'}, 400
         elif action == 'click_element':
             css_selector = params.get('css_selector')
             if css_selector:
                 element = find_element(driver, css_selector)
                 element.click()
-                return jsonify({'status': 'success', 'message': f'Clicked element with selector {css_selector}'}), 200
+                return {'status': 'success', 'message': f'Clicked element with selector {css_selector}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'paste_text':
             css_selector = params.get('css_selector')
             text = params.get('text')
             use_shift = params.get('use_shift', True)
+            mode = params.get('mode', 'keys' if use_shift else 'clipboard')
+            if mode not in paste_modes:
+                return {'status': 'error', 'message': f'Unknown mode {mode}, use one of {", ".join(paste_modes)}'}, 400
             if css_selector and text is not None:
-                pyperclip.copy(text)
-
                 element = find_element(driver, css_selector)
-                if use_shift:
+                if mode == 'keys':
                     element.send_keys(Keys.CONTROL + 'a')
                     lines = text.split('\n')
                     for i, part in enumerate(lines):
                         element.send_keys(part)
                         if i < len(lines) - 1:
                             ActionChains(driver).key_down(Keys.SHIFT).key_down(Keys.ENTER).key_up(Keys.SHIFT).key_up(Keys.ENTER).perform()
-                else:
-                    text = text.replace('\n', '\\n').replace('\r', '\\r').replace('\'', '\\\'')
-                    copy_js = f"""
+                elif mode == 'clipboard':
+                    copy_js = """
                         var textarea = document.createElement('textarea');
-                        textarea.value = '{text}';
+                        textarea.value = arguments[0];
                         document.body.appendChild(textarea);
                         textarea.select();
                         document.execCommand('copy');
                         document.body.removeChild(textarea);
                     """
-                    print("js:" + copy_js)
-
-                    driver.execute_script(copy_js)
-                    time.sleep(0.5)
-                    element.click()
-                    time.sleep(0.5)
+                    with clipboard_lock:
+                        pyperclip.copy(text)
+                        driver.execute_script(copy_js, text)
+                        time.sleep(0.5)
+                        element.click()
+                        time.sleep(0.5)
 
-                    element.send_keys(Keys.CONTROL + 'a')
-                    element.send_keys(Keys.DELETE)
+                        element.send_keys(Keys.CONTROL + 'a')
+                        element.send_keys(Keys.DELETE)
 
-                    actions = ActionChains(driver)
-                    actions.key_down(Keys.CONTROL).send_keys('v').key_up(Keys.CONTROL).perform()
-                return jsonify({'status': 'success', 'message': f'Pasted text into element with selector {css_selector}'}), 200
+                        actions = ActionChains(driver)
+                        actions.key_down(Keys.CONTROL).send_keys('v').key_up(Keys.CONTROL).perform()
+                elif mode == 'insert':
+                    driver.execute_script(text_entry_js, element, text, 'select')
+                    driver.execute_cdp_cmd('Input.insertText', {'text': text})
+                else:
+                    driver.execute_script(text_entry_js, element, text, mode)
+                return {'status': 'success', 'message': f'Pasted text into element with selector {css_selector}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector or text is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector or text is missing'}, 400
         elif action == 'send_enter_key':
             css_selector = params.get('css_selector')
             if css_selector:
                 element = find_element(driver, css_selector)
                 element.send_keys(Keys.ENTER)
-                return jsonify({'status': 'success', 'message': f'Sent Enter key to element with selector {css_selector}'}), 200
+                return {'status': 'success', 'message': f'Sent Enter key to element with selector {css_selector}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'get_innerHTML':
             css_selector = params.get('css_selector')
             if css_selector:
                 element = find_element(driver, css_selector)
+                if 'etag' in params or params.get('diff'):
+                    return get_versioned_content(driver, sessions[session_name], 'innerHTML:' + css_selector, element, params, f'innerHTML retrieved for element with selector {css_selector}')
                 inner_html = element.get_attribute('innerHTML')
-                return jsonify({'status': 'success', 'message': f'innerHTML retrieved for element with selector {css_selector}', 'data': inner_html}), 200
+                return {'status': 'success', 'message': f'innerHTML retrieved for element with selector {css_selector}', 'data': inner_html}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'set_innerHTML':
             css_selector = params.get('css_selector')
             new_inner_html = params.get('html')
             if css_selector and new_inner_html is not None:
                 element = find_element(driver, css_selector)
                 driver.execute_script("arguments[0].innerHTML = arguments[1];", element, new_inner_html)
-                return jsonify({'status': 'success', 'message': f'innerHTML set for element with selector {css_selector}'}), 200
+                return {'status': 'success', 'message': f'innerHTML set for element with selector {css_selector}'}, 200
             elif not css_selector:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
             else:
-                return jsonify({'status': 'error', 'message': 'html is missing'}), 400
+                return {'status': 'error', 'message': 'html is missing'}, 400
         elif action == 'get_innerHTML_for_each':
             css_selector = params.get('css_selector')
             if css_selector:
-                elements = find_elements(driver, css_selector)
-                inner_htmls = []
-                for element in elements:
-                    try:
-                        inner_html = element.get_attribute('innerHTML')
-                        inner_htmls.append(inner_html)
-                    except Exception as e:
-                        inner_htmls.append("")
-                return jsonify({'status': 'success', 'message': f'innerHTML retrieved for elements with selector {css_selector}', 'data': inner_htmls}), 200
+                total, elements_data = extract_elements(driver, css_selector, ['innerHTML'])
+                inner_htmls = [element_data['innerHTML'] for element_data in elements_data]
+                return {'status': 'success', 'message': f'innerHTML retrieved for elements with selector {css_selector}', 'data': inner_htmls}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
+        elif action == 'extract_elements':
+            css_selector = params.get('css_selector')
+            fields = params.get('fields', ['tag_name', 'attributes'])
+            attribute_names = params.get('attributes')
+            offset = params.get('offset', 0)
+            limit = params.get('limit')
+            if not css_selector:
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
+            if not isinstance(fields, list) or not fields:
+                return {'status': 'error', 'message': 'Fields must be a non-empty list'}, 400
+            unknown_fields = [field for field in fields if field not in element_fields]
+            if unknown_fields:
+                return {'status': 'error', 'message': f'Unknown fields: {", ".join(map(str, unknown_fields))}'}, 400
+            if attribute_names is not None and not isinstance(attribute_names, list):
+                return {'status': 'error', 'message': 'Attributes must be a list'}, 400
+            if not isinstance(offset, int) or offset < 0 or (limit is not None and (not isinstance(limit, int) or limit < 0)):
+                return {'status': 'error', 'message': 'Offset and limit must be non-negative integers'}, 400
+            total, elements_data = extract_elements(driver, css_selector, fields, attribute_names, offset, limit)
+            return {'status': 'success', 'message': f'Extracted {len(elements_data)} of {total} elements with selector {css_selector}', 'data': {'total': total, 'offset': offset, 'items': elements_data}}, 200
+        elif action == 'scrape':
+            max_records = params.get('max_records')
+            try:
+                schema = ScrapeSchema(params.get('schema'))
+                pagination = scrape_pagination(params.get('pagination'))
+            except ValueError as e:
+                return {'status': 'error', 'message': str(e)}, 400
+            if max_records is not None and (not isinstance(max_records, int) or max_records < 1):
+                return {'status': 'error', 'message': 'max_records must be a positive integer'}, 400
+            stream = getattr(action_context, 'record_stream', None)
+            records = []
+            pages, count, stop_reason = scrape_pages(driver, sessions[session_name], schema, pagination, max_records,
+                                                     stream.put if stream else records.extend, stream.cancelled if stream else None)
+            data = {'pages': pages, 'count': count, 'stop_reason': stop_reason}
+            if stream is None:
+                data['records'] = records
+            return {'status': 'success', 'message': f'Scraped {count} records from {pages} pages', 'data': data}, 200
         elif action == 'check_element_exists':
             css_selector = params.get('css_selector')
             if css_selector:
                 try:
                     find_element(driver, css_selector)
-                    return jsonify({'status': 'success', 'message': f'Element with selector {css_selector} exists', 'data': True}), 200
+                    return {'status': 'success', 'message': f'Element with selector {css_selector} exists', 'data': True}, 200
                 except NoSuchElementException:
-                    return jsonify({'status': 'success', 'message': f'Element with selector {css_selector} does not exist', 'data': False}), 200
+                    return {'status': 'success', 'message': f'Element with selector {css_selector} does not exist', 'data': False}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'count_elements':
             css_selector = params.get('css_selector')
             if css_selector:
                 elements = find_elements(driver, css_selector)
                 count = len(elements)
-                return jsonify({'status': 'success', 'message': f'Number of elements with selector {css_selector}', 'data': count}), 200
+                return {'status': 'success', 'message': f'Number of elements with selector {css_selector}', 'data': count}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'get_current_url':
             current_url = driver.current_url
-            return jsonify({'status': 'success', 'message': f'Current URL: {current_url}', 'data': current_url}), 200
+            return {'status': 'success', 'message': f'Current URL: {current_url}', 'data': current_url}, 200
         elif action == 'execute_js':
             js = params.get('js')
             if js:
                 result = driver.execute_script(f"return {js}")
-                return jsonify({'status': 'success', 'message': 'JavaScript code executed', 'data': result}), 200
+                return {'status': 'success', 'message': 'JavaScript code executed', 'data': result}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'JavaScript code is missing'}), 400
+                return {'status': 'error', 'message': 'JavaScript code is missing'}, 400
         elif action == 'get_screenshot':
+            if any(params.get(option) is not None for option in ('format', 'quality', 'css_selector', 'scale')):
+                try:
+                    image_format, quality, scale = screenshot_options(params)
+                except ValueError as e:
+                    return {'status': 'error', 'message': str(e)}, 400
+                try:
+                    screenshot = capture_screenshot(driver, image_format, quality, params.get('css_selector'), scale)
+                except NoSuchElementException:
+                    return {'status': 'error', 'message': f'Element with selector {params.get("css_selector")} not found'}, 404
+                return {'status': 'success', 'message': 'Screenshot taken', 'data': screenshot, 'format': image_format}, 200
             screenshot = driver.get_screenshot_as_base64()
-            return jsonify({'status': 'success', 'message': 'Screenshot taken', 'data': screenshot}), 200
+            return {'status': 'success', 'message': 'Screenshot taken', 'data': screenshot}, 200
         elif action == 'is_page_loading':
             ready_state = driver.execute_script("return document.readyState;")
             is_loading = ready_state != 'complete'
-            return jsonify({'status': 'success', 'message': f'Page is still loading: {is_loading}', 'data': is_loading}), 200
+            return {'status': 'success', 'message': f'Page is still loading: {is_loading}', 'data': is_loading}, 200
         elif action == 'get_page_source':
+            if 'etag' in params or params.get('diff'):
+                return get_versioned_content(driver, sessions[session_name], 'page_source', None, params, 'Got page source')
             page_source = driver.page_source
-            return jsonify({'status': 'success', 'message': 'Got page source', 'data': page_source}), 200
+            return {'status': 'success', 'message': 'Got page source', 'data': page_source}, 200
         elif action == 'scroll_to_element':
             css_selector = params.get('css_selector')
             if css_selector:
                 element = find_element(driver, css_selector)
                 driver.execute_script("arguments[0].scrollIntoView();", element)
-                return jsonify({'status': 'success', 'message': f'Scrolled to element with selector {css_selector}'}), 200
+                return {'status': 'success', 'message': f'Scrolled to element with selector {css_selector}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'scroll_to_top':
             driver.execute_script("window.scrollTo(0, 0);")
-            return jsonify({'status': 'success', 'message': 'Scrolled to the top of the page'}), 200
+            return {'status': 'success', 'message': 'Scrolled to the top of the page'}, 200
         elif action == 'scroll_to_bottom':
             driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-            return jsonify({'status': 'success', 'message': 'Scrolled to bottom of the page'}), 200
+            return {'status': 'success', 'message': 'Scrolled to bottom of the page'}, 200
         elif action == 'get_input_value':
             css_selector = params.get('css_selector')
             if css_selector:
                 element = find_element(driver, css_selector)
                 value = driver.execute_script("return arguments[0].value;", element)
-                return jsonify({'status': 'success', 'message': f'Got value for element with selector {css_selector}', 'data': value}), 200
+                return {'status': 'success', 'message': f'Got value for element with selector {css_selector}', 'data': value}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'set_input_value':
             css_selector = params.get('css_selector')
             value = params.get('value')
             if css_selector and value is not None:
                 element = find_element(driver, css_selector)
                 driver.execute_script("arguments[0].value = arguments[1];", element, value)
-                return jsonify({'status': 'success', 'message': f'Set value for element with selector {css_selector}'}), 200
+                return {'status': 'success', 'message': f'Set value for element with selector {css_selector}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector or value is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector or value is missing'}, 400
 
         elif action == 'get_element_attribute':
             css_selector = params.get('css_selector')
@@ -417,9 +2750,9 @@ def execute():
             if css_selector and attribute:
                 element = find_element(driver, css_selector)
                 attribute_value = element.get_attribute(attribute)
-                return jsonify({'status': 'success', 'message': f'Attribute value for {attribute}:', 'data': attribute_value}), 200
+                return {'status': 'success', 'message': f'Attribute value for {attribute}:', 'data': attribute_value}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector or attribute is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector or attribute is missing'}, 400
         elif action == 'get_all_element_attributes':
             css_selector = params.get('css_selector')
             if css_selector:
@@ -433,9 +2766,9 @@ def execute():
                     }
                     return attributes;
                 ''', element)
-                return jsonify({'status': 'success', 'message': f'All attributes for element with selector {css_selector}:', 'data': attributes}), 200
+                return {'status': 'success', 'message': f'All attributes for element with selector {css_selector}:', 'data': attributes}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'set_element_attribute':
             css_selector = params.get('css_selector')
             attribute = params.get('attribute')
@@ -443,86 +2776,1037 @@ def execute():
             if css_selector and attribute and value is not None:
                 element = find_element(driver, css_selector)
                 driver.execute_script(f"arguments[0].setAttribute(arguments[1], arguments[2]);", element, attribute, value)
-                return jsonify({'status': 'success', 'message': f'Set attribute {attribute} with value {value} for element with selector {css_selector}'}), 200
+                return {'status': 'success', 'message': f'Set attribute {attribute} with value {value} for element with selector {css_selector}'}, 200
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector, attribute, or value is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector, attribute, or value is missing'}, 400
         elif action == 'get_element_children':
             css_selector = params.get('css_selector')
             if css_selector:
                 try:
-                    element = find_element(driver, css_selector)
-                    children = driver.execute_script("return Array.from(arguments[0].children);", element)
-                    children_data = []
-                    for child in children:
-                        child_info = {
-                            'tag_name': child.tag_name,
-                            'attributes': driver.execute_script('''
-                                var element = arguments[0];
-                                var attributes = {};
-                                for (var i = 0; i < element.attributes.length; i++) {
-                                    var attr = element.attributes[i];
-                                    attributes[attr.name] = attr.value;
-                                }
-                                return attributes;
-                            ''', child)
-                        }
-                        children_data.append(child_info)
-                    return jsonify({'status': 'success', 'message': f'Children for element with selector {css_selector}:', 'data': children_data}), 200
+                    total, elements_data = extract_elements(driver, css_selector, ['children'], limit=1)
+                    if not elements_data:
+                        raise NoSuchElementException(f'No element found with the selector "{css_selector}"')
+                    children_data = elements_data[0]['children']
+                    return {'status': 'success', 'message': f'Children for element with selector {css_selector}:', 'data': children_data}, 200
                 except NoSuchElementException:
-                    return jsonify({'status': 'error', 'message': f'Element with selector {css_selector} not found'}), 404
+                    return {'status': 'error', 'message': f'Element with selector {css_selector} not found'}, 404
             else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
         elif action == 'wait_for_element':
             css_selector = params.get('css_selector')
             timeout = params.get('timeout', 10)  # Default timeout is 10 seconds
-            if css_selector:
-                WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.CSS_SELECTOR, css_selector)))
-                return jsonify({'status': 'success', 'message': f'Element with selector {css_selector} is visible'}), 200
-            else:
-                return jsonify({'status': 'error', 'message': 'CSS selector is missing'}), 400
+            condition = params.get('condition', 'presence')
+            if condition not in wait_conditions:
+                return {'status': 'error', 'message': f'Unknown condition {condition}, use one of {", ".join(wait_conditions)}'}, 400
+            if not css_selector and condition in selector_wait_conditions:
+                return {'status': 'error', 'message': 'CSS selector is missing'}, 400
+            options = {'text': params.get('text'), 'pattern': params.get('pattern'), 'count': params.get('count', 1),
+                       'state': params.get('state', 'complete'), 'idle_time': params.get('idle_time', 500)}
+            if condition == 'text' and options['text'] is None and options['pattern'] is None:
+                return {'status': 'error', 'message': 'Text or pattern is missing'}, 400
+            result = wait_until(driver, sessions[session_name], condition, timeout, css_selector if condition in selector_wait_conditions else None, options)
+            if condition in selector_wait_conditions:
+                return {'status': 'success', 'message': f'Element with selector {css_selector} is {"visible" if condition == "presence" else condition}', 'data': result.get('count')}, 200
+            return {'status': 'success', 'message': f'Page is {condition}'}, 200
         elif action == 'send_request':
             url = params.get('url')
-            method = params.get('method', 'GET').upper()
-            data = params.get('data', {})
-            is_json = params.get('json', False)
-            is_multipart = params.get('multipart', False)
-            headers = params.get('headers', {})
             if url:
                 try:
-                    cookies = driver.get_cookies()
-                    s = requests.Session()
-                    for cookie in cookies:
-                        s.cookies.set(cookie['name'], cookie['value'])
-                    if is_multipart:
-                        data = MultipartEncoder(fields=data)
-                        headers['Content-Type'] = data.content_type
-                    if method == 'POST':
-                        if is_json:
-                            response = s.post(url, json=data, headers=headers)
-                        else:
-                            response = s.post(url, data=data, headers=headers)
-                    elif method == 'PUT':
-                        if is_json:
-                            response = s.put(url, json=data, headers=headers)
-                        else:
-                            response = s.put(url, data=data, headers=headers)
-                    elif method == 'DELETE':
-                        response = s.delete(url, params=data, headers=headers)
-                    else:
-                        response = s.get(url, params=data, headers=headers)
-                    return jsonify({'status': 'success', 'message': f'Request sent to {url}', 'response': response.text}), 200
+                    session = sessions[session_name]
+                    sync_http_cookies(driver, session, params.get('sync_cookies', 'auto'))
+                    response = send_http_request(session.http_client, params)
+                    return {'status': 'success', 'message': f'Request sent to {url}', 'response': response.text,
+                            'status_code': response.status_code, 'headers': dict(response.headers)}, 200
                 except Exception as e:
-                    return jsonify({'status': 'error', 'message': f'Error while sending request to {url}: {str(e)}'}), 500
+                    return {'status': 'error', 'message': f'Error while sending request to {url}: {str(e)}'}, 500
             else:
-                return jsonify({'status': 'error', 'message': 'Url is missing'}), 400
+                return {'status': 'error', 'message': 'Url is missing'}, 400
+        elif action == 'send_requests':
+            request_specs = params.get('requests')
+            concurrency = params.get('concurrency', 8)
+            if not isinstance(request_specs, list) or not request_specs:
+                return {'status': 'error', 'message': 'Requests are missing'}, 400
+            if any(not isinstance(spec, dict) or not spec.get('url') for spec in request_specs):
+                return {'status': 'error', 'message': 'Every request needs a url'}, 400
+            if not isinstance(concurrency, int) or not 1 <= concurrency <= max_request_concurrency:
+                return {'status': 'error', 'message': f'Concurrency must be an integer between 1 and {max_request_concurrency}'}, 400
+            session = sessions[session_name]
+            sync_http_cookies(driver, session, params.get('sync_cookies', 'auto'))
+            results = send_http_requests(session.http_client, request_specs, concurrency)
+            failed = sum(1 for result in results if 'error' in result)
+            return {'status': 'success', 'message': f'Sent {len(results)} requests, {failed} failed', 'data': results}, 200
+        elif action == 'snapshot_session':
+            origins = params.get('origins', [])
+            if not isinstance(origins, list) or not all(isinstance(origin, str) for origin in origins):
+                return {'status': 'error', 'message': 'Origins must be a list of origins'}, 400
+            session = sessions[session_name]
+            snapshot = take_snapshot(driver, session, origins)
+            data = {'url': snapshot['url'], 'cookies': len(snapshot['cookies']), 'origins': list(snapshot['storage'])}
+            if params.get('save', True):
+                name = params.get('snapshot', session_name)
+                path = write_snapshot(name, snapshot)
+                if name == session_name:
+                    session.snapshot_at = time.time()
+                data.update(snapshot=name, bytes=os.path.getsize(path))
+            if params.get('return_snapshot'):
+                data['snapshot_data'] = snapshot
+            return {'status': 'success', 'message': f'Took a snapshot of the session with name {session_name}', 'data': data}, 200
+        elif action == 'start_network_capture':
+            if not network_capture_enabled:
+                return {'status': 'error', 'message': 'Network capture is disabled, start the server with --network-capture'}, 400
+            body_patterns = params.get('bodies', [])
+            max_bytes = params.get('max_bytes', default_network_capture_bytes)
+            max_body_size = params.get('max_body_size', default_network_body_size)
+            if not isinstance(body_patterns, list) or not all(isinstance(pattern, str) for pattern in body_patterns):
+                return {'status': 'error', 'message': 'Bodies must be a list of URL patterns'}, 400
+            if not isinstance(max_bytes, int) or not 0 < max_bytes <= max_network_capture_bytes:
+                return {'status': 'error', 'message': f'max_bytes must be an integer between 1 and {max_network_capture_bytes}'}, 400
+            if not isinstance(max_body_size, int) or max_body_size < 0:
+                return {'status': 'error', 'message': 'max_body_size must be a non-negative integer'}, 400
+            session = sessions[session_name]
+            # Skip what the page loaded before the capture started.
+            driver.get_log('performance')
+            session.network_log_read_at = time.time()
+            # Keep response bodies in the browser until they are read.
+            driver.execute_cdp_cmd('Network.enable', {'maxTotalBufferSize': max_bytes, 'maxResourceBufferSize': max(max_body_size, 1)})
+            session.network = NetworkCapture(body_patterns, max_bytes, max_body_size)
+            return {'status': 'success', 'message': 'Started the network capture', 'data': session.network.stats()}, 200
+        elif action in ('stop_network_capture', 'get_network_requests', 'drain_network_requests'):
+            session = sessions[session_name]
+            if session.network is None:
+                return {'status': 'error', 'message': 'Network capture was not started'}, 400
+            collect_network(driver, session)
+            if action == 'stop_network_capture':
+                session.network.capturing = False
+                session.network.pending.clear()
+                return {'status': 'success', 'message': 'Stopped the network capture', 'data': session.network.stats()}, 200
+            limit = params.get('limit')
+            if limit is not None and (not isinstance(limit, int) or limit < 0):
+                return {'status': 'error', 'message': 'Limit must be a non-negative integer'}, 400
+            try:
+                matches = network_filter(params)
+            except ValueError as e:
+                return {'status': 'error', 'message': str(e)}, 400
+            records = session.network.select(matches, limit, remove=action == 'drain_network_requests')
+            data = dict(session.network.stats(), requests=records)
+            return {'status': 'success', 'message': f'{len(records)} network requests', 'data': data}, 200
         else:
-            return jsonify({'status': 'error', 'message': 'Invalid action'}), 400
+            return {'status': 'error', 'message': 'Invalid action'}, 400
+    except ExpiredHandleError as e:
+        return {'status': 'error', 'message': str(e)}, 410
+    except StaleElementReferenceException as e:
+        session = sessions.get(params.get('session', 'default'))
+        if session is not None and session.handles:
+            # The page changed under a cached handle, find the elements again
+            # and retry once, or let the client retry an action with side effects.
+            session.forget_elements()
+            if retry_stale and action in stale_retry_actions:
+                return perform_action(action, params, retry_stale=False)
+        current_timing().exception = type(e).__name__
+        logger.warning("Action %s failed: %s", action, e, exc_info=logger.isEnabledFor(logging.DEBUG))
+        return {'status': 'error', 'message': f'An error occurred: {str(e)}'}, 500
+    except Exception as e:
+        current_timing().exception = type(e).__name__
+        logger.warning("Action %s failed: %s", action, e, exc_info=logger.isEnabledFor(logging.DEBUG))
+        return {'status': 'error', 'message': f'An error occurred: {str(e)}'}, 500
+
+def json_response(response, status):
+    """jsonify() a response, reporting the serialization time in a Server-Timing header.
+
+    The time cannot be part of the body it measures, so responses with a
+    timing breakdown carry it as ``Server-Timing: serialization;dur=<ms>``.
+    """
+    if 'timing' not in response:
+        return jsonify(response), status
+    started = time.perf_counter()
+    serialized = jsonify(response)
+    serialized.headers['Server-Timing'] = f'serialization;dur={(time.perf_counter() - started) * 1000:.3f}'
+    return serialized, status
+
+# ``$${`` escapes a literal ``${``.
+step_reference_pattern = re.compile(r'\$(\$?)\{([^}]*)\}')
+# Params holding JavaScript, where ``${`` belongs to template literals.
+script_params = {'js'}
+
+def resolve_step_reference(reference, outputs):
+    """Look up ``<step>[.<key>...]`` in the responses of the earlier steps.
+
+    ``<step>`` is either the index of the step or its ``id``. Without a path
+    the ``data`` of the step is returned.
+    """
+    parts = reference.strip().split('.')
+    if parts[0] not in outputs:
+        raise KeyError(reference)
+    value = outputs[parts[0]]
+    path = parts[1:] or ['data']
+    for key in path:
+        if isinstance(value, list) and key.lstrip('-').isdigit():
+            try:
+                value = value[int(key)]
+            except IndexError:
+                raise KeyError(reference)
+        elif isinstance(value, dict) and key in value:
+            value = value[key]
+        else:
+            raise KeyError(reference)
+    return value
+
+def resolve_step_params(value, outputs):
+    """Replace ``${...}`` references in the params of a batch step.
+
+    A string that consists of a single reference is replaced by the referenced
+    value as is, so lists, numbers and objects keep their type. References
+    embedded in a longer string are substituted as text. Script params are
+    passed unchanged.
+    """
+    if isinstance(value, dict):
+        return {key: item if key in script_params else resolve_step_params(item, outputs) for key, item in value.items()}
+    if isinstance(value, list):
+        return [resolve_step_params(item, outputs) for item in value]
+    if isinstance(value, str):
+        match = step_reference_pattern.fullmatch(value)
+        if match and not match.group(1):
+            return resolve_step_reference(match.group(2), outputs)
+
+        def substitute(match):
+            if match.group(1):
+                return '${' + match.group(2) + '}'
+            resolved = resolve_step_reference(match.group(2), outputs)
+            return resolved if isinstance(resolved, str) else json.dumps(resolved)
+        return step_reference_pattern.sub(substitute, value)
+    return value
+
+def run_batch(session_name, profile, steps, stop_on_error=True, cancelled=None):
+    """Run the steps of a batch in order against one session.
+
+    Returns a ``(response, status_code)`` tuple. The data of the response holds
+    one result per executed step. If a step fails, the batch reports the error
+    and status code of the first failing step; the remaining steps are skipped
+    unless ``stop_on_error`` is false. When the ``cancelled`` event is set the
+    batch stops before its next step and returns status code 409.
+    """
+    if not isinstance(steps, list) or not steps:
+        return {'status': 'error', 'message': 'Steps are missing'}, 400
+    results = []
+    outputs = {}
+    failure = None
+    for index, step in enumerate(steps):
+        if cancelled is not None and cancelled.is_set():
+            return {'status': 'error', 'message': f'Batch cancelled after {len(results)} steps', 'data': results}, 409
+        if not isinstance(step, dict):
+            step = {}
+        action = step.get('action')
+        params = step.get('params') or {}
+        if not isinstance(params, dict):
+            response, status = {'status': 'error', 'message': 'Params must be an object'}, 400
+        else:
+            try:
+                params = resolve_step_params(params, outputs)
+            except KeyError as e:
+                response, status = {'status': 'error', 'message': f'Invalid step reference {e.args[0]}'}, 400
+            else:
+                params['session'] = session_name
+                params.setdefault('profile', profile)
+                response, status = run_action(action, params)
+        outputs[str(index)] = response
+        if step.get('id') is not None:
+            outputs[str(step['id'])] = response
+        results.append({'step': index, 'id': step.get('id'), 'action': action, 'code': status, **response})
+        if status >= 400:
+            if failure is None:
+                failure = (index, action, response, status)
+            if stop_on_error:
+                break
+    if failure is not None:
+        index, action, response, status = failure
+        return {'status': 'error', 'message': f'Step {index} ({action}) failed: {response.get("message")}', 'data': results}, status
+    return {'status': 'success', 'message': f'Executed {len(results)} steps', 'data': results}, 200
+
+class Job:
+    """An action or batch submitted through the job API."""
+
+    def __init__(self, job_id, kind, session, action=None, cancelled=None):
+        self.id = job_id
+        self.kind = kind
+        self.session = session
+        self.action = action
+        self.state = 'queued'
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.response = None
+        self.code = None
+        self.future = None
+        self.cancelled = cancelled or threading.Event()
+        self.finished = threading.Event()
+
+    def info(self, result=True):
+        info = {
+            'id': self.id,
+            'kind': self.kind,
+            'session': self.session,
+            'action': self.action,
+            'state': self.state,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+        if result and self.finished.is_set():
+            info['code'] = self.code
+            info['result'] = self.response
+        return info
+
+class JobStore:
+    """Runs actions and batches in the background and keeps their results.
+
+    Jobs run on the session queues like any other command. Finished jobs are
+    kept for ``ttl`` seconds, and when more than ``max_jobs`` jobs are stored
+    the oldest finished ones are dropped first. Every state change is appended
+    to a short event log that the Server-Sent Events stream reads from.
+    """
+
+    def __init__(self, ttl=300, max_jobs=10000, max_events=1000, prefix=''):
+        self.ttl = ttl
+        self.prefix = prefix
+        self.max_jobs = max_jobs
+        self.jobs = OrderedDict()
+        self.events = deque(maxlen=max_events)
+        self.sequence = 0
+        self.changed = threading.Condition()
+        self.purged_at = 0
+
+    def submit(self, kind, session, fn, *args, action=None, cancelled=None):
+        """Queue ``fn(*args)`` as a job, or return None if the store is full.
+
+        ``fn`` must return a ``(response, status_code)`` tuple. A job without a
+        session runs right away on the calling thread. ``cancelled`` is the
+        event that is set when the job is cancelled.
+        """
+        self.purge()
+        job = Job(self.prefix + base64.urlsafe_b64encode(os.urandom(12)).decode(), kind, session, action, cancelled)
+        with self.changed:
+            if len(self.jobs) >= self.max_jobs:
+                return None
+            self.jobs[job.id] = job
+        self.publish(job)
+        if session is None:
+            job.future = Future()
+            job.future.add_done_callback(lambda future: self.finish(job))
+            if job.future.set_running_or_notify_cancel():
+                self.run(job, fn, args, job.future)
+        else:
+            job.future = session_executor.submit(session, self.run, job, fn, args)
+            job.future.add_done_callback(lambda future: self.finish(job))
+        return job
+
+    def run(self, job, fn, args, future=None):
+        with self.changed:
+            job.state = 'running'
+            job.started_at = time.time()
+        self.publish(job)
+        if future is None:
+            return fn(*args)
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def finish(self, job):
+        future = job.future
+        with self.changed:
+            job.finished_at = time.time()
+            if future.cancelled():
+                job.state = 'cancelled'
+                job.response, job.code = {'status': 'error', 'message': 'Job cancelled before it started'}, 409
+            elif future.exception() is not None:
+                job.state = 'failed'
+                job.response, job.code = {'status': 'error', 'message': f'An error occurred: {str(future.exception())}'}, 500
+            else:
+                job.response, job.code = future.result()
+                job.state = 'cancelled' if job.code == 409 and job.cancelled.is_set() else 'done'
+        job.finished.set()
+        self.publish(job)
+
+    def publish(self, job):
+        with self.changed:
+            self.sequence += 1
+            self.events.append((self.sequence, job.info()))
+            self.changed.notify_all()
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list(self, session=None, state=None):
+        with self.changed:
+            jobs = list(self.jobs.values())
+        return [job for job in jobs if (session is None or job.session == session) and (state is None or job.state == state)]
+
+    def cancel(self, job_id):
+        """Cancel a queued job, or stop a running batch before its next step.
+
+        A running action is not interrupted. Returns the job, or None if there
+        is no such job.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancelled.set()
+        job.future.cancel()
+        return job
+
+    def wait_for_events(self, after, timeout):
+        """Return the ``(sequence, job info)`` events after sequence number ``after``.
+
+        Waits up to ``timeout`` seconds for the first one.
+        """
+        with self.changed:
+            self.changed.wait_for(lambda: self.sequence > after, timeout)
+            return [(sequence, info) for sequence, info in self.events if sequence > after]
+
+    def purge(self):
+        now = time.monotonic()
+        if now - self.purged_at < 1:
+            return
+        self.purged_at = now
+        expired_before = time.time() - self.ttl
+        with self.changed:
+            finished = [job for job in self.jobs.values() if job.finished.is_set()]
+            for job in finished:
+                if job.finished_at < expired_before:
+                    del self.jobs[job.id]
+            excess = len(self.jobs) - self.max_jobs + 1
+            if excess > 0:
+                for job in sorted((job for job in finished if job.id in self.jobs), key=lambda job: job.finished_at)[:excess]:
+                    del self.jobs[job.id]
+
+    def stats(self):
+        with self.changed:
+            jobs = list(self.jobs.values())
+        counts = {state: 0 for state in ('queued', 'running', 'done', 'failed', 'cancelled')}
+        for job in jobs:
+            counts[job.state] += 1
+        return counts
+
+job_store = JobStore()
+
+# Longest long poll of GET /jobs/<id>, and the interval of keep-alive comments
+# in the event stream.
+max_job_wait = 60
+job_event_keepalive = 15
+
+@app.route('/execute', methods=['POST'])
+def execute():
+    try:
+        action = request.json.get('action')
+        params = request.json.get('params')
+    except Exception as e:
+        return jsonify({'status': 'error', 'message': f'An error occurred: {str(e)}'}), 500
+    response, status = execute_action(action, params)
+    return json_response(response, status)
+
+@app.route('/execute_batch', methods=['POST'])
+def execute_batch():
+    try:
+        session_name = request.json.get('session', 'default')
+        profile = request.json.get('profile', 'default')
+        steps = request.json.get('steps')
+        stop_on_error = request.json.get('stop_on_error', True)
     except Exception as e:
-        print(str(e))
         return jsonify({'status': 'error', 'message': f'An error occurred: {str(e)}'}), 500
+    response, status = session_executor.submit(session_name, run_batch, session_name, profile, steps, stop_on_error).result()
+    return jsonify(response), status
+
+def request_params():
+    """The params of a GET request's query string or a POST request's JSON body."""
+    if request.method == 'GET':
+        return request.args.to_dict()
+    return dict(request.get_json(silent=True) or {})
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """Queue an action (``action``/``params``) or a batch (``steps``) as a job."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'status': 'error', 'message': 'Request body must be a JSON object'}), 400
+    if 'steps' in body:
+        session_name = body.get('session', 'default')
+        cancelled = threading.Event()
+        job = job_store.submit('batch', session_name, run_batch, session_name, body.get('profile', 'default'), body.get('steps'),
+                               body.get('stop_on_error', True), cancelled, cancelled=cancelled)
+    else:
+        action = body.get('action')
+        params = body.get('params')
+        if not isinstance(params, dict) or action_name(action) in server_actions | {'unknown'}:
+            job = job_store.submit('action', None, run_action, action, params, action=action)
+        else:
+            job = job_store.submit('action', params.get('session', 'default'), run_action, action, params, time.perf_counter(), action=action)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Too many jobs, try again later'}), 503
+    return jsonify({'status': 'success', 'message': f'Job {job.id} queued', 'data': job.info(result=False)}), 202
+
+@app.route('/jobs', methods=['GET'])
+def list_jobs():
+    jobs = [job.info(result=False) for job in job_store.list(request.args.get('session'), request.args.get('state'))]
+    return jsonify({'status': 'success', 'message': f'{len(jobs)} jobs', 'data': jobs}), 200
+
+@app.route('/jobs/events', methods=['GET'])
+def job_events():
+    """Stream job state changes as Server-Sent Events.
+
+    Only jobs listed in ``ids`` (comma separated) or of ``session`` are sent if
+    either is given. A reconnecting client resumes after its Last-Event-ID.
+    """
+    ids = set(filter(None, request.args.get('ids', '').split(','))) or None
+    session_name = request.args.get('session')
+    try:
+        after = int(request.headers.get('Last-Event-ID') or request.args.get('after') or job_store.sequence)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid Last-Event-ID'}), 400
+
+    def events(after):
+        yield ': connected\n\n'
+        while True:
+            batch = job_store.wait_for_events(after, job_event_keepalive)
+            if not batch:
+                yield ': keep-alive\n\n'
+                continue
+            for sequence, info in batch:
+                after = sequence
+                if (ids is None or info['id'] in ids) and (session_name is None or info['session'] == session_name):
+                    yield f'id: {sequence}\nevent: {info["state"]}\ndata: {json.dumps(info)}\n\n'
+
+    return app.response_class(events(after), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """The state of a job, with its result once it has finished.
+
+    With ``wait`` the request blocks for up to that many seconds (at most
+    ``max_job_wait``) until the job finishes.
+    """
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} not found'}), 404
+    try:
+        wait = min(float(request.args.get('wait', 0)), max_job_wait)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Wait must be a number of seconds'}), 400
+    if wait > 0:
+        job.finished.wait(wait)
+    return json_response({'status': 'success', 'message': f'Job {job.id} is {job.state}', 'data': job.info()}, 200)
+
+@app.route('/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    job = job_store.cancel(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} not found'}), 404
+    if job.finished.is_set() and job.state != 'cancelled':
+        return jsonify({'status': 'error', 'message': f'Job {job.id} already finished', 'data': job.info(result=False)}), 409
+    return jsonify({'status': 'success', 'message': f'Cancelling job {job.id}', 'data': job.info(result=False)}), 200
+
+@app.route('/scrape', methods=['POST'])
+def scrape():
+    """Run the scrape action and stream its records as NDJSON while pages are read.
+
+    Every line is a record; the last line is the response of the action, with
+    the page and record counts but without the records.
+    """
+    params = request_params()
+    try:
+        ScrapeSchema(params.get('schema'))
+        scrape_pagination(params.get('pagination'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    stream = RecordStream()
+    future = session_executor.submit(params.get('session', 'default'), stream.run, params, time.perf_counter())
+    response = app.response_class(stream.lines(future), mimetype='application/x-ndjson')
+    response.call_on_close(stream.cancelled.set)
+    return response
+
+@app.route('/screenshot', methods=['GET', 'POST'])
+def screenshot():
+    params = request_params()
+    response, status = execute_action('get_screenshot', params)
+    if status != 200:
+        return jsonify(response), status
+    mimetype = screenshot_formats[response.get('format', 'png')]
+    return app.response_class(base64.b64decode(response['data']), status=200, mimetype=mimetype)
+
+max_screencast_fps = 30
+
+@app.route('/screencast', methods=['GET', 'POST'])
+def screencast():
+    """Stream screenshots of a session as multipart/x-mixed-replace.
+
+    Frames are captured through the session queue, so the stream never gets in
+    the way of other commands, at no more than ``fps`` frames per second. The
+    stream ends after ``duration`` seconds or ``max_frames`` frames if given,
+    or when the client disconnects.
+    """
+    params = request_params()
+    params.setdefault('format', 'jpeg')
+    try:
+        screenshot_options(params)
+        fps = min(float(params.pop('fps', 2)), max_screencast_fps)
+        duration = float(params.pop('duration', 0))
+        max_frames = int(params.pop('max_frames', 0))
+        if fps <= 0:
+            raise ValueError('Fps must be greater than 0')
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    def frames():
+        interval = 1 / fps
+        started = time.monotonic()
+        next_frame = started
+        count = 0
+        while True:
+            response, status = execute_action('get_screenshot', dict(params))
+            if status != 200:
+                logger.warning("Screencast of session=%s stopped: %s", params.get('session', 'default'), response.get('message'))
+                return
+            frame = base64.b64decode(response['data'])
+            yield (b'--frame\r\nContent-Type: ' + screenshot_formats[response['format']].encode() +
+                   b'\r\nContent-Length: ' + str(len(frame)).encode() + b'\r\n\r\n' + frame + b'\r\n')
+            count += 1
+            now = time.monotonic()
+            if (max_frames and count >= max_frames) or (duration and now - started >= duration):
+                return
+            # Skip ahead instead of bursting when a capture took longer than a frame.
+            next_frame = max(next_frame + interval, now)
+            time.sleep(next_frame - now)
+
+    return app.response_class(frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+# Responses smaller than this are sent uncompressed, None disables compression.
+compression_min_size = 1024
+compressible_mimetypes = {'application/json', 'text/plain'}
+
+@app.after_request
+def compress_response(response):
+    """Compress responses with zstd or gzip, whichever the client prefers.
+
+    zstd is only offered when the zstandard package is installed.
+    """
+    if (compression_min_size is None or response.direct_passthrough or response.is_streamed
+            or response.mimetype not in compressible_mimetypes or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < compression_min_size:
+        return response
+    encoding = request.accept_encodings.best_match(['zstd', 'gzip'] if zstandard is not None else ['gzip'])
+    if encoding == 'zstd':
+        body = zstandard.ZstdCompressor(level=3).compress(body)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=5)
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+def collect_gauges():
+    now = time.time()
+    with sessions_lock:
+        open_sessions = list(sessions.values())
+    pool_stats = browser_pool.stats()
+    executor_stats = session_executor.stats()
+    job_stats = job_store.stats()
+    return [
+        ('selenium_api_sessions', 'Number of open sessions.', [((), len(open_sessions))]),
+        ('selenium_api_session_age_seconds', 'Age of each open session.',
+         [((('session', session.name),), round(now - session.created_at, 3)) for session in open_sessions]),
+        ('selenium_api_session_idle_seconds', 'Time since each open session was last used.',
+         [((('session', session.name),), round(now - session.last_used, 3)) for session in open_sessions]),
+        ('selenium_api_pool_idle_browsers', 'Pre-launched browsers waiting in the pool.', [((), pool_stats['idle'])]),
+        ('selenium_api_pool_hits', 'Sessions served from the browser pool.', [((), pool_stats['hits'])]),
+        ('selenium_api_pool_misses', 'Sessions that found the browser pool empty.', [((), pool_stats['misses'])]),
+        ('selenium_api_busy_sessions', 'Sessions with queued or running commands.', [((), executor_stats['busy_sessions'])]),
+        ('selenium_api_queued_commands', 'Commands waiting in the session queues.', [((), executor_stats['queued_commands'])]),
+        ('selenium_api_jobs', 'Jobs in the job store by state.', [((('state', state),), count) for state, count in job_stats.items()]),
+    ]
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return app.response_class(metrics.render(collect_gauges()), mimetype='text/plain; version=0.0.4')
+
+@app.route('/health', methods=['GET'])
+def health():
+    executor_stats = session_executor.stats()
+    return jsonify({'status': 'success', 'message': 'OK', 'data': {
+        'pid': os.getpid(),
+        'sessions': len(sessions),
+        'busy_sessions': executor_stats['busy_sessions'],
+        'queued_commands': executor_stats['queued_commands'],
+        'idle_browsers': browser_pool.stats()['idle'],
+    }}), 200
+
+class Worker:
+    """A server process started by the supervisor on an internal port."""
+
+    def __init__(self, index, port, arguments):
+        self.index = index
+        self.port = port
+        self.arguments = arguments
+        self.url = f'http://127.0.0.1:{port}'
+        self.process = None
+        self.restarts = 0
+
+    def start(self):
+        command = [sys.executable, os.path.abspath(__file__), *self.arguments, '--port', str(self.port), '--worker-index', str(self.index)]
+        self.process = subprocess.Popen(command)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if not self.is_alive():
+            return
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+class Supervisor:
+    """Starts the worker processes of ``--workers`` and restarts them when they exit.
+
+    Every worker is a complete server that owns the sessions hashed to it. A
+    restarted worker comes back without sessions, like a restarted server,
+    unless ``--restore-snapshots`` restores them from their snapshots.
+    """
+
+    def __init__(self, count, base_port, arguments, check_interval=2):
+        self.workers = [Worker(index, base_port + index, [*arguments, '--worker-count', str(count)]) for index in range(count)]
+        self.check_interval = check_interval
+        self.stopped = threading.Event()
+        self.http = requests.Session()
+        self.http.mount('http://', requests.adapters.HTTPAdapter(pool_connections=count, pool_maxsize=max_request_concurrency))
+
+    def start(self, ready_timeout=60):
+        for worker in self.workers:
+            worker.start()
+        deadline = time.monotonic() + ready_timeout
+        for worker in self.workers:
+            while not self.is_healthy(worker):
+                if not worker.is_alive() or time.monotonic() > deadline:
+                    raise RuntimeError(f"Worker {worker.index} did not start")
+                time.sleep(0.2)
+        threading.Thread(target=self.run, name="supervisor", daemon=True).start()
+
+    def is_healthy(self, worker):
+        try:
+            return self.http.get(worker.url + '/health', timeout=2).status_code == 200
+        except requests.RequestException:
+            return False
+
+    def run(self):
+        while not self.stopped.wait(self.check_interval):
+            for worker in self.workers:
+                if not worker.is_alive() and not self.stopped.is_set():
+                    logger.warning("Worker %d exited with code %s, restarting", worker.index, worker.process.returncode)
+                    worker.restarts += 1
+                    worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        for worker in self.workers:
+            worker.stop()
+
+    def worker_for_session(self, name):
+        return self.workers[zlib.crc32(str(name).encode()) % len(self.workers)]
+
+    def worker_for_job(self, job_id):
+        index = job_id.split('-', 1)[0]
+        if not index.isdigit() or int(index) >= len(self.workers):
+            return None
+        return self.workers[int(index)]
+
+def worker_arguments(argv):
+    """The command line of the supervisor without the options it handles itself."""
+    arguments = []
+    skip = False
+    for argument in argv:
+        if skip:
+            skip = False
+        elif argument in ('--workers', '--port', '--worker-port-base'):
+            skip = True
+        elif not argument.startswith(('--workers=', '--port=', '--worker-port-base=')):
+            arguments.append(argument)
+    return arguments
+
+router = Flask('selenium_api_router')
+supervisor = None
+
+# Headers passed from the client to a worker and back.
+forwarded_request_headers = ('Content-Type', 'Accept', 'Accept-Encoding', 'Last-Event-ID')
+forwarded_response_headers = ('Content-Type', 'Content-Encoding', 'Cache-Control', 'Vary', 'ETag', 'X-Accel-Buffering', 'Server-Timing')
+
+def forward(worker, stream=False):
+    """Send the current request to a worker and relay its response unchanged."""
+    headers = {name: request.headers[name] for name in forwarded_request_headers if name in request.headers}
+    try:
+        response = supervisor.http.request(request.method, worker.url + request.full_path.rstrip('?'), data=request.get_data(),
+                                           headers=headers, stream=True, timeout=None if stream else 3600)
+    except requests.RequestException as e:
+        return jsonify({'status': 'error', 'message': f'Worker {worker.index} is unavailable: {str(e)}'}), 502
+    headers = {name: response.headers[name] for name in forwarded_response_headers if name in response.headers}
+    if stream:
+        return router.response_class(response.raw.stream(8192, decode_content=False), status=response.status_code, headers=headers)
+    body = response.raw.read(decode_content=False)
+    response.close()
+    return router.response_class(body, status=response.status_code, headers=headers)
+
+def fan_out(method, path, **kwargs):
+    """Send a request to every worker in parallel and return the decoded JSON bodies.
+
+    A worker that cannot be reached or answers with an error yields None.
+    """
+    def call(worker):
+        try:
+            response = supervisor.http.request(method, worker.url + path, timeout=30, **kwargs)
+            return response.json()
+        except (requests.RequestException, ValueError):
+            return None
+    with ThreadPoolExecutor(max_workers=len(supervisor.workers)) as executor:
+        return list(executor.map(call, supervisor.workers))
+
+def merge_pool_stats(worker_stats):
+    merged = {}
+    for stats in worker_stats:
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                merged[key] = merged.get(key, False) or value
+            elif isinstance(value, (int, float)) and key != 'hit_rate':
+                merged[key] = merged.get(key, 0) + value
+    requests_total = merged.get('hits', 0) + merged.get('misses', 0)
+    merged['hit_rate'] = merged['hits'] / requests_total if requests_total else None
+    return merged
+
+def session_params():
+    """The session a request to the router is for."""
+    body = request.get_json(silent=True) if request.method != 'GET' else None
+    if isinstance(body, dict):
+        params = body.get('params')
+        if isinstance(params, dict) and 'session' in params:
+            return params['session']
+        return body.get('session', 'default')
+    return request.args.get('session', 'default')
+
+@router.route('/execute', methods=['POST'])
+def route_execute():
+    body = request.get_json(silent=True)
+    action = body.get('action') if isinstance(body, dict) else None
+    if action == 'list_sessions':
+        listed = []
+        for index, response in enumerate(fan_out('POST', '/execute', json=body)):
+            for session in (response or {}).get('data') or []:
+                listed.append({**session, 'worker': index})
+        return jsonify({'status': 'success', 'message': f'{len(listed)} sessions open', 'data': listed}), 200
+    if action == 'get_pool_stats':
+        worker_stats = [(response or {}).get('data') or {} for response in fan_out('POST', '/execute', json=body)]
+        data = merge_pool_stats(worker_stats)
+        data['workers'] = worker_stats
+        return jsonify({'status': 'success', 'message': 'Browser pool statistics', 'data': data}), 200
+    return forward(supervisor.worker_for_session(session_params()))
+
+@router.route('/execute_batch', methods=['POST'])
+@router.route('/screenshot', methods=['GET', 'POST'])
+def route_session_request():
+    return forward(supervisor.worker_for_session(session_params()))
+
+@router.route('/screencast', methods=['GET', 'POST'])
+def route_screencast():
+    return forward(supervisor.worker_for_session(session_params()), stream=True)
+
+@router.route('/scrape', methods=['POST'])
+def route_scrape():
+    return forward(supervisor.worker_for_session(session_params()), stream=True)
+
+@router.route('/jobs', methods=['POST'])
+def route_submit_job():
+    return forward(supervisor.worker_for_session(session_params()))
+
+@router.route('/jobs', methods=['GET'])
+def route_list_jobs():
+    listed = []
+    for response in fan_out('GET', '/jobs', params=request.args):
+        listed.extend((response or {}).get('data') or [])
+    return jsonify({'status': 'success', 'message': f'{len(listed)} jobs', 'data': listed}), 200
+
+@router.route('/jobs/<job_id>', methods=['GET', 'DELETE'])
+def route_job(job_id):
+    worker = supervisor.worker_for_job(job_id)
+    if worker is None:
+        return jsonify({'status': 'error', 'message': f'Job {job_id} not found'}), 404
+    return forward(worker)
+
+@router.route('/jobs/events', methods=['GET'])
+def route_job_events():
+    """Merge the event streams of all workers into one.
+
+    The id of a merged event lists the last sequence number of every worker,
+    so a client reconnecting with Last-Event-ID resumes every worker's stream.
+    """
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('after')
+    positions = [None] * len(supervisor.workers)
+    if last_id:
+        parts = last_id.split('.')
+        if len(parts) != len(positions) or not all(part.isdigit() for part in parts):
+            return jsonify({'status': 'error', 'message': 'Invalid Last-Event-ID'}), 400
+        positions = [int(part) for part in parts]
+    params = {key: value for key, value in request.args.items() if key != 'after'}
+    events = queue.Queue()
+    closed = threading.Event()
+
+    def read(worker, after):
+        query = dict(params)
+        if after is not None:
+            query['after'] = after
+        try:
+            with supervisor.http.get(worker.url + '/jobs/events', params=query, stream=True, timeout=(5, None)) as response:
+                event = {}
+                for line in response.iter_lines(decode_unicode=True):
+                    if closed.is_set():
+                        return
+                    if not line:
+                        if 'data' in event:
+                            events.put((worker.index, event))
+                        event = {}
+                    elif not line.startswith(':'):
+                        field, _, value = line.partition(': ')
+                        event[field] = value
+        except requests.RequestException as e:
+            logger.warning("Event stream of worker %d ended: %s", worker.index, e)
+
+    for worker, after in zip(supervisor.workers, positions):
+        threading.Thread(target=read, args=(worker, after), daemon=True).start()
+
+    def merged():
+        try:
+            yield ': connected\n\n'
+            while True:
+                try:
+                    index, event = events.get(timeout=job_event_keepalive)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                positions[index] = int(event['id'])
+                event_id = '.'.join(str(position or 0) for position in positions)
+                yield f'id: {event_id}\nevent: {event["event"]}\ndata: {event["data"]}\n\n'
+        finally:
+            closed.set()
+
+    return router.response_class(merged(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@router.route('/health', methods=['GET'])
+def route_health():
+    workers = []
+    for worker, response in zip(supervisor.workers, fan_out('GET', '/health')):
+        workers.append({'worker': worker.index, 'port': worker.port, 'alive': worker.is_alive(), 'healthy': response is not None,
+                        'restarts': worker.restarts, **((response or {}).get('data') or {})})
+    healthy = all(worker['healthy'] for worker in workers)
+    return jsonify({'status': 'success' if healthy else 'error', 'message': 'OK' if healthy else 'Some workers are unavailable',
+                    'data': workers}), 200 if healthy else 503
+
+def merge_metrics(worker_texts):
+    """Merge the Prometheus metrics of the workers, adding a worker label to every sample."""
+    families = OrderedDict()
+    for index, text in enumerate(worker_texts):
+        family = None
+        for line in text.splitlines():
+            if line.startswith('# HELP ') or line.startswith('# TYPE '):
+                family = families.setdefault(line.split()[2], {'header': [], 'samples': []})
+                if len(family['header']) < 2:
+                    family['header'].append(line)
+            elif line and family is not None:
+                name, labels, value = re.match(r'([^{ ]+)(?:\{(.*)\})? (.*)', line).groups()
+                labels = f'worker="{index}",{labels}' if labels else f'worker="{index}"'
+                family['samples'].append(f'{name}{{{labels}}} {value}')
+    lines = []
+    for family in families.values():
+        lines += family['header'] + family['samples']
+    return "\n".join(lines) + "\n"
+
+@router.route('/metrics', methods=['GET'])
+def route_metrics():
+    def call(worker):
+        try:
+            return supervisor.http.get(worker.url + '/metrics', timeout=30).text
+        except requests.RequestException:
+            return ''
+    with ThreadPoolExecutor(max_workers=len(supervisor.workers)) as executor:
+        texts = list(executor.map(call, supervisor.workers))
+    return router.response_class(merge_metrics(texts), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="Run the Flask web app.")
     parser.add_argument('--port', type=int, default=5000, help="Port number to use for the web server (default: 5000)")
+    parser.add_argument('--pool-min', type=int, default=0, help="Refill the browser pool when fewer idle browsers are ready (default: 0)")
+    parser.add_argument('--pool-max', type=int, default=0, help="Number of idle browsers the pool refills up to, 0 disables the pool (default: 0)")
+    parser.add_argument('--threads', type=int, default=32, help="Number of threads that run browser commands, commands of one session always run in order (default: 32)")
+    parser.add_argument('--idle-ttl', type=int, default=0, help="Close sessions that have been idle for this many seconds, 0 keeps them open (default: 0)")
+    parser.add_argument('--max-sessions', type=int, default=0, help="Close the least recently used sessions beyond this count, 0 means no limit (default: 0)")
+    parser.add_argument('--memory-budget-mb', type=int, default=0, help="Close the least recently used sessions while their browsers use more memory than this, needs psutil, 0 means no limit (default: 0)")
+    parser.add_argument('--reap-interval', type=int, default=30, help="Seconds between checks for idle sessions and the memory budget (default: 30)")
+    parser.add_argument('--log-level', default='info', choices=['debug', 'info', 'warning', 'error', 'off'], help="Level of the server log, debug also logs every action and selector (default: info)")
+    parser.add_argument('--compress-min-size', type=int, default=1024, help="Compress JSON responses of at least this many bytes with gzip or zstd (default: 1024)")
+    parser.add_argument('--no-compress', action='store_true', help="Never compress responses")
+    parser.add_argument('--cookie-max-age', type=int, default=30, help="Seconds after which send_request reads the browser cookies again even if no action changed them (default: 30)")
+    parser.add_argument('--job-ttl', type=int, default=300, help="Seconds to keep the results of finished jobs (default: 300)")
+    parser.add_argument('--max-jobs', type=int, default=10000, help="Most jobs kept at once, older finished jobs are dropped first (default: 10000)")
+    parser.add_argument('--workers', type=int, default=0, help="Run this many worker processes behind a router that assigns sessions by name (default: 0, a single process)")
+    parser.add_argument('--worker-port-base', type=int, default=None, help="First internal port of the worker processes (default: the next port after --port)")
+    parser.add_argument('--worker-index', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--worker-count', type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--clone-profiles', action='store_true', help="Give sessions with a profile their own copy of the profile unless they ask otherwise with clone_profile")
+    parser.add_argument('--profile-write-back', action='store_true', help="Copy the state of cloned profiles back to the template when their session closes")
+    parser.add_argument('--clone-dir', default=None, help="Directory for profile clones, for example on /dev/shm (default: Data/Clones)")
+    parser.add_argument('--presets', help="JSON file with additional session presets by name")
+    parser.add_argument('--network-capture', action='store_true', help="Launch browsers with the DevTools performance log so sessions can capture their network requests")
+    parser.add_argument('--snapshot-dir', default=None, help="Directory of session snapshots (default: Data/Snapshots)")
+    parser.add_argument('--snapshot-interval', type=int, default=0, help="Snapshot sessions used since their last snapshot this often in seconds, 0 disables it (default: 0)")
+    parser.add_argument('--watchdog-interval', type=int, default=0, help="Check the browsers of all sessions this often in seconds and rebuild dead ones from their last snapshot, 0 disables it (default: 0)")
+    parser.add_argument('--restore-snapshots', action='store_true', help="Restore the sessions of the snapshot directory on startup")
     args = parser.parse_args()
-    app.run(port=args.port)
\ No newline at end of file
+    if args.presets:
+        try:
+            load_presets(args.presets)
+        except (OSError, ValueError) as e:
+            parser.error(f"Could not load the presets: {e}")
+    cookie_max_age = args.cookie_max_age
+    network_capture_enabled = args.network_capture
+    clone_profiles_by_default = args.clone_profiles
+    write_back_by_default = args.profile_write_back
+    if args.clone_dir:
+        clone_dir = args.clone_dir
+    if args.snapshot_dir:
+        snapshot_dir = args.snapshot_dir
+    compression_min_size = None if args.no_compress else args.compress_min_size
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    if args.log_level == 'off':
+        logger.disabled = True
+    else:
+        logger.setLevel(args.log_level.upper())
+    if args.workers > 0:
+        supervisor = Supervisor(args.workers, args.worker_port_base or args.port + 1, worker_arguments(sys.argv[1:]))
+        # Quit the workers on SIGTERM as well, not only on Ctrl+C.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+        atexit.register(supervisor.stop)
+        supervisor.start()
+        router.run(port=args.port, threaded=True)
+        sys.exit(0)
+    remove_stale_clones()
+    session_executor = SessionExecutor(args.threads)
+    session_reaper = SessionReaper(args.idle_ttl, args.max_sessions, args.memory_budget_mb * 1024 * 1024, args.reap_interval)
+    job_store = JobStore(args.job_ttl, args.max_jobs, prefix='' if args.worker_index is None else f'{args.worker_index}-')
+    session_reaper.start()
+    browser_pool = BrowserPool(args.pool_min, args.pool_max)
+    browser_pool.start()
+    atexit.register(browser_pool.stop)
+    session_watchdog = SessionWatchdog(args.watchdog_interval, args.snapshot_interval)
+    session_watchdog.start()
+    if args.restore_snapshots:
+        restore_saved_sessions(args.worker_index, args.worker_count)
+    app.run(port=args.port, threaded=True)
\ No newline at end of file
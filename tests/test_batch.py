@@ -0,0 +1,60 @@
+import pytest
+
+import server
+from benchmarks.fake_driver import FakeDriver
+
+
+outputs = {
+    '0': {'status': 'success', 'message': 'Counted', 'data': 3},
+    'items': {'status': 'success', 'message': 'Extracted', 'data': ['a', 'b', 'c']},
+}
+
+
+def test_single_reference_keeps_its_type():
+    assert server.resolve_step_params({'count': '${0}', 'items': '${items.data}'}, outputs) == {'count': 3, 'items': ['a', 'b', 'c']}
+
+
+def test_embedded_references_are_substituted_as_text():
+    params = {'css_selector': 'li::${0}', 'text': '${items.data.1} of ${0.message}', 'nested': ['x${items.data.-1}']}
+    assert server.resolve_step_params(params, outputs) == {'css_selector': 'li::3', 'text': 'b of Counted', 'nested': ['xc']}
+
+
+def test_escaped_reference_is_left_as_text():
+    assert server.resolve_step_params({'text': '$${0} costs ${0}', 'whole': '$${0}'}, outputs) == {'text': '${0} costs 3', 'whole': '${0}'}
+
+
+def test_scripts_are_not_substituted():
+    params = {'js': 'return `${1+1}`;', 'css_selector': '#n${0}'}
+    assert server.resolve_step_params(params, outputs) == {'js': 'return `${1+1}`;', 'css_selector': '#n3'}
+
+
+@pytest.mark.parametrize('reference', ['${1}', '${missing.data}', '${items.data.7}', '${0.data.key}', '${}'])
+def test_unknown_references_raise_key_error(reference):
+    with pytest.raises(KeyError):
+        server.resolve_step_params({'value': reference}, outputs)
+
+
+def test_batch_reports_an_invalid_reference():
+    response, status = server.run_batch('default', 'default', [{'action': 'navigate', 'params': {'url': '${3}'}}])
+    assert status == 400
+    assert response['message'] == 'Step 0 (navigate) failed: Invalid step reference 3'
+
+
+def test_documented_batch_example(monkeypatch):
+    pages = {'https://example.com': '<html><body><ul><li class="item" data-id="17"><a href="/17">a</a></li>'
+                                     '<li class="item" data-id="18"><a href="/18">b</a></li></ul></body></html>',
+             'https://example.com/17': '<html><body><p>17</p></body></html>'}
+    monkeypatch.setattr(server, 'launch_driver', lambda profile='', arguments=(), user_data_dir=None: server.instrument_driver(FakeDriver(pages.get)))
+    steps = [
+        {'action': 'navigate', 'params': {'url': 'https://example.com'}},
+        {'action': 'wait_for_element', 'params': {'css_selector': 'li.item'}},
+        {'id': 'first', 'action': 'get_element_attribute', 'params': {'css_selector': 'li.item', 'attribute': 'data-id'}},
+        {'action': 'click_element', 'params': {'css_selector': 'li.item[data-id="${first}"] a'}},
+    ]
+    try:
+        response, status = server.run_batch('batch-example', 'default', steps)
+        assert (status, response['message']) == (200, 'Executed 4 steps')
+        assert response['data'][3]['message'] == 'Clicked element with selector li.item[data-id="17"] a'
+        assert server.sessions['batch-example'].driver.current_url == 'https://example.com/17'
+    finally:
+        server.close_session('batch-example')
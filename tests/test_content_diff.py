@@ -0,0 +1,58 @@
+import copy
+
+import pytest
+
+import server
+from benchmarks.fake_driver import Node, container_tree
+
+
+def container(html):
+    node = Node('div')
+    node.set_inner_html(html)
+    return node
+
+
+def node_at(root, path):
+    for index in path:
+        root = root.children[index]
+    return root
+
+
+def apply_splices(old, new, splices):
+    """Apply the splices to a copy of ``old``, taking the inserted nodes from ``new``."""
+    patched = copy.deepcopy(old)
+    for splice in splices:
+        parent = node_at(patched, splice['path'])
+        nodes = [copy.deepcopy(node_at(new, path)) for path, _ in splice['nodes']]
+        for node in nodes:
+            node.parent = parent
+        parent.children[splice['start']:splice['end']] = nodes
+    return patched
+
+
+@pytest.mark.parametrize('old_html, new_html', [
+    ('<p>a</p><p>b</p>', '<p>a</p><p>b</p>'),
+    ('<p>a</p><p>b</p>', '<p>a</p><p>x</p><p>b</p>'),
+    ('<p>a</p><p>b</p><p>c</p>', '<p>a</p><p>c</p>'),
+    ('<ul><li>1</li><li>2</li></ul><p>end</p>', '<ul><li>1</li><li>two</li><li>3</li></ul><p>end</p>'),
+    ('<div class="a"><span>x</span></div>', '<div class="b"><span>x</span></div>'),
+    ('<section><div><p>deep</p></div></section>', '<section><div><p>deeper</p></div></section>'),
+    ('text <b>bold</b>', 'other <b>bold</b> tail'),
+    ('', '<p>new</p>'),
+    ('<p>a</p><p>b</p>', ''),
+])
+@pytest.mark.parametrize('depth', [1, 3])
+def test_splices_turn_the_old_version_into_the_new(old_html, new_html, depth):
+    old, new = container(old_html), container(new_html)
+    splices = server.diff_content_trees(container_tree(old, depth), container_tree(new, depth))
+    assert apply_splices(old, new, splices).inner_html() == new.inner_html()
+    if old_html == new_html:
+        assert splices == []
+
+
+def test_only_the_changed_subtree_is_sent():
+    old = container('<ul><li>1</li><li>2</li><li>3</li></ul><p>end</p>')
+    new = container('<ul><li>1</li><li>two</li><li>3</li></ul><p>end</p>')
+    splices = server.diff_content_trees(container_tree(old, 3), container_tree(new, 3))
+    assert [(splice['path'], splice['start'], splice['end'], [path for path, _ in splice['nodes']]) for splice in splices] == [
+        ([0, 1], 0, 1, [[0, 1, 0]])]
@@ -0,0 +1,40 @@
+import pytest
+
+import server
+from benchmarks.fake_driver import FakeDriver
+
+
+pages = {
+    'http://fixtures.local/a': '<html><body><input class="field"><a id="next" href="/b">next</a></body></html>',
+    'http://fixtures.local/b': '<html><body><input class="field"></body></html>',
+}
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(server, 'launch_driver', lambda profile='', arguments=(), user_data_dir=None: server.instrument_driver(FakeDriver(pages.get)))
+    response, status = server.run_action('navigate', {'session': 'handles-test', 'url': 'http://fixtures.local/a'})
+    assert status == 200
+    yield server.sessions['handles-test']
+    server.close_session('handles-test')
+
+
+def run(action, **params):
+    return server.run_action(action, dict(params, session='handles-test'))
+
+
+def test_handle_is_found_again_in_the_same_document(session):
+    handle = run('get_element_info', css_selector='input.field', return_handle=True)[0]['data']['handle']
+    session.forget_elements()
+    assert run('set_input_value', handle=handle, value='x')[1] == 200
+    assert run('get_input_value', handle=handle)[0]['data'] == 'x'
+
+
+def test_handle_expires_when_the_page_is_replaced(session):
+    handle = run('get_all_matching_elements_info', css_selector='input.field', return_handle=True)[0]['data'][0]['handle']
+    assert run('click_element', css_selector='#next')[1] == 200
+    assert session.driver.current_url == 'http://fixtures.local/b'
+    response, status = run('set_input_value', handle=handle, value='y')
+    assert status == 410
+    assert 'expired' in response['message']
+    assert run('get_input_value', css_selector='input.field')[0]['data'] == ''
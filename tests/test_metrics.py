@@ -0,0 +1,32 @@
+import json
+import re
+
+import server
+
+
+def test_known_actions_cover_perform_action():
+    with open(server.__file__) as f:
+        source = f.read()
+    body = source[source.index('def perform_action'):source.index('def json_response')]
+    assert set(re.findall(r"action == '(\w+)'", body)) <= server.known_actions
+
+
+def test_unknown_actions_get_a_fixed_label(monkeypatch):
+    def launch_driver(*args, **kwargs):
+        raise AssertionError('An unknown action launched a browser')
+    monkeypatch.setattr(server, 'launch_driver', launch_driver)
+    for action, params in (('drop_table_<x>', {}), ('drop_table_<y>', ['not', 'a', 'dict']), (['navigate'], {})):
+        assert server.run_action(action, params) == ({'status': 'error', 'message': 'Invalid action'}, 400)
+    rendered = server.metrics.render()
+    assert 'selenium_api_requests_total{action="unknown",status="400"}' in rendered
+    assert 'drop_table' not in rendered
+    assert 'action="unknown"' in rendered
+
+
+def test_json_response_reports_the_serialization_time():
+    response = {'status': 'success', 'message': 'ok', 'data': [1, 2], 'timing': {'total_ms': 1.0}}
+    with server.app.app_context():
+        serialized, status = server.json_response(dict(response), 200)
+    assert status == 200
+    assert json.loads(serialized.get_data()) == response
+    assert re.fullmatch(r'serialization;dur=\d+\.\d{3}', serialized.headers['Server-Timing'])
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+import server
+
+
+def entry(method, **params):
+    return {'message': json.dumps({'message': {'method': method, 'params': params}})}
+
+
+def request(request_id, url, method='GET', timestamp=1.0, **extra):
+    return entry('Network.requestWillBeSent', requestId=request_id, type=extra.pop('type', 'XHR'), timestamp=timestamp,
+                 wallTime=0.0, request={'url': url, 'method': method, 'headers': {}}, **extra)
+
+
+def response(request_id, status=200):
+    return entry('Network.responseReceived', requestId=request_id, response={'status': status, 'mimeType': 'application/json'})
+
+
+def finished(request_id, timestamp=1.5):
+    return entry('Network.loadingFinished', requestId=request_id, timestamp=timestamp, encodedDataLength=10)
+
+
+class BodyDriver:
+    def __init__(self, bodies):
+        self.bodies = bodies
+        self.logs = 0
+
+    def execute_cdp_cmd(self, cmd, params):
+        assert cmd == 'Network.getResponseBody'
+        return {'body': self.bodies[params['requestId']], 'base64Encoded': False}
+
+    def get_log(self, kind):
+        self.logs += 1
+        return [request('9', 'https://example.com/late'), finished('9')]
+
+
+def test_requests_are_recorded_with_their_bodies():
+    capture = server.NetworkCapture(['*/api/*'], max_body_size=5)
+    driver = BodyDriver({'1': '{"a":1}', '2': 'ok'})
+    capture.process(driver, [request('1', 'https://example.com/api/big'), request('2', 'https://example.com/api/small', 'POST'),
+                             request('3', 'https://example.com/page'), response('1'), response('2', 201), response('3'),
+                             finished('1'), finished('2'), finished('3', 2.0), entry('Network.loadingFinished', requestId='4'),
+                             {'message': 'not json'}])
+    records = capture.select(lambda record: True)
+    assert [record['url'] for record in records] == ['https://example.com/api/big', 'https://example.com/api/small', 'https://example.com/page']
+    assert records[0]['body_error'] == 'Body larger than 5 bytes'
+    assert (records[1]['status'], records[1]['body']) == (201, 'ok')
+    assert 'body' not in records[2] and records[2]['duration_ms'] == 1000.0
+    assert [record['seq'] for record in records] == [1, 2, 3]
+
+
+def test_redirects_finish_the_earlier_request():
+    capture = server.NetworkCapture()
+    capture.process(None, [request('1', 'http://example.com/'),
+                           request('1', 'https://example.com/', timestamp=1.2, redirectResponse={'status': 301}),
+                           response('1'), finished('1')])
+    assert [(record['url'], record['status']) for record in capture.select(lambda record: True)] == [
+        ('http://example.com/', 301), ('https://example.com/', 200)]
+
+
+def test_oldest_records_are_dropped_past_max_bytes():
+    capture = server.NetworkCapture(max_bytes=1000)
+    for n in range(10):
+        capture.process(None, [request(str(n), f'https://example.com/{n}'), finished(str(n))])
+    assert capture.size <= 1000
+    assert capture.dropped == 10 - len(capture.records)
+    assert capture.select(lambda record: True)[-1]['url'] == 'https://example.com/9'
+
+
+def test_drained_records_leave_the_buffer():
+    capture = server.NetworkCapture()
+    for n in range(5):
+        capture.process(None, [request(str(n), f'https://example.com/{n}'), finished(str(n))])
+    assert [record['seq'] for record in capture.select(lambda record: record['seq'] % 2, limit=2, remove=True)] == [1, 3]
+    assert [record['seq'] for record in capture.select(lambda record: True)] == [2, 4, 5]
+    assert capture.stats()['records'] == 3
+
+
+def test_network_filter():
+    records = [{'url': 'https://example.com/api/items', 'method': 'GET', 'status': 200, 'type': 'XHR', 'seq': 1},
+               {'url': 'https://example.com/api/items', 'method': 'POST', 'status': 201, 'type': 'Fetch', 'seq': 2},
+               {'url': 'https://example.com/logo.png', 'method': 'GET', 'status': 404, 'type': 'Image', 'seq': 3}]
+
+    def seqs(**params):
+        matches = server.network_filter(params)
+        return [record['seq'] for record in records if matches(record)]
+
+    assert seqs() == [1, 2, 3]
+    assert seqs(url='/api/') == [1, 2]
+    assert seqs(method='post') == [2]
+    assert seqs(status=[200, 404]) == [1, 3]
+    assert seqs(type='image') == [3]
+    assert seqs(url='items', after=1) == [2]
+
+
+@pytest.mark.parametrize('params, message', [
+    ({'url': '('}, 'Invalid url pattern'),
+    ({'status': '200'}, 'Status must be an integer'),
+    ({'after': 'last'}, 'after must be an integer'),
+])
+def test_invalid_network_filters_are_rejected(params, message):
+    with pytest.raises(ValueError, match=message):
+        server.network_filter(params)
+
+
+def test_log_is_only_read_often_while_capturing(monkeypatch):
+    monkeypatch.setattr(server, 'network_capture_enabled', True)
+    driver = BodyDriver({})
+    session = server.BrowserSession('network-test', driver)
+    server.collect_network(driver, session)
+    assert driver.logs == 0
+    session.network_log_read_at -= server.network_discard_interval
+    server.collect_network(driver, session)
+    assert driver.logs == 1
+    session.network = server.NetworkCapture()
+    server.collect_network(driver, session)
+    server.collect_network(driver, session)
+    assert driver.logs == 3
+    assert session.network.stats()['records'] == 2
@@ -0,0 +1,26 @@
+import os
+
+import server
+
+
+def write_file(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def read_file(path):
+    with open(path) as f:
+        return f.read()
+
+
+def test_profile_is_written_back_twice(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'app_path', str(tmp_path))
+    template = server.profile_path('writeback')
+    for run in ('first', 'second'):
+        clone = tmp_path / f'clone-{run}'
+        write_file(str(clone / 'Default' / 'Preferences'), run)
+        server.write_back_profile('writeback', str(clone))
+        assert read_file(os.path.join(template, 'Default', 'Preferences')) == run
+        # A previous copy left behind, as by a crash between the two renames.
+        write_file(f'{template}.previous-{os.getpid()}/Default/Preferences', 'stale')
@@ -0,0 +1,75 @@
+import pytest
+
+import server
+from benchmarks import fixtures
+from benchmarks.fake_driver import FakeDriver
+
+
+schema = {'rows': 'li.item', 'fields': {'id': {'extract': 'attribute', 'attribute': 'data-id'}, 'name': 'a.link'}}
+
+
+@pytest.fixture
+def driver(monkeypatch):
+    monkeypatch.setattr(server, 'launch_driver', lambda profile='', arguments=(), user_data_dir=None: server.instrument_driver(FakeDriver(fixtures.render)))
+    yield server.get_session('scrape-test')
+    server.close_session('scrape-test')
+
+
+@pytest.mark.parametrize('bad, message', [
+    ({'fields': {'a': 'b'}}, 'Schema needs a rows selector'),
+    ({'rows': 'li'}, 'Schema needs at least one field'),
+    ({'rows': 'li', 'fields': {'a': 3}}, 'Field a must be a selector or an object'),
+    ({'rows': 'li', 'fields': {'a': {'extract': 'value'}}}, 'Unknown extractor value for field a'),
+    ({'rows': 'li', 'fields': {'a': {'extract': 'attribute'}}}, 'Field a needs an attribute'),
+])
+def test_invalid_schemas_are_rejected(bad, message):
+    with pytest.raises(ValueError, match=message):
+        server.ScrapeSchema(bad)
+
+
+def test_pagination_defaults():
+    assert server.scrape_pagination(None) == {'type': None, 'max_pages': 1}
+    assert server.scrape_pagination({'type': 'scroll'}) == {'type': 'scroll', 'max_pages': 10, 'timeout': 10.0, 'idle_time': 2000.0}
+
+
+@pytest.mark.parametrize('bad, message', [
+    ({'type': 'pages'}, 'Pagination needs a type'),
+    ({'type': 'next'}, 'needs a selector'),
+    ({'type': 'url', 'template': '/list'}, 'needs a template with {page}'),
+    ({'type': 'scroll', 'max_pages': 0}, 'max_pages must be an integer'),
+    ({'type': 'scroll', 'idle_time': 'long'}, 'timeout and idle_time must be numbers'),
+])
+def test_invalid_pagination_is_rejected(bad, message):
+    with pytest.raises(ValueError, match=message):
+        server.scrape_pagination(bad)
+
+
+@pytest.mark.parametrize('more', ['0', '1'])
+def test_next_pagination_reads_every_row_once(driver, more):
+    # With more=1 the rows of earlier pages stay on the page, like with a load more button.
+    driver.get(f'http://fixtures.local/list?items=5&pages=3&more={more}')
+    session = server.sessions['scrape-test']
+    records = []
+    pages, count, stop_reason = server.scrape_pages(driver, session, server.ScrapeSchema(schema),
+                                                    server.scrape_pagination({'type': 'next', 'selector': '#next'}), sink=records.extend)
+    assert (pages, count, stop_reason) == (3, 15, 'last_page')
+    assert [record['id'] for record in records] == [str(i) for i in range(15)]
+
+
+def test_max_records_stops_the_scrape(driver):
+    driver.get('http://fixtures.local/list?items=5&pages=3')
+    pages, count, stop_reason = server.scrape_pages(driver, server.sessions['scrape-test'], server.ScrapeSchema(schema),
+                                                    server.scrape_pagination({'type': 'next', 'selector': '#next'}), max_records=7)
+    assert (pages, count, stop_reason) == (2, 7, 'max_records')
+
+
+def test_descendant_and_quoted_selectors():
+    page = ('<html><body><table class="results"><tr><td><a title="x y" href="/1">one</a></td></tr></table>'
+            '<table class="results"><tr><td><a title="x" href="/2">two</a></td></tr>'
+            '<tr><td><a title="x y" href="/3">three</a></td></tr></table></body></html>')
+    driver = FakeDriver(lambda url: page)
+    driver.get('http://fixtures.local/')
+    schema = server.ScrapeSchema({'rows': 'table.results tr', 'fields': {
+        'link': {'selector': 'td a[title="x y"]', 'extract': 'attribute', 'attribute': 'href'}}})
+    assert schema.rows.steps == [['css', 'table.results tr']]
+    assert schema.extract(driver) == (3, [{'link': '/1'}, {'link': None}, {'link': '/3'}])
@@ -0,0 +1,39 @@
+import pytest
+
+import server
+from benchmarks.fake_driver import FakeDriver
+
+
+page = ('<html><body><ul id="first"><li>a</li></ul><ul id="second"><li>b</li><li>c</li></ul>'
+        '<a title="foo bar" href="/1">one</a><a title="foo" href="/2">two</a></body></html>')
+
+
+@pytest.fixture
+def driver():
+    driver = FakeDriver(lambda url: page)
+    driver.get('http://fixtures.local/')
+    return driver
+
+
+@pytest.mark.parametrize('selector, steps', [
+    ('ul li', [['css', 'ul li']]),
+    ('a[title="foo bar"]', [['css', 'a[title="foo bar"]']]),
+    (' ul > li ', [['css', 'ul > li']]),
+    ('', []),
+    ('ul li::1', [['css', 'ul'], ['css', 'li'], ['index', 1]]),
+    ('li::parent::visible', [['css', 'li'], ['parent'], ['visible']]),
+])
+def test_compile_selector(selector, steps):
+    assert server.compile_selector(selector).steps == steps
+
+
+def test_descendant_selector_matches_in_every_container(driver):
+    total, items = server.extract_elements(driver, 'ul li', ['text'])
+    assert total == len(server.find_elements(driver, 'ul li')) == 3
+    assert [item['text'] for item in items] == ['a', 'b', 'c']
+
+
+def test_quoted_attribute_with_a_space(driver):
+    total, items = server.extract_elements(driver, 'a[title="foo bar"]', ['attributes'])
+    assert total == 1
+    assert items[0]['attributes']['href'] == '/1'
@@ -0,0 +1,46 @@
+import server
+
+
+def test_worker_arguments_drop_the_supervisor_options():
+    argv = ['--workers', '4', '--port=5000', '--threads', '8', '--worker-port-base', '6000', '--workers=2', '--network-capture']
+    assert server.worker_arguments(argv) == ['--threads', '8', '--network-capture']
+
+
+def test_worker_arguments_keep_similar_options():
+    assert server.worker_arguments(['--port-file', 'x', '--workersx']) == ['--port-file', 'x', '--workersx']
+
+
+worker_0 = '''# HELP selenium_api_requests_total Handled actions.
+# TYPE selenium_api_requests_total counter
+selenium_api_requests_total{action="navigate",status="200"} 3.0
+# HELP selenium_api_sessions Open sessions.
+# TYPE selenium_api_sessions gauge
+selenium_api_sessions 2
+'''
+
+worker_1 = '''# HELP selenium_api_sessions Open sessions.
+# TYPE selenium_api_sessions gauge
+selenium_api_sessions 5
+# HELP selenium_api_requests_total Handled actions.
+# TYPE selenium_api_requests_total counter
+selenium_api_requests_total{action="navigate",status="200"} 1.0
+selenium_api_requests_total{action="unknown",status="400"} 1.0
+'''
+
+
+def test_merge_metrics_labels_every_sample_with_its_worker():
+    assert server.merge_metrics([worker_0, worker_1]) == '''# HELP selenium_api_requests_total Handled actions.
+# TYPE selenium_api_requests_total counter
+selenium_api_requests_total{worker="0",action="navigate",status="200"} 3.0
+selenium_api_requests_total{worker="1",action="navigate",status="200"} 1.0
+selenium_api_requests_total{worker="1",action="unknown",status="400"} 1.0
+# HELP selenium_api_sessions Open sessions.
+# TYPE selenium_api_sessions gauge
+selenium_api_sessions{worker="0"} 2
+selenium_api_sessions{worker="1"} 5
+'''
+
+
+def test_merge_metrics_skips_unavailable_workers():
+    assert server.merge_metrics(['', worker_1]).count('worker="1"') == 3
+    assert server.merge_metrics(['', '']) == '\n'
@@ -0,0 +1,27 @@
+import pytest
+from selenium.common.exceptions import TimeoutException
+
+import server
+from benchmarks.fake_driver import FakeDriver
+
+
+page = '<html><body><ul><li>a</li></ul><ul><li>b</li><li class="done">c</li></ul></body></html>'
+
+
+@pytest.fixture
+def driver():
+    driver = FakeDriver(lambda url: page)
+    driver.get('http://fixtures.local/')
+    return driver
+
+
+def test_count_of_a_descendant_selector(driver):
+    session = server.BrowserSession('wait-test', driver)
+    assert server.wait_until(driver, session, 'count', 1, 'ul li', {'count': 3})['count'] == 3
+    with pytest.raises(TimeoutException):
+        server.wait_until(driver, session, 'count', 0.1, 'ul li', {'count': 4})
+
+
+def test_presence_of_a_descendant_selector(driver):
+    session = server.BrowserSession('wait-test', driver)
+    assert server.wait_until(driver, session, 'presence', 1, 'ul li.done')['ok']